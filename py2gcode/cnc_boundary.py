@@ -456,9 +456,77 @@ class MixedSegBoundaryXY(BoundaryBase):
             segListRev = geom_utils.reverseSegList(segList)
             segList.extend(segListRev)
 
-        # ---------------------------------------------------------------------
-        # To Do need to finish MixedSegPath ...
-        # ---------------------------------------------------------------------
+        # Get list of mixed segment paths
+        zPairsList = self.getZPairsList()
+        mixedSegPathList = []
+        for i, zPair in enumerate(zPairsList):
+            z0, z1 = zPair
+            if self.param['closed'] and cutterComp is not None:
+                if i == len(zPairsList)-1:
+                    # On closed paths, when using cutter compensation add 
+                    # stub into next segment so that we don't over cut.
+                    segList.append(self.getStubSeg(segList))
+            mixedSegPath = cnc_path.MixedSegPath(
+                    segList,
+                    closed=False,
+                    plane='xy',
+                    helix=(z0,z1),
+                    ptEquivTol=self.param['ptEquivTol']
+                    )
+            mixedSegPathList.append(mixedSegPath)
+
+        # Get x,y coord of first point
+        firstPath = mixedSegPathList[0]
+        x0, y0 = firstPath.getStartPoint()[:2]
+
+        # Routine begin - move to safe height, then to start x,y and then to start z
+        self.addStartComment()
+        self.addRapidMoveToSafeZ()
+        self.addRapidMoveToPos(x=x0,y=y0,comment='start x,y')
+
+        if cutterComp is not None:
+            # Move back to leadin start along tangent of first segment
+            tx, ty = segList[0].startTangent
+            xLead, yLead = getCutterCompLeadIn((x0,y0),(x0+tx,y0+ty),self.param['toolDiam'])
+            self.addRapidMoveToPos(x=xLead,y=yLead, comment='cutterComp start move')
+
+            # Add cutter compensation
+            compCmd = gcode_cmd.CutterCompensation(cutterComp,diameter=toolDiam)
+            self.listOfCmds.append(compCmd)
+
+            # Return to start 
+            self.addRapidMoveToPos(x=x0,y=y0, comment='cutterComp start move')
+
+        self.addDwell(startDwell)
+        self.addMoveToStartZ()
+
+        # Add cutting paths
+        for i, path in enumerate(mixedSegPathList):
+            self.addComment('MixedSegPath {0}'.format(i))
+            self.listOfCmds.extend(path.listOfCmds)
+
+        # Routine end - move to safe height and post end comment
+        self.addRapidMoveToSafeZ()
+
+        # Cancel cutter compensation
+        self.listOfCmds.append(gcode_cmd.CancelCutterCompensation())
+        # Get move to remove cutter compensation - continue along tangent of last segment 
+        xEnd, yEnd = segList[-1].endPoint
+        tx, ty = segList[-1].endTangent
+        xLead, yLead = getCutterCompLeadIn((xEnd,yEnd),(xEnd-tx,yEnd-ty),self.param['toolDiam'])
+        self.addRapidMoveToPos(x=xLead,y=yLead,comment='cancel cutter comp move')
+        self.addRapidMoveToPos(x=xEnd,y=yEnd,comment='cancel cutter comp move') 
+        self.addEndComment()
+
+    def getStubSeg(self,segList):
+        """
+        Get short stub segment along the start of the first segment in
+        segList. This is used to prevent over cutting on closed paths when
+        using cutter compensation. See LineSegBoundaryXY.getStubPoint.
+        """
+        seg = segList[0]
+        stubLength = min([0.25*seg.length, 0.5*self.param['toolDiam']])
+        return seg.truncate(stubLength)
 
 
 
@@ -583,14 +651,14 @@ if __name__ == '__main__':
         if closed:
             segList = [
                 geom_utils.LineSeg2D((0,0),(5,0)),
-                geom_utils.ArcSeg2D((5,2),2,3.0*math.pi/2.0,math.pi/2.0),
+                geom_utils.ArcSeg2D((5,2),2,3.0*math.pi/2.0,math.pi/2.0,'ccw'),
                 geom_utils.LineSeg2D((5,4),(0,4)),
-                geom_utils.ArcSeg2D((0,2),2,math.pi/2.0, 3.0*math.pi/2.0)
+                geom_utils.ArcSeg2D((0,2),2,math.pi/2.0, 3.0*math.pi/2.0,'ccw')
                 ]
         else:
             segList = [
                 geom_utils.LineSeg2D((0,0),(5,0)),
-                geom_utils.ArcSeg2D((5,2),2,3.0*math.pi/2.0,math.pi/2.0),
+                geom_utils.ArcSeg2D((5,2),2,3.0*math.pi/2.0,math.pi/2.0,'ccw'),
                 geom_utils.LineSeg2D((5,4),(0,4)),
                 ]
 
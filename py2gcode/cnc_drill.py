@@ -111,6 +111,8 @@ class SimpleDrill(DrillBase):
 
 class PeckDrill(DrillBase):
 
+    cycleClass = gcode_cmd.PeckDrillCycle
+
     def __init__(self,param):
         super(PeckDrill,self).__init__(param)
 
@@ -131,12 +133,123 @@ class PeckDrill(DrillBase):
         self.addRapidMoveToPos(x=cx,y=cy,comment='drill x,y')
         self.addDwell(startDwell)
         self.addMoveToStartZ()
-        drillCmd = gcode_cmd.PeckDrillCycle(x=cx,y=cy,z=stopZ,r=startZ,q=stepZ)
+        drillCmd = self.cycleClass(x=cx,y=cy,z=stopZ,r=startZ,q=stepZ)
         self.listOfCmds.append(drillCmd)
         self.addRapidMoveToSafeZ()
         self.addEndComment()
 
 
+class HighSpeedPeckDrill(PeckDrill):
+    """
+    Peck drill with the chip breaking G73 cycle, which only retracts a small
+    distance between pecks.
+    """
+
+    cycleClass = gcode_cmd.HighSpeedPeckDrillCycle
+
+    def __init__(self,param):
+        super(HighSpeedPeckDrill,self).__init__(param)
+
+
+class BatchDrillBase(DrillBase):
+    """
+    Drills a batch of holes with a single modal canned cycle (cycleClass). The
+    cycle is issued for the first hole only and the remaining holes are given
+    by x,y words. The cycle retracts to the r-plane (startZ) between holes.
+
+    param:
+      pointList  = list of (x,y) hole centers
+      startZ     = feed start/retract z position
+      stopZ      = drill z position (final)
+      safeZ      = safe z position before and after the batch
+      startDwell = (optional) dwell time before the first hole
+      holeDwell  = (optional) dwell time at the bottom of each hole (G82)
+    """
+
+    cycleClass = gcode_cmd.DrillCycle
+
+    def __init__(self,param):
+        super(BatchDrillBase,self).__init__(param)
+
+    def makeListOfCmds(self):
+        self.listOfCmds = []
+        pointList = [(float(p[0]), float(p[1])) for p in self.param['pointList']]
+        startZ = float(self.param['startZ'])
+        stopZ = float(self.param['stopZ'])
+        try:
+            startDwell = self.param['startDwell']
+        except KeyError:
+            startDwell = 0.0
+
+        self.addStartComment()
+        if pointList:
+            cx, cy = pointList[0]
+            self.addRapidMoveToSafeZ()
+            self.addRapidMoveToPos(x=cx,y=cy,comment='drill x,y')
+            self.addDwell(startDwell)
+            self.addMoveToStartZ()
+            self.addComment('{0} holes'.format(len(pointList)))
+            self.listOfCmds.append(gcode_cmd.CannedCycleReturnMode('r-word'))
+            self.listOfCmds.append(self.getDrillCmd(cx,cy,stopZ,startZ))
+            for cx, cy in pointList[1:]:
+                self.listOfCmds.append(gcode_cmd.ModalMotion(x=cx,y=cy))
+            self.listOfCmds.append(gcode_cmd.CancelCannedCycle())
+            self.listOfCmds.append(gcode_cmd.CannedCycleReturnMode('prior'))
+            self.addRapidMoveToSafeZ()
+        self.addEndComment()
+
+    def addStartComment(self):
+        # Add start comment w/ the number of points instead of the point list
+        self.listOfCmds = []
+        self.listOfCmds.append(gcode_cmd.Space())
+        commentStr = 'Begin {0}'.format(self.__class__.__name__)
+        self.listOfCmds.append(gcode_cmd.Comment(commentStr))
+        self.listOfCmds.append(gcode_cmd.Comment('-'*60))
+        for k,v in self.param.iteritems():
+            if k == 'pointList':
+                v = '{0} points'.format(len(v))
+            self.listOfCmds.append(gcode_cmd.Comment('{0}: {1}'.format(k,v)))
+
+    def getDrillCmd(self,cx,cy,stopZ,startZ):
+        holeDwell = self.param.get('holeDwell')
+        return self.cycleClass(x=cx,y=cy,z=stopZ,r=startZ,p=holeDwell)
+
+
+class BatchDrill(BatchDrillBase):
+
+    cycleClass = gcode_cmd.DrillCycle
+
+    def __init__(self,param):
+        super(BatchDrill,self).__init__(param)
+
+
+class BatchPeckDrill(BatchDrillBase):
+    """
+    Batch version of PeckDrill - additional param stepZ is the peck increment.
+    """
+
+    cycleClass = gcode_cmd.PeckDrillCycle
+
+    def __init__(self,param):
+        super(BatchPeckDrill,self).__init__(param)
+
+    def getDrillCmd(self,cx,cy,stopZ,startZ):
+        stepZ =  float(self.param['stepZ'])
+        assert stepZ>=0,'stepZ must be >= 0'
+        return self.cycleClass(x=cx,y=cy,z=stopZ,r=startZ,q=stepZ)
+
+
+class BatchHighSpeedPeckDrill(BatchPeckDrill):
+    """
+    Batch version of HighSpeedPeckDrill.
+    """
+
+    cycleClass = gcode_cmd.HighSpeedPeckDrillCycle
+
+    def __init__(self,param):
+        super(BatchHighSpeedPeckDrill,self).__init__(param)
+
+
 # -----------------------------------------------------------------------------
 if __name__ == '__main__':
 
@@ -171,6 +284,18 @@ if __name__ == '__main__':
 
         drill = PeckDrill(param)
 
+    if 0:
+        param = {
+                'pointList': [(0.5,0.2), (1.0,0.2), (1.0,0.7), (0.5,0.7)],
+                'startZ': 0.02,
+                'stopZ' : -0.5,
+                'safeZ' : 0.5,
+                'stepZ' : 0.05,
+                'startDwell' : 2.0,
+                }
+
+        drill = BatchPeckDrill(param)
+
 
     prog.add(drill)
     prog.add(gcode_cmd.Space())
@@ -18,10 +18,16 @@ limitations under the License.
 from __future__ import print_function
 import math
 import gcode_cmd
+import geom_utils
+import gcode_optimize
 import cnc_drill
 import cnc_pocket
 import cnc_boundary
 import dxfgrabber
+import dxf_cache
+import progress_utils
+import parallel_utils
+import order_utils
 import networkx
 import numpy
 import shapely.geometry.polygon as polygon
@@ -29,7 +35,16 @@ import matplotlib.pyplot as plt
 
 from geom_utils import dist2D
 from graph_utils import getEntityGraph
+from graph_utils import getCutTaskList
+from graph_utils import getOrderedCutTaskList
+from graph_utils import getClosedLoopPath
+from graph_utils import getLineStringPath
+from graph_utils import getNodePathPointArrayList
+from graph_utils import getNodePathSegList
 from dxf_utils import getEntityStartAndEndPts
+from dxf_utils import getEntityIndex
+from dxf_utils import getDxfArcPointArray
+from dxf_utils import getArcTessellation
 
 class DxfBase(gcode_cmd.GCodeProg):
 
@@ -39,26 +54,27 @@ class DxfBase(gcode_cmd.GCodeProg):
     def __init__(self,param):
         self.param = dict(self.DEFAULT_PARAM)
         self.param.update(param)
-        try:
-            self.dwg = self.param['dwg']
-        except KeyError:
-            self.dwg = dxfgrabber.readfile(self.param['fileName'])
+        self.progress = progress_utils.popProgress(self.param)
+        self.workers = parallel_utils.popWorkers(self.param)
+        self.dwg = dxf_cache.getDrawing(self.param)
         self.makeListOfCmds()
 
+    @property
+    def entityIndex(self):
+        return getEntityIndex(self.dwg)
+
     @property
     def layerNameList(self):
         try:
             layerNameList = self.param['layers']
         except KeyError:
-            layerNameList = [layer.name for layer in self.dwg.layers]
+            layerNameList = self.entityIndex.layerNameList
         return layerNameList
 
     @property
     def entityList(self):
-        entityList = [x for x in self.dwg.entities if x.layer in self.layerNameList]
-        entityList = [x for x in entityList if x.dxftype in self.param['dxfTypes']] 
-        entityList = [x for x in entityList if x.dxftype in self.ALLOWED_TYPE_LIST]
-        return entityList
+        dxfTypes = set(self.param['dxfTypes']) & set(self.ALLOWED_TYPE_LIST)
+        return self.entityIndex.getEntityList(self.layerNameList,dxfTypes)
 
 
 class DxfDrill(DxfBase):
@@ -74,10 +90,13 @@ class DxfDrill(DxfBase):
 
     @property
     def drillClass(self):
-        if 'stepZ' in self.param:
-            drill = cnc_drill.PeckDrill
+        batch = self.param.get('batch',False)
+        if 'stepZ' not in self.param:
+            drill = cnc_drill.BatchDrill if batch else cnc_drill.SimpleDrill
+        elif self.param.get('chipBreak',False):
+            drill = cnc_drill.BatchHighSpeedPeckDrill if batch else cnc_drill.HighSpeedPeckDrill
         else:
-            drill = cnc_drill.SimpleDrill
+            drill = cnc_drill.BatchPeckDrill if batch else cnc_drill.PeckDrill
         return drill 
 
     def getCenterPt(self,entity):
@@ -89,17 +108,55 @@ class DxfDrill(DxfBase):
 
     def makeListOfCmds(self):
         self.listOfCmds = []
-        # ------------------------------------------------------------------------
-        # Note: for better efficiency it might be worth while sorting the entities
-        # based on some criteria .....distance, etc.
-        # -------------------------------------------------------------------------
-        for entity in self.entityList:
+        centerPtList = [self.getCenterPt(entity) for entity in self.entityList]
+        centerPtList = self.getOrderedCenterPtList(centerPtList)
+        if self.param.get('batch',False):
+            # All holes with a single modal canned cycle
             drillParam = dict(self.param)
-            centerPt = self.getCenterPt(entity)
-            drillParam['centerX'] = centerPt[0]
-            drillParam['centerY'] = centerPt[1]
+            drillParam['pointList'] = [centerPt[:2] for centerPt in centerPtList]
             drill = self.drillClass(drillParam)
             self.listOfCmds.extend(drill.listOfCmds)
+        else:
+            for centerPt in centerPtList:
+                drillParam = dict(self.param)
+                drillParam['centerX'] = centerPt[0]
+                drillParam['centerY'] = centerPt[1]
+                drill = self.drillClass(drillParam)
+                self.listOfCmds.extend(drill.listOfCmds)
+
+    def getOrderedCenterPtList(self,centerPtList):
+        """
+        Orders the holes to reduce rapid travel between them if the holeOrder
+        param is set:
+
+        holeOrder     = None (drawing order, default), 'nearest' (nearest
+                        neighbor) or 'optimize' (nearest neighbor improved by
+                        2-opt and Or-opt moves). The first hole is given by
+                        startCond.
+        holeOrderTime = (optional) time budget in secs for 'optimize'
+
+        The rapid distance saved is stored in rapidDistSaved and added as a
+        comment.
+        """
+        method = self.param.get('holeOrder',None)
+        self.rapidDistSaved = 0.0
+        if method is None or len(centerPtList) < 2:
+            return centerPtList
+        startIndex = order_utils.getStartCondIndex(centerPtList,self.param['startCond'])
+        order = order_utils.getOrder(
+                centerPtList,
+                method,
+                startIndex,
+                timeBudget=self.param.get('holeOrderTime',None)
+                )
+        origDist = order_utils.getPathLength(centerPtList)
+        newDist = order_utils.getPathLength(centerPtList,order)
+        self.rapidDistSaved = origDist - newDist
+        self.listOfCmds.append(gcode_cmd.Space())
+        commentStr = '{0}: hole order {1}, rapid distance {2:1.4f} -> {3:1.4f} (saved {4:1.4f})'
+        commentStr = commentStr.format(self.__class__.__name__,method,origDist,newDist,self.rapidDistSaved)
+        self.listOfCmds.append(gcode_cmd.Comment(commentStr))
+        return [centerPtList[i] for i in order]
 
 
 class DxfCircPocket(DxfBase):
@@ -140,7 +197,7 @@ class DxfRectPocketFromExtent(DxfBase):
         self.listOfCmds = []
         if self.param['components']:
             # Get entity graph and find connected components
-            graph, ptToNodeDict = getEntityGraph(self.entityList,self.param['ptEquivTol'])
+            graph, ptToNodeDict = getEntityGraph(self.entityList,self.param['ptEquivTol'],self.progress)
             connectedCompSubGraphs = networkx.connected_component_subgraphs(graph)
             # Create list of commands for each connected component individually
             for i, subGraph in enumerate(connectedCompSubGraphs):
@@ -206,7 +263,7 @@ class DxfRectBoundaryFromExtent(DxfBase):
         self.listOfCmds = []
         if self.param['components']:
             # Get entity graph and find connected components
-            graph, ptToNodeDict = getEntityGraph(self.entityList,self.param['ptEquivTol'])
+            graph, ptToNodeDict = getEntityGraph(self.entityList,self.param['ptEquivTol'],self.progress)
             connectedCompSubGraphs = networkx.connected_component_subgraphs(graph)
             # Create list of commands for each connected component individually
             for i, subGraph in enumerate(connectedCompSubGraphs):
@@ -289,56 +346,99 @@ class DxfBoundary(DxfBase):
     def makeListOfCmds(self):
         self.listOfCmds = []
         # Get entity graph and find connected components
-        graph, ptToNodeDict = getEntityGraph(self.entityList,self.param['ptEquivTol'])
+        graph, ptToNodeDict = getEntityGraph(self.entityList,self.param['ptEquivTol'],self.progress)
         connectedCompSubGraphs = networkx.connected_component_subgraphs(graph)
+        if self.param.get('componentOrder',None) is None:
+            taskFunc = self.makeListOfCmdsForSubGraph
+            taskList = connectedCompSubGraphs
+        else:
+            taskFunc = self.makeListOfCmdsForTask
+            taskList = self.getOrderedTaskList(connectedCompSubGraphs)
         # Create list of commands for each connected component individually
-        for i, subGraph in enumerate(connectedCompSubGraphs):
-            nodeDegreeList = [subGraph.degree(n) for n in subGraph]
-            maxNodeDegree = max(nodeDegreeList)
-            minNodeDegree = min(nodeDegreeList)
-            if maxNodeDegree > 2:
-                # Graph is complicated - treat each entity as separate task 
-                for edge in subGraph.edges():
-                    edgeGraph = subGraph.subgraph(edge)
-                    listOfCmds = self.makeCmdsForLineString(edgeGraph)
-                    self.listOfCmds.extend(listOfCmds)
-            elif maxNodeDegree == 2 and minNodeDegree == 2:
-                # Graph is closed loop
-                listOfCmds = self.makeCmdsForClosedLoop(subGraph)
-                self.listOfCmds.extend(listOfCmds)
-            elif minNodeDegree == 1:
-                # Graph is line string
-                listOfCmds = self.makeCmdsForLineString(subGraph)
-                self.listOfCmds.extend(listOfCmds)
-            else:
-                errorMsg = 'sub-graph has nodes with degree 0'
-                raise RuntimeError(errorMsg)
-            
+        resultList = parallel_utils.parallelMap(
+                taskFunc,
+                taskList,
+                workers=self.workers,
+                progress=self.progress,
+                stage='connected components'
+                )
+        for listOfCmds in resultList:
+            self.listOfCmds.extend(listOfCmds)
+
+    def makeListOfCmdsForSubGraph(self,subGraph):
+        listOfCmds = []
+        nodeDegreeList = [subGraph.degree(n) for n in subGraph]
+        maxNodeDegree = max(nodeDegreeList)
+        minNodeDegree = min(nodeDegreeList)
+        if maxNodeDegree > 2:
+            # Graph is complicated - treat each entity as separate task 
+            for edge in subGraph.edges():
+                edgeGraph = subGraph.subgraph(edge)
+                listOfCmds.extend(self.makeCmdsForLineString(edgeGraph))
+        elif maxNodeDegree == 2 and minNodeDegree == 2:
+            # Graph is closed loop
+            listOfCmds.extend(self.makeCmdsForClosedLoop(subGraph))
+        elif minNodeDegree == 1:
+            # Graph is line string
+            listOfCmds.extend(self.makeCmdsForLineString(subGraph))
+        else:
+            errorMsg = 'sub-graph has nodes with degree 0'
+            raise RuntimeError(errorMsg)
+        return listOfCmds
+
+    def getOrderedTaskList(self,subGraphList):
+        """
+        Returns list of (graph, closed, startNode) cutting tasks for the
+        connected components, ordered to reduce the rapid travel between them
+        with each closed loop started near the end of the previous task.
+
+        componentOrder     = 'nearest' or 'optimize' (see order_utils.getTaskOrder)
+        componentOrderTime = (optional) time budget in secs for 'optimize'
+        startXY            = (optional) tool x,y position before the first
+                             task. If not given the first task starts at the
+                             entry point given by startCond.
+        """
+        return getOrderedCutTaskList(
+                getCutTaskList(subGraphList),
+                self.param['componentOrder'],
+                startPt=self.param.get('startXY',None),
+                startCond=self.param['startCond'],
+                timeBudget=self.param.get('componentOrderTime',None)
+                )
+
+    def makeListOfCmdsForTask(self,task):
+        graph, closed, startNode = task
+        if closed:
+            return self.makeCmdsForClosedLoop(graph,startNode)
+        else:
+            return self.makeCmdsForLineString(graph,startNode)
 
-    def makeCmdsForLineString(self,graph):
+    def makeCmdsForLineString(self,graph,startNode=None):
         if self.param['cutterComp'] is not None:
             errorMsg = 'cutterComp must be None for line string graphs'
             raise RuntimeError(errorMsg)
 
-        # Get start and end  node based on startCond.
         endNodeList = [n for n in graph if graph.degree(n) == 1]
-        if self.param['startCond'] in ('minX', 'maX'):
-            endCoordAndNodeList = [(graph.node[n]['coord'][0],n)  for n in endNodeList]
-        elif self.param['startCond'] in ('minY', 'maxY'):
-            endCoordAndNodeList = [(graph.node[n]['coord'][1],n)  for n in endNodeList]
+        if startNode is not None:
+            endNode = [n for n in endNodeList if n != startNode][0]
         else:
-            raise ValueError('unknown startCond {0}'.format(self.param['startCond']))
-        endCoordAndNodeList.sort()
-        if 'min' in  self.param['startCond']:
-            startNode = endCoordAndNodeList[0][1]
-            endNode = endCoordAndNodeList[1][1]
-        else:
-            startNode = endCoordAndNodeList[1][1]
-            endNode = endCoordAndNodeList[0][1]
+            # Get start and end  node based on startCond.
+            if self.param['startCond'] in ('minX', 'maxX'):
+                endCoordAndNodeList = [(graph.node[n]['coord'][0],n)  for n in endNodeList]
+            elif self.param['startCond'] in ('minY', 'maxY'):
+                endCoordAndNodeList = [(graph.node[n]['coord'][1],n)  for n in endNodeList]
+            else:
+                raise ValueError('unknown startCond {0}'.format(self.param['startCond']))
+            endCoordAndNodeList.sort()
+            if 'min' in  self.param['startCond']:
+                startNode = endCoordAndNodeList[0][1]
+                endNode = endCoordAndNodeList[1][1]
+            else:
+                startNode = endCoordAndNodeList[1][1]
+                endNode = endCoordAndNodeList[0][1]
 
         # Get path from start to end node (there is only one)
-        simplePathGen = networkx.all_simple_paths(graph, startNode,endNode)
-        startToEndPath = simplePathGen.next()
+        startToEndPath = getLineStringPath(graph, startNode, endNode)
 
         # Get list of segments (line or arc) along path and create cnc commands
         segList = self.getSegListFromPath(startToEndPath, graph)
@@ -347,26 +447,23 @@ class DxfBoundary(DxfBase):
         listOfCmds = self.makeListOfCmdsFromSegList(segList,param)
         return listOfCmds
 
-    def makeCmdsForClosedLoop(self,graph):
-        # Get start and end nodes based on startCond
-        if self.param['startCond'] in ('minX', 'maxX'):
-            coordAndNodeList = [(graph.node[n]['coord'][0], n) for n in graph]
-        elif self.param['startCond'] in ('minY', 'maxY'):
-            coordAndNodeList = [(graph.node[n]['coord'][1], n) for n in graph]
-        else:
-            raise ValueError('unknown startCond {0}'.format(self.param['startCond']))
-        coordAndNodeList.sort()
-        if 'min' in self.param['startCond']:
-            startNode = coordAndNodeList[0][1]
-        else:
-            startNode = coordAndNodeList[-1][1]
-        endNode = list(graph.neighbors(startNode))[0]
+    def makeCmdsForClosedLoop(self,graph,startNode=None):
+        if startNode is None:
+            # Get start and end nodes based on startCond
+            if self.param['startCond'] in ('minX', 'maxX'):
+                coordAndNodeList = [(graph.node[n]['coord'][0], n) for n in graph]
+            elif self.param['startCond'] in ('minY', 'maxY'):
+                coordAndNodeList = [(graph.node[n]['coord'][1], n) for n in graph]
+            else:
+                raise ValueError('unknown startCond {0}'.format(self.param['startCond']))
+            coordAndNodeList.sort()
+            if 'min' in self.param['startCond']:
+                startNode = coordAndNodeList[0][1]
+            else:
+                startNode = coordAndNodeList[-1][1]
 
         # Get path around graph
-        simplePathList = [p for p in networkx.all_simple_paths(graph,startNode,endNode)]
-        lenAndSimplePathList = [(len(p),p) for p in simplePathList]
-        closedPath = max(lenAndSimplePathList)[1]
-        closedPath.append(startNode)
+        closedPath = getClosedLoopPath(graph, startNode)
         closedPathCoord = [graph.node[n]['coord'] for n in closedPath]
 
 
@@ -414,13 +511,18 @@ class DxfBoundary(DxfBase):
     def makeListOfCmdsFromSegList(self,segList,param):
         listOfCmds = []
         if self.param['convertArcs']:
-            pointList = [p[0] for p in segList]
-            pointList.append(segList[-1][1])
-            param['pointList'] = pointList 
+            pointArray = geom_utils.joinPointArrayList(segList)
+            if 'simplifyTol' in self.param:
+                pointArray = geom_utils.simplifyPolyline(pointArray,self.param['simplifyTol'])
+            param['pointList'] = pointArray.tolist()
             boundary = cnc_boundary.LineSegBoundaryXY(param)
             listOfCmds = boundary.listOfCmds
+            if 'arcFitTol' in self.param:
+                listOfCmds = gcode_optimize.ArcFitter(self.param['arcFitTol']).fit(listOfCmds)
         else:
-            raise RuntimeError('convertArcs=False not supported yet')
+            param['segList'] = segList
+            boundary = cnc_boundary.MixedSegBoundaryXY(param)
+            listOfCmds = boundary.listOfCmds
 
         #xList = [p[0] for p in pointList]
         #yList = [p[1] for p in pointList]
@@ -431,21 +533,18 @@ class DxfBoundary(DxfBase):
         return listOfCmds
 
     def getSegListFromPath(self, nodePath,  graph):
-        segList = []
-        for node0, node1 in zip(nodePath[:-1],nodePath[1:]):
-            startCoord = graph.node[node0]['coord']
-            endCoord = graph.node[node1]['coord']
-            edgeEntity = graph[node0][node1]['entity']
-            if edgeEntity.dxftype == 'LINE':
-                segList.append((startCoord, endCoord))
-            else: 
-                if self.param['convertArcs']:
-                    arcSegList = self.convertDxfArcToLineList(edgeEntity)
-                    if dist2D(arcSegList[0][0],startCoord) > self.param['ptEquivTol']:
-                        arcSegList = [(y,x) for x,y in arcSegList[::-1]]
-                    segList.extend(arcSegList)
-                else:
-                    raise RuntimeError('convertArcs=False not supported yet')
+        if self.param['convertArcs']:
+            maxArcLen, maxChordErr, minSegLen = getArcTessellation(self.param)
+            segList = getNodePathPointArrayList(
+                    nodePath,
+                    graph,
+                    maxArcLen,
+                    self.param['ptEquivTol'],
+                    maxChordErr,
+                    minSegLen
+                    )
+        else:
+            segList = getNodePathSegList(nodePath,graph,self.param['ptEquivTol'])
         return segList
 
 
@@ -456,42 +555,14 @@ class DxfBoundary(DxfBase):
                 line = entity.start[:2], entity.end[:2]
                 lineList.append(line)
             else:
-                arcLineList = self.convertDxfArcToLineList(entity)
-                lineList.extend(arcLineList)
+                arcPointList = [tuple(p) for p in self.convertDxfArcToPointArray(entity).tolist()]
+                lineList.extend(zip(arcPointList[:-1], arcPointList[1:]))
         return lineList
     
 
-    def convertDxfArcToLineList(self,arc):
-        xc = arc.center[0]
-        yc = arc.center[1]
-        r = arc.radius
-        try:
-            angStart = (math.pi/180.0)*arc.start_angle
-        except AttributeError:
-            angStart = (math.pi/180.0)*arc.startangle
+    def convertDxfArcToPointArray(self,arc):
+        return getDxfArcPointArray(arc,*getArcTessellation(self.param))
 
-        try:
-            angEnd = (math.pi/180.0)*arc.end_angle
-        except AttributeError:
-            angEnd = (math.pi/180.0)*arc.endangle
-        
-        # Get array of steps from start to end angle
-        if angEnd < angStart:
-            angEnd += 2.0*math.pi 
-        totalAng = abs(angEnd - angStart)
-        maxStepAng = self.param['maxArcLen']/arc.radius
-        numPts = int(math.ceil(totalAng/maxStepAng))
-        angStepArray = numpy.linspace(angStart, angEnd, numPts)
-        # Create line segments
-        lineList = []
-        for ang0, ang1 in zip(angStepArray[:-1], angStepArray[1:]):
-            x0 = xc + r*math.cos(ang0)
-            y0 = yc + r*math.sin(ang0)
-            x1 = xc + r*math.cos(ang1)
-            y1 = yc + r*math.sin(ang1)
-            lineSeg = ((x0,y0), (x1,y1))
-            lineList.append(lineSeg)
-        return lineList
 
 
 
@@ -582,6 +653,7 @@ if __name__ == '__main__':
                 'safeZ'       : 0.5,
                 'stepZ'       : 0.05,
                 'startDwell'  : 2.0,
+                'holeOrder'   : 'optimize',
                 }
         drill = DxfDrill(param)
         prog.add(drill)
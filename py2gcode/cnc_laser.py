@@ -20,12 +20,27 @@ import cnc_path
 import math
 import numpy
 import gcode_cmd
+import geom_utils
+import gcode_optimize
 import dxfgrabber
+import dxf_cache
+import progress_utils
+import parallel_utils
+import order_utils
 import networkx
 import shapely.geometry.polygon as polygon
 
 from graph_utils import getEntityGraph
+from graph_utils import getCutTaskList
+from graph_utils import getOrderedCutTaskList
+from graph_utils import getClosedLoopPath
+from graph_utils import getLineStringPath
+from graph_utils import getNodePathPointArrayList
+from graph_utils import getNodePathSegList
 from dxf_utils import getEntityStartAndEndPts
+from dxf_utils import getEntityIndex
+from dxf_utils import getDxfArcPointArray
+from dxf_utils import getArcTessellation
 from geom_utils import dist2D
 
 class LaserCutBase(gcode_cmd.GCodeProg): 
@@ -39,12 +54,21 @@ class LaserCutBase(gcode_cmd.GCodeProg):
         self.param['laserDIOPin'] = self.LASER_DIO_PIN
         self.param['laserHomeXY'] = self.LASER_HOME_XY
         self.param.update(param)
-        try:
-            self.dwg = self.param['dwg']
-        except KeyError:
-            self.dwg = dxfgrabber.readfile(self.param['fileName'])
+        self.progress = progress_utils.popProgress(self.param)
+        self.workers = parallel_utils.popWorkers(self.param)
+        self._dwg = None
         self.makeListOfCmds()
 
+    @property
+    def dwg(self):
+        """
+        Drawing, loaded on first access. Path classes such as LaserLineSegPath
+        never access the drawing and so run without one.
+        """
+        if self._dwg is None:
+            self._dwg = dxf_cache.getDrawing(self.param)
+        return self._dwg
+
     def addStartComment(self):
         self.listOfCmds.append(gcode_cmd.Space())
         commentStr = 'Begin {0}'.format(self.__class__.__name__)
@@ -127,20 +151,22 @@ class LaserCutBase(gcode_cmd.GCodeProg):
         return listOfCmds
 
 
+    @property
+    def entityIndex(self):
+        return getEntityIndex(self.dwg)
+
     @property
     def layerNameList(self):
         try:
             layerNameList = self.param['layers']
         except KeyError:
-            layerNameList = [layer.name for layer in self.dwg.layers]
+            layerNameList = self.entityIndex.layerNameList
         return layerNameList
 
     @property
     def entityList(self):
-        entityList = [x for x in self.dwg.entities if x.layer in self.layerNameList]
-        entityList = [x for x in entityList if x.dxftype in self.param['dxfTypes']] 
-        entityList = [x for x in entityList if x.dxftype in self.ALLOWED_TYPE_LIST]
-        return entityList
+        dxfTypes = set(self.param['dxfTypes']) & set(self.ALLOWED_TYPE_LIST)
+        return self.entityIndex.getEntityList(self.layerNameList,dxfTypes)
 
 
 class VectorCut(LaserCutBase):
@@ -168,63 +194,140 @@ class VectorCut(LaserCutBase):
         self.addLaserSetup()
 
         # Get entity graph and find connected components
-        print('Getting entity graph')
-        graph, ptToNodeDict = getEntityGraph(self.entityList,self.param['ptEquivTol'])
-        print('Finding connected components')
+        graph, ptToNodeDict = getEntityGraph(self.entityList,self.param['ptEquivTol'],self.progress)
         connectedCompSubGraphs = networkx.connected_component_subgraphs(graph)
+        if self.param.get('componentOrder',None) is None and not self.param.get('insideOut',False):
+            taskFunc = self.makeListOfCmdsForSubGraph
+            taskList = connectedCompSubGraphs
+        else:
+            taskFunc = self.makeListOfCmdsForTask
+            taskList = self.getOrderedTaskList(connectedCompSubGraphs)
         # Create list of commands for each connected component individually
-        for i, subGraph in enumerate(connectedCompSubGraphs):
-            print('subGraph: {0}'.format(i))
-            nodeDegreeList = [subGraph.degree(n) for n in subGraph]
-            maxNodeDegree = max(nodeDegreeList)
-            minNodeDegree = min(nodeDegreeList)
-            if maxNodeDegree > 2:
-                # Graph is complicated - treat each entity as separate task 
-                for edge in subGraph.edges():
-                    edgeGraph = subGraph.subgraph(edge)
-                    listOfCmds = self.makeCmdsForLineString(edgeGraph)
-                    self.listOfCmds.extend(listOfCmds)
-
-            elif maxNodeDegree == 2 and minNodeDegree == 2:
-                # Graph is closed loop
-                listOfCmds = self.makeCmdsForClosedLoop(subGraph)
-                self.listOfCmds.extend(listOfCmds)
-            elif minNodeDegree == 1:
-                # Graph is line string
-                listOfCmds = self.makeCmdsForLineString(subGraph)
-                self.listOfCmds.extend(listOfCmds)
-            else:
-                #errorMsg = 'sub-graph has nodes with degree 0'
-                #raise RuntimeError(errorMsg)
-                continue
+        resultList = parallel_utils.parallelMap(
+                taskFunc,
+                taskList,
+                workers=self.workers,
+                progress=self.progress,
+                stage='connected components'
+                )
+        for listOfCmds in resultList:
+            self.listOfCmds.extend(listOfCmds)
 
         self.addLaserShutdown()
         if self.param['returnHome']:
             self.addRapidMoveToHome()
-            
 
-    def makeCmdsForLineString(self,graph):
-        print(' makeCmdsForLineString')
+    def makeListOfCmdsForSubGraph(self,subGraph):
+        listOfCmds = []
+        nodeDegreeList = [subGraph.degree(n) for n in subGraph]
+        maxNodeDegree = max(nodeDegreeList)
+        minNodeDegree = min(nodeDegreeList)
+        if maxNodeDegree > 2:
+            # Graph is complicated - treat each entity as separate task 
+            for edge in subGraph.edges():
+                edgeGraph = subGraph.subgraph(edge)
+                listOfCmds.extend(self.makeCmdsForLineString(edgeGraph))
+        elif maxNodeDegree == 2 and minNodeDegree == 2:
+            # Graph is closed loop
+            listOfCmds.extend(self.makeCmdsForClosedLoop(subGraph))
+        elif minNodeDegree == 1:
+            # Graph is line string
+            listOfCmds.extend(self.makeCmdsForLineString(subGraph))
+        return listOfCmds
 
-        # Get start and end  node based on startCond.
-        endNodeList = [n for n in graph if graph.degree(n) == 1]
-        if self.param['startCond'] in ('minX', 'maX'):
-            endCoordAndNodeList = [(graph.node[n]['coord'][0],n)  for n in endNodeList]
-        elif self.param['startCond'] in ('minY', 'maxY'):
-            endCoordAndNodeList = [(graph.node[n]['coord'][1],n)  for n in endNodeList]
+    def getOrderedTaskList(self,subGraphList):
+        """
+        Returns list of (graph, closed, startNode) cutting tasks for the
+        connected components, ordered to reduce the rapid travel between them
+        with each closed loop started near the end of the previous task.
+
+        componentOrder     = 'nearest' or 'optimize' (see order_utils.getTaskOrder)
+        componentOrderTime = (optional) time budget in secs for 'optimize'
+                             (per containment depth level)
+        startXY            = (optional) tool x,y position before the first
+                             task. If not given the first task starts at the
+                             entry point given by startCond.
+        insideOut          = if True tasks are cut from the innermost
+                             containment depth level out, so that loops are
+                             cut after everything inside them. The default
+                             componentOrder is then 'nearest'.
+        """
+        taskList = getCutTaskList(subGraphList,skipIsolated=True)
+        if self.param.get('insideOut',False) and taskList:
+            depthList = self.getTaskDepthList(taskList)
         else:
-            raise ValueError('unknown startCond {0}'.format(self.param['startCond']))
-        endCoordAndNodeList.sort()
-        if 'min' in  self.param['startCond']:
-            startNode = endCoordAndNodeList[0][1]
-            endNode = endCoordAndNodeList[1][1]
+            depthList = None
+        return getOrderedCutTaskList(
+                taskList,
+                self.param.get('componentOrder',None) or 'nearest',
+                startPt=self.param.get('startXY',None),
+                startCond=self.param['startCond'],
+                timeBudget=self.param.get('componentOrderTime',None),
+                depthList=depthList
+                )
+
+    def getTaskDepthList(self,taskList):
+        """
+        Returns the containment depth of each cutting task - the number of
+        closed loops of other tasks it lies inside.
+        """
+        ringList = []
+        ringIndexList = []
+        testPtList = []
+        for graph, closed in taskList:
+            if closed:
+                ringIndexList.append(len(ringList))
+                ringList.append(self.getClosedLoopPointArray(graph))
+            else:
+                ringIndexList.append(None)
+            testPtList.append(graph.node[graph.nodes()[0]]['coord'])
+        return order_utils.getContainmentDepthList(ringList,testPtList,ringIndexList)
+
+    def getClosedLoopPointArray(self,graph):
+        """
+        Returns (N,2) array of points around closed loop graph, with arcs
+        tessellated as for cutting.
+        """
+        maxArcLen, maxChordErr, minSegLen = getArcTessellation(self.param)
+        if len(graph.nodes()) == 1:
+            node = graph.nodes()[0]
+            circle = graph[node][node]['entity']
+            return geom_utils.getArcPointArray(circle.center[:2],circle.radius,0.0,2.0*math.pi,
+                    maxArcLen,maxChordErr,minSegLen)
+        closedPath = getClosedLoopPath(graph,graph.nodes()[0])
+        pointArrayList = getNodePathPointArrayList(closedPath,graph,maxArcLen,self.param['ptEquivTol'],
+                maxChordErr,minSegLen)
+        return geom_utils.joinPointArrayList(pointArrayList)
+
+    def makeListOfCmdsForTask(self,task):
+        graph, closed, startNode = task
+        if closed:
+            return self.makeCmdsForClosedLoop(graph,startNode)
         else:
-            startNode = endCoordAndNodeList[1][1]
-            endNode = endCoordAndNodeList[0][1]
+            return self.makeCmdsForLineString(graph,startNode)
+
+    def makeCmdsForLineString(self,graph,startNode=None):
+        endNodeList = [n for n in graph if graph.degree(n) == 1]
+        if startNode is not None:
+            endNode = [n for n in endNodeList if n != startNode][0]
+        else:
+            # Get start and end  node based on startCond.
+            if self.param['startCond'] in ('minX', 'maxX'):
+                endCoordAndNodeList = [(graph.node[n]['coord'][0],n)  for n in endNodeList]
+            elif self.param['startCond'] in ('minY', 'maxY'):
+                endCoordAndNodeList = [(graph.node[n]['coord'][1],n)  for n in endNodeList]
+            else:
+                raise ValueError('unknown startCond {0}'.format(self.param['startCond']))
+            endCoordAndNodeList.sort()
+            if 'min' in  self.param['startCond']:
+                startNode = endCoordAndNodeList[0][1]
+                endNode = endCoordAndNodeList[1][1]
+            else:
+                startNode = endCoordAndNodeList[1][1]
+                endNode = endCoordAndNodeList[0][1]
 
         # Get path from start to end node (there is only one)
-        simplePathGen = networkx.all_simple_paths(graph, startNode,endNode)
-        startToEndPath = simplePathGen.next()
+        startToEndPath = getLineStringPath(graph, startNode, endNode)
 
         # Get list of segments (line or arc) along path and create cnc commands
         segList = self.getSegListFromPath(startToEndPath, graph)
@@ -233,9 +336,7 @@ class VectorCut(LaserCutBase):
         listOfCmds = self.makeListOfCmdsFromSegList(segList,param)
         return listOfCmds
 
-    def makeCmdsForClosedLoop(self,graph):
-        print(' makeCmdsForClosedLoop')
-
+    def makeCmdsForClosedLoop(self,graph,startNode=None):
         if len(graph.edges())==1 and len(graph.nodes()) == 1:
             # Graph is a circle
             node = graph.nodes()[0]
@@ -247,25 +348,22 @@ class VectorCut(LaserCutBase):
             listOfCmds = circPath.listOfCmds
         else:
 
-            # Get start and end nodes based on startCond
-            if self.param['startCond'] in ('minX', 'maxX'):
-                coordAndNodeList = [(graph.node[n]['coord'][0], n) for n in graph]
-            elif self.param['startCond'] in ('minY', 'maxY'):
-                coordAndNodeList = [(graph.node[n]['coord'][1], n) for n in graph]
-            else:
-                raise ValueError('unknown startCond {0}'.format(self.param['startCond']))
-            coordAndNodeList.sort()
-            if 'min' in self.param['startCond']:
-                startNode = coordAndNodeList[0][1]
-            else:
-                startNode = coordAndNodeList[-1][1]
-            endNode = graph.neighbors(startNode)[0]
+            if startNode is None:
+                # Get start and end nodes based on startCond
+                if self.param['startCond'] in ('minX', 'maxX'):
+                    coordAndNodeList = [(graph.node[n]['coord'][0], n) for n in graph]
+                elif self.param['startCond'] in ('minY', 'maxY'):
+                    coordAndNodeList = [(graph.node[n]['coord'][1], n) for n in graph]
+                else:
+                    raise ValueError('unknown startCond {0}'.format(self.param['startCond']))
+                coordAndNodeList.sort()
+                if 'min' in self.param['startCond']:
+                    startNode = coordAndNodeList[0][1]
+                else:
+                    startNode = coordAndNodeList[-1][1]
 
             # Get path around graph
-            simplePathList = [p for p in networkx.all_simple_paths(graph,startNode,endNode)]
-            lenAndSimplePathList = [(len(p),p) for p in simplePathList]
-            closedPath = max(lenAndSimplePathList)[1]
-            closedPath.append(startNode)
+            closedPath = getClosedLoopPath(graph, startNode)
             closedPathCoord = [graph.node[n]['coord'] for n in closedPath]
 
             # Test for self instersections and if none orient closed loop for cutting direction
@@ -288,31 +386,33 @@ class VectorCut(LaserCutBase):
     def makeListOfCmdsFromSegList(self,segList,param):
         listOfCmds = []
         if self.param['convertArcs']:
-            pointList = [p[0] for p in segList]
-            pointList.append(segList[-1][1])
-            param['pointList'] = pointList 
+            pointArray = geom_utils.joinPointArrayList(segList)
+            if 'simplifyTol' in self.param:
+                pointArray = geom_utils.simplifyPolyline(pointArray,self.param['simplifyTol'])
+            param['pointList'] = pointArray.tolist()
             path = LaserLineSegPath(param)
             listOfCmds = path.listOfCmds
+            if 'arcFitTol' in self.param:
+                listOfCmds = gcode_optimize.ArcFitter(self.param['arcFitTol']).fit(listOfCmds)
         else:
-            raise RuntimeError('convertArcs=False not supported yet')
+            param['segList'] = segList
+            path = LaserMixedSegPath(param)
+            listOfCmds = path.listOfCmds
         return listOfCmds
 
     def getSegListFromPath(self, nodePath,  graph):
-        segList = []
-        for node0, node1 in zip(nodePath[:-1],nodePath[1:]):
-            startCoord = graph.node[node0]['coord']
-            endCoord = graph.node[node1]['coord']
-            edgeEntity = graph[node0][node1]['entity']
-            if edgeEntity.dxftype == 'LINE':
-                segList.append((startCoord, endCoord))
-            else: 
-                if self.param['convertArcs']:
-                    arcSegList = self.convertDxfArcToLineList(edgeEntity)
-                    if dist2D(arcSegList[0][0],startCoord) > self.param['ptEquivTol']:
-                        arcSegList = [(y,x) for x,y in arcSegList[::-1]]
-                    segList.extend(arcSegList)
-                else:
-                    raise RuntimeError('convertArcs=False not supported yet')
+        if self.param['convertArcs']:
+            maxArcLen, maxChordErr, minSegLen = getArcTessellation(self.param)
+            segList = getNodePathPointArrayList(
+                    nodePath,
+                    graph,
+                    maxArcLen,
+                    self.param['ptEquivTol'],
+                    maxChordErr,
+                    minSegLen
+                    )
+        else:
+            segList = getNodePathSegList(nodePath,graph,self.param['ptEquivTol'])
         return segList
 
 
@@ -323,34 +423,14 @@ class VectorCut(LaserCutBase):
                 line = entity.start[:2], entity.end[:2]
                 lineList.append(line)
             else:
-                arcLineList = self.convertDxfArcToLineList(entity)
-                lineList.extend(arcLineList)
+                arcPointList = [tuple(p) for p in self.convertDxfArcToPointArray(entity).tolist()]
+                lineList.extend(zip(arcPointList[:-1], arcPointList[1:]))
         return lineList
     
 
-    def convertDxfArcToLineList(self,arc):
-        xc = arc.center[0]
-        yc = arc.center[1]
-        r = arc.radius
-        angStart = (math.pi/180.0)*arc.startangle
-        angEnd = (math.pi/180.0)*arc.endangle
-        # Get array of steps from start to end angle
-        if angEnd < angStart:
-            angEnd += 2.0*math.pi 
-        totalAng = abs(angEnd - angStart)
-        maxStepAng = self.param['maxArcLen']/arc.radius
-        numPts = int(math.ceil(totalAng/maxStepAng))
-        angStepArray = numpy.linspace(angStart, angEnd, numPts)
-        # Create line segments
-        lineList = []
-        for ang0, ang1 in zip(angStepArray[:-1], angStepArray[1:]):
-            x0 = xc + r*math.cos(ang0)
-            y0 = yc + r*math.sin(ang0)
-            x1 = xc + r*math.cos(ang1)
-            y1 = yc + r*math.sin(ang1)
-            lineSeg = ((x0,y0), (x1,y1))
-            lineList.append(lineSeg)
-        return lineList
+    def convertDxfArcToPointArray(self,arc):
+        return getDxfArcPointArray(arc,*getArcTessellation(self.param))
+
 
         
 class LaserLineSegPath(LaserCutBase):
@@ -378,6 +458,32 @@ class LaserLineSegPath(LaserCutBase):
         self.listOfCmds.append(gcode_cmd.ExactPathMode())
         self.addEndComment()
 
+class LaserMixedSegPath(LaserCutBase):
+
+    DEFAULT_PARAM = {'ptEquivTol'  :  1.0e-5}
+    
+    def __init__(self,param):
+        super(LaserMixedSegPath,self).__init__(param)
+
+    def makeListOfCmds(self):
+        self.listOfCmds = []
+        mixedSegPath = cnc_path.MixedSegPath(
+                self.param['segList'],
+                closed=self.param['closed'],
+                plane='xy',
+                helix=None,
+                ptEquivTol=self.param['ptEquivTol']
+                )
+        self.addStartComment()
+        x0, y0 = mixedSegPath.getStartPoint()[:2]
+        self.addRapidMoveToPos(x=x0,y=y0,comment='start x,y')
+        self.listOfCmds.append((gcode_cmd.PathBlendMode(p=0.001,q=0.001)))
+        self.addLaserOn(synchronized=True)
+        self.listOfCmds.extend(mixedSegPath.listOfCmds) 
+        self.addLaserOff()
+        self.listOfCmds.append(gcode_cmd.ExactPathMode())
+        self.addEndComment()
+
 class LaserCircPath(LaserCutBase):
 
     def __init__(self,param):
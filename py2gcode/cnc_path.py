@@ -662,7 +662,8 @@ class LineSegPath(gcode_cmd.GCodeProg):
         """
         pointListMod = []
         pointListMod.extend(self.pointList)
-        if self.closed:
+        if self.closed and tuple(self.pointList[-1]) != tuple(self.pointList[0]):
+            # Only close path if it doesn't already end at the start point
             pointListMod.append(self.pointList[0])
         if self.helix is not None:
             pointListMod = self.addHelixToPointList(pointListMod)
@@ -675,14 +676,29 @@ class LineSegPath(gcode_cmd.GCodeProg):
             linearFeed = self.getLinearFeedFromPt(p)
             self.listOfCmds.append(linearFeed)
 
+    def addToToolPath(self,toolPath):
+        """
+        Appends path to a toolpath.ToolPath as a single block of linear feeds.
+        """
+        pointListMod = self.getModifiedPointList()
+        keys = PLANE_COORD[self.plane]
+        if len(pointListMod[0]) == 3:
+            keys = keys + (PLANE_NORM_COORD[self.plane],)
+        toolPath.addLinearFeeds(pointListMod,keys=keys)
 
-class MixedSegPath(gcode_cmd.GCodeProg):
 
-    # -----------------------------------------------------------
-    # TODO - not done yet
-    # -----------------------------------------------------------
+class MixedSegPath(gcode_cmd.GCodeProg):
 
     def __init__(self,segList,closed=False,plane='xy',helix=None,ptEquivTol=1.0e-5):
+        """
+        Generates a path from a list of geom_utils.LineSeg2D and ArcSeg2D
+        segments - lines become linear feeds and arcs helical motions. The
+        path starts with a linear feed to the start point of the first
+        segment. 
+
+        helix = (startDepth, stopDepth), the depth is ramped along the path in
+        proportion to the distance travelled.
+        """
         checkPlane(plane)
         self.segList = segList
         self.closed = closed
@@ -701,25 +717,55 @@ class MixedSegPath(gcode_cmd.GCodeProg):
     def hasHelix(self):
         return self.helix is not None
 
+    def getStartPoint(self):
+        x0, y0 = self.segList[0].startPoint
+        if self.hasHelix:
+            return x0, y0, self.helix[0]
+        else:
+            return x0, y0
+
+    def getStopPoint(self):
+        x1, y1 = self.segList[-1].endPoint
+        if self.hasHelix:
+            return x1, y1, self.helix[1]
+        else:
+            return x1, y1
+
+    def getSegHelixList(self):
+        """
+        Returns list of (startDepth, stopDepth) for each segment.
+        """
+        z0, z1 = self.helix
+        segLengthList = [seg.length for seg in self.segList]
+        totalLength = sum(segLengthList)
+        segHelixList = []
+        distCum = 0.0
+        zStart = z0
+        for segLength in segLengthList:
+            distCum += segLength
+            if totalLength > 0:
+                zStop = z0 + (z1-z0)*(distCum/totalLength)
+            else:
+                zStop = z1
+            segHelixList.append((zStart, zStop))
+            zStart = zStop
+        return segHelixList
+
     def makeListOfCmds(self):
         self.listOfCmds = []
         if self.segListDim == 2:
             if self.hasHelix:
-                totalXYPathLen = geom_utils.getSegListLength(self.segList)
-                raise RuntimeError, 'helix option not yet implemented'
+                segHelixList = self.getSegHelixList()
             else:
-                for i, seg in enumerate(segList):
-                    if i == 0:
-                        self.listOfCmds.append(seg.getFeedToStartCmd())
-                    self.listOfCmds.append(seg.getFeedCmd())
+                segHelixList = [None]*len(self.segList)
+            for i, (seg, segHelix) in enumerate(zip(self.segList, segHelixList)):
+                if i == 0:
+                    self.listOfCmds.append(seg.getFeedToStartCmd(self.plane,helix=segHelix))
+                self.listOfCmds.append(seg.getFeedCmd(self.plane,helix=segHelix))
         else:
             raise RuntimeError, '3D segment lists not yet supported'
 
 
-
-
-
-
 # Utility functions
 # -----------------------------------------------------------------------------
 
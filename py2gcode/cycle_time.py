@@ -0,0 +1,673 @@
+"""
+
+Copyright 2014 IO Rodeo Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+from __future__ import print_function
+import collections
+import itertools
+import math
+import operator
+import numpy
+import gcode_cmd
+import toolpath
+
+DEFAULT_MAX_VELOCITY = (60.0, 60.0, 30.0)  # x,y,z in units/min
+DEFAULT_MAX_ACCEL = (10.0, 10.0, 5.0)      # x,y,z in units/sec**2
+DEFAULT_JUNCTION_DEVIATION = 0.001         # units, path blending w/o G64 P
+DEFAULT_PECK_CLEARANCE = 0.01              # units, G83 rapid back down clearance
+
+# Arc plane axes (first, second, helix) and direction (ccw = 1) by motion code
+ARC_TABLE = numpy.zeros((toolpath.MOTION_ARC_YZ_CCW+1,4),dtype=int)
+ARC_TABLE[toolpath.MOTION_ARC_XY_CW]  = (0, 1, 2, -1)
+ARC_TABLE[toolpath.MOTION_ARC_XY_CCW] = (0, 1, 2,  1)
+ARC_TABLE[toolpath.MOTION_ARC_XZ_CW]  = (2, 0, 1, -1)
+ARC_TABLE[toolpath.MOTION_ARC_XZ_CCW] = (2, 0, 1,  1)
+ARC_TABLE[toolpath.MOTION_ARC_YZ_CW]  = (1, 2, 0, -1)
+ARC_TABLE[toolpath.MOTION_ARC_YZ_CCW] = (1, 2, 0,  1)
+
+CLASS_TO_MOTION = {
+        gcode_cmd.RapidMotion     : toolpath.MOTION_RAPID,
+        gcode_cmd.LinearFeed      : toolpath.MOTION_LINEAR,
+        gcode_cmd.HelicalMotionXY : toolpath.MOTION_ARC_XY_CW,
+        gcode_cmd.HelicalMotionXZ : toolpath.MOTION_ARC_XZ_CW,
+        gcode_cmd.HelicalMotionYZ : toolpath.MOTION_ARC_YZ_CW,
+        gcode_cmd.ModalMotion     : -1,
+        gcode_cmd.DrillCycle      : -2,
+        gcode_cmd.PeckDrillCycle  : -2,
+        gcode_cmd.HighSpeedPeckDrillCycle : -2,
+        gcode_cmd.CancelCannedCycle : -2,
+        }
+
+MOTION_DICT_GETTER = operator.attrgetter('motionDict')
+DIRECTION_GETTER = operator.attrgetter('direction')
+AXES_GETTER = operator.itemgetter(*toolpath.AXIS_KEYS)
+TURNS_GETTER = operator.itemgetter('p')
+
+# Arc offset words and their columns in the i,j,k offsets by helical class
+ARC_OFFSETS = (
+        (gcode_cmd.HelicalMotionXY, operator.itemgetter('i','j'), [0, 1]),
+        (gcode_cmd.HelicalMotionXZ, operator.itemgetter('i','k'), [0, 2]),
+        (gcode_cmd.HelicalMotionYZ, operator.itemgetter('j','k'), [1, 2]),
+        )
+
+FEED_MODES = {
+        gcode_cmd.InverseTimeMode    : 'G93',
+        gcode_cmd.UnitsPerMinuteMode : 'G94',
+        gcode_cmd.UnitsPerRevMode    : 'G95',
+        }
+
+# Commands after which the machine comes to a stop
+STOP_CLASSES = (
+        gcode_cmd.Pause,
+        gcode_cmd.OptionalPause,
+        gcode_cmd.End,
+        gcode_cmd.SelectAndChangeTool,
+        gcode_cmd.ChangeTool,
+        gcode_cmd.StartSpindleCW,
+        gcode_cmd.StartSpindleCCW,
+        gcode_cmd.StopSpindle,
+        )
+
+
+class CycleTimeEstimator(object):
+    """
+    Estimates the run time of a program (GCodeProg or toolpath.ToolPath).
+
+    Motions are timed with trapezoidal velocity profiles limited by the
+    per-axis max velocity (units/min) and acceleration (units/sec**2). Rapids
+    run at the max velocity along the direction of motion, feeds at the
+    feed rate (G93, G94 and G95 feed modes). The speed through the junction
+    between two moves is limited with a junction deviation model - the
+    deviation is the G64 P tolerance, or junctionDeviation for G64 w/o P, and
+    zero (colinear moves only) in G61. The machine stops at dwells, tool and
+    spindle changes, pauses and in G61.1, and between the moves of the
+    expanded G73, G81, G82 and G83 canned cycles (G90 or G91). The junction speeds are then
+    planned with vectorized backward and forward passes, so that each move can
+    reach its exit speed.
+
+    Only the x,y,z axes are modeled (in program units). startPos and feedRate
+    are the initial position and feed rate, e.g. for estimating single
+    routines. Time is broken down by routine using the 'Begin X'/'End X'
+    comments added by the routines.
+    """
+
+    def __init__(self, maxVelocity=DEFAULT_MAX_VELOCITY, maxAccel=DEFAULT_MAX_ACCEL,
+            junctionDeviation=DEFAULT_JUNCTION_DEVIATION, peckClearance=DEFAULT_PECK_CLEARANCE,
+            startPos=(0.0,0.0,0.0), feedRate=None):
+        self.maxVelocity = numpy.array(maxVelocity,dtype=float)/60.0
+        self.maxAccel = numpy.array(maxAccel,dtype=float)
+        self.junctionDeviation = float(junctionDeviation)
+        self.peckClearance = float(peckClearance)
+        self.startPos = numpy.array(startPos,dtype=float)
+        self.startFeedRate = feedRate
+        self.reset()
+
+    def reset(self):
+        self.position = numpy.array(self.startPos)
+        self.motionCode = None
+        self.absolute = True
+        self.feedRate = self.startFeedRate
+        self.feedMode = 'G94'
+        self.spindleSpeed = None
+        self.blendDeviation = self.junctionDeviation
+        self.exactStop = False
+        self.returnMode = 'prior'
+        self.cycleParams = None
+        self.cycleClass = None
+        self.routineNames = [None]
+        self.routineStack = []
+        self.dwellTimes = collections.defaultdict(float)
+        self.moveList = []
+        self.numMoves = 0
+        self.stopList = []
+
+    @property
+    def routineId(self):
+        return self.routineStack[-1] if self.routineStack else 0
+
+    def estimate(self,obj):
+        """
+        Returns CycleTime for GCodeProg or ToolPath obj.
+        """
+        self.reset()
+        if isinstance(obj,toolpath.ToolPath):
+            toolPath = obj
+        else:
+            toolPath = getToolPath(obj)
+        codes = toolPath.codes
+        axes = toolPath.axes
+        offsets = toolPath.offsets
+        turns = numpy.ones((toolPath.size,))
+        for i, value in toolPath.sideTable.iteritems():
+            if isinstance(value,dict) and value.get('p') is not None:
+                turns[i] = value['p']
+        row0 = 0
+        for row in numpy.flatnonzero(codes == toolpath.MOTION_NONE).tolist():
+            if row > row0:
+                self.addMotions(codes[row0:row],axes[row0:row],offsets[row0:row],turns[row0:row])
+            self.addCmd(toolPath.sideTable[row])
+            row0 = row + 1
+        if toolPath.size > row0:
+            self.addMotions(codes[row0:],axes[row0:],offsets[row0:],turns[row0:])
+        return self.getCycleTime()
+
+    def addCmd(self,cmd):
+        """
+        Updates state for non-motion command. Canned cycles are expanded into
+        motions.
+        """
+        cls = type(cmd)
+        if cls is gcode_cmd.Comment:
+            self.addComment(str(cmd.value))
+        elif cls is gcode_cmd.FeedRate:
+            self.feedRate = float(cmd.value)
+        elif cls is gcode_cmd.SpindleSpeed:
+            self.spindleSpeed = float(cmd.value)
+        elif cls is gcode_cmd.Dwell:
+            self.dwellTimes[self.routineId] += float(cmd.value)
+            self.addStop()
+        elif cls in FEED_MODES:
+            self.feedMode = FEED_MODES[cls]
+        elif cls is gcode_cmd.AbsoluteMode:
+            self.absolute = True
+        elif cls is gcode_cmd.IncrementalMode:
+            self.absolute = False
+        elif cls is gcode_cmd.ExactPathMode:
+            self.blendDeviation = 0.0
+            self.exactStop = False
+        elif cls is gcode_cmd.ExactStopMode:
+            self.exactStop = True
+        elif cls is gcode_cmd.PathBlendMode:
+            p = cmd.params['p']
+            self.blendDeviation = self.junctionDeviation if p is None else float(p)
+            self.exactStop = False
+        elif cls is gcode_cmd.CannedCycleReturnMode:
+            self.returnMode = cmd.mode
+        elif isinstance(cmd,gcode_cmd.DrillCycleBase):
+            self.cycleClass = cls
+            self.addDrillCycle(cmd.params)
+        elif cls is gcode_cmd.CancelCannedCycle:
+            self.cycleParams = None
+        elif cls is gcode_cmd.ModalMotion and self.cycleParams is not None:
+            param = dict(self.cycleParams)
+            param.update((k,v) for k,v in cmd.motionDict.iteritems() if v is not None)
+            self.addDrillCycle(param)
+        elif cls is gcode_cmd.ModalMotion:
+            if self.motionCode not in (toolpath.MOTION_RAPID, toolpath.MOTION_LINEAR):
+                raise ValueError('modal motion w/o rapid or linear motion mode')
+            axes = [[getFloatOrNan(cmd.motionDict.get(k)) for k in toolpath.AXIS_KEYS]]
+            self.addMotions(numpy.array([self.motionCode]),numpy.array(axes))
+        elif cls is gcode_cmd.QuadraticBSplineXY:
+            self.addSpline(cmd)
+        elif isinstance(cmd,STOP_CLASSES):
+            self.addStop()
+
+    def addComment(self,commentStr):
+        if commentStr.startswith('Begin '):
+            self.routineStack.append(len(self.routineNames))
+            self.routineNames.append(commentStr[6:])
+        elif commentStr.startswith('End ') and self.routineStack:
+            if self.routineNames[self.routineStack[-1]] == commentStr[4:]:
+                self.routineStack.pop()
+
+    def addStop(self):
+        if self.numMoves:
+            self.stopList.append(self.numMoves-1)
+
+    def addMotions(self,codes,axes,offsets=None,turns=None,stop=False,absolute=False):
+        """
+        Adds block of motions given by toolpath motion codes, x,y,z axes
+        (NaN for missing words), i,j,k offsets and number of turns. If stop is
+        True the machine stops after each motion. If absolute is True the axes
+        are absolute positions regardless of the distance mode.
+        """
+        numRows = codes.shape[0]
+        self.cycleParams = None
+        if absolute or self.absolute:
+            end = fillForward(axes,self.position)
+        else:
+            end = self.position + numpy.cumsum(numpy.nan_to_num(axes),axis=0)
+        start = numpy.vstack((self.position,end[:-1]))
+        delta = end - start
+        length = numpy.sqrt((delta**2).sum(axis=1))
+        with numpy.errstate(invalid='ignore',divide='ignore'):
+            startDir = delta/length[:,None]
+        endDir = startDir
+        axisUse = numpy.abs(startDir)
+        radius = None
+
+        isArc = codes >= toolpath.MOTION_ARC_XY_CW
+        if isArc.any():
+            endDir = startDir.copy()
+            arcCodes = codes[isArc]
+            arcLength, arcStartDir, arcEndDir, arcRadius = getArcMotions(
+                    arcCodes, start[isArc], end[isArc], offsets[isArc], turns[isArc]
+                    )
+            length[isArc] = arcLength
+            startDir[isArc] = arcStartDir
+            endDir[isArc] = arcEndDir
+            arcAxisUse = numpy.maximum(numpy.abs(arcStartDir),numpy.abs(arcEndDir))
+            rows = numpy.arange(arcCodes.shape[0])
+            arcAxisUse[rows,ARC_TABLE[arcCodes,0]] = 1.0
+            arcAxisUse[rows,ARC_TABLE[arcCodes,1]] = 1.0
+            axisUse[isArc] = arcAxisUse
+            radius = numpy.full((numRows,),numpy.inf)
+            radius[isArc] = arcRadius
+
+        # Axis limits along the direction of motion
+        with numpy.errstate(invalid='ignore',divide='ignore'):
+            velocity = (self.maxVelocity/axisUse).min(axis=1)
+            accel = (self.maxAccel/axisUse).min(axis=1)
+        if radius is not None:
+            velocity = numpy.minimum(velocity,numpy.sqrt(accel*radius))
+
+        isRapid = codes == toolpath.MOTION_RAPID
+        if not isRapid.all():
+            feedVelocity = self.getFeedVelocity(length)
+            velocity = numpy.where(isRapid,velocity,numpy.minimum(velocity,feedVelocity))
+
+        stopAfter = numpy.full((numRows,),stop or self.exactStop,dtype=bool)
+        deviation = numpy.full((numRows,),self.blendDeviation)
+        routine = numpy.full((numRows,),self.routineId,dtype=int)
+        self.moveList.append((length,velocity,accel,startDir,endDir,deviation,stopAfter,isRapid,routine))
+        self.numMoves += numRows
+        self.position = end[-1].copy()
+        self.motionCode = int(codes[-1])
+
+    def getFeedVelocity(self,length):
+        """
+        Returns feed velocity (units/sec) for moves with given lengths.
+        """
+        if self.feedRate is None or self.feedRate <= 0:
+            raise ValueError('feed motion w/o positive feed rate')
+        if self.feedMode == 'G94':
+            return self.feedRate/60.0
+        elif self.feedMode == 'G95':
+            if not self.spindleSpeed:
+                raise ValueError('units per rev feed w/o spindle speed')
+            return self.feedRate*self.spindleSpeed/60.0
+        else:
+            return length*self.feedRate/60.0
+
+    def addDrillCycle(self,param):
+        """
+        Expands G73, G81, G82 or G83 canned cycle with the given params into
+        rapids and feeds. In incremental distance mode x and y are increments
+        applied on each repeat, r is relative to the initial z and z to the
+        r plane. G73 retracts by peckClearance after each peck.
+        """
+        z0 = self.position[2]
+        if self.absolute:
+            x, y, z, r = [float(param[k]) for k in ('x','y','z','r')]
+            dx, dy = 0.0, 0.0
+        else:
+            dx, dy = [float(param[k] or 0.0) for k in ('x','y')]
+            x, y = self.position[:2]
+            r = z0 + float(param['r'])
+            z = r + float(param['z'])
+        reps = 1 if param['l'] is None else int(param['l'])
+        clearZ = r if self.returnMode == 'r-word' else max(z0,r)
+        dwell = param.get('p')
+        peck = param.get('q')
+
+        codes, points = [], []
+        if z0 < r:
+            codes.append(toolpath.MOTION_RAPID)
+            points.append((numpy.nan,numpy.nan,r))
+        for i in range(reps):
+            x, y = x + dx, y + dy
+            codes.extend([toolpath.MOTION_RAPID, toolpath.MOTION_RAPID])
+            points.extend([(x,y,numpy.nan), (numpy.nan,numpy.nan,r)])
+            if peck is None:
+                codes.append(toolpath.MOTION_LINEAR)
+                points.append((numpy.nan,numpy.nan,z))
+            elif self.cycleClass is gcode_cmd.HighSpeedPeckDrillCycle:
+                depth = r
+                while depth > z:
+                    depth = max(depth - float(peck), z)
+                    codes.extend([toolpath.MOTION_LINEAR, toolpath.MOTION_RAPID])
+                    points.extend([(numpy.nan,numpy.nan,depth), (numpy.nan,numpy.nan,depth+self.peckClearance)])
+                codes.pop()
+                points.pop()
+            else:
+                depth = r
+                while depth > z:
+                    if depth < r:
+                        codes.append(toolpath.MOTION_RAPID)
+                        points.append((numpy.nan,numpy.nan,depth+self.peckClearance))
+                    depth = max(depth - float(peck), z)
+                    codes.extend([toolpath.MOTION_LINEAR, toolpath.MOTION_RAPID])
+                    points.extend([(numpy.nan,numpy.nan,depth), (numpy.nan,numpy.nan,r)])
+                codes.pop()
+                points.pop()
+            if dwell is not None:
+                self.dwellTimes[self.routineId] += float(dwell)
+            codes.append(toolpath.MOTION_RAPID)
+            points.append((numpy.nan,numpy.nan,clearZ))
+        self.addMotions(numpy.array(codes),numpy.array(points),stop=True,absolute=True)
+        self.cycleParams = param
+
+    def addSpline(self,cmd):
+        """
+        Adds quadratic B-spline as a single feed with the length of the curve.
+        """
+        param = cmd.splineArgs
+        p0 = self.position[:2]
+        p1 = p0 + [getFloatOrNan(param[k]) for k in ('i','j')]
+        p2 = numpy.array([getFloatOrNan(param[k]) for k in ('x','y')])
+        p2 = numpy.where(numpy.isnan(p2),p0,p2)
+        s = numpy.linspace(0.0,1.0,33)[:,None]
+        curve = (1-s)**2*p0 + 2*s*(1-s)*p1 + s**2*p2
+        curveLength = numpy.sqrt((numpy.diff(curve,axis=0)**2).sum(axis=1)).sum()
+        self.addMotions(numpy.array([toolpath.MOTION_LINEAR]),numpy.array([[p2[0],p2[1],numpy.nan]]))
+        length = self.moveList[-1][0]
+        length[-1] = curveLength
+
+    def getCycleTime(self):
+        """
+        Plans the junction speeds and returns the CycleTime for the motions
+        and dwells added.
+        """
+        numRoutines = len(self.routineNames)
+        dwellTimes = numpy.zeros((numRoutines,))
+        for i, t in self.dwellTimes.iteritems():
+            dwellTimes[i] = t
+        if not self.moveList:
+            zeros = numpy.zeros((0,))
+            return CycleTime(self.routineNames,zeros,zeros.astype(bool),zeros.astype(int),dwellTimes)
+
+        moveArrays = [numpy.concatenate(x) for x in zip(*self.moveList)]
+        length, velocity, accel, startDir, endDir, deviation, stopAfter, isRapid, routine = moveArrays
+        stopAfter[self.stopList] = True
+
+        # Drop zero length moves, keeping their stops
+        keep = length > 0
+        if not keep.all():
+            keepIndex = numpy.maximum.accumulate(numpy.where(keep,numpy.arange(keep.shape[0]),-1))
+            stopIndex = keepIndex[stopAfter & ~keep]
+            stopAfter[stopIndex[stopIndex >= 0]] = True
+            moveArrays = [x[keep] for x in (length,velocity,accel,startDir,endDir,deviation,stopAfter,isRapid,routine)]
+            length, velocity, accel, startDir, endDir, deviation, stopAfter, isRapid, routine = moveArrays
+
+        speedSqr = numpy.zeros((length.shape[0]+1,))
+        if length.shape[0] > 1:
+            cosTheta = -(endDir[:-1]*startDir[1:]).sum(axis=1)
+            junctionSqr = getJunctionSpeedSqr(cosTheta,numpy.minimum(accel[:-1],accel[1:]),deviation[:-1])
+            junctionSqr = numpy.minimum(junctionSqr,numpy.minimum(velocity[:-1],velocity[1:])**2)
+            junctionSqr[stopAfter[:-1]] = 0.0
+            speedSqr[1:-1] = junctionSqr
+        speedSqr = planSpeedSqr(speedSqr,2.0*accel*length)
+        speed = numpy.sqrt(speedSqr)
+        moveTimes = getMoveTimes(length,velocity,accel,speed[:-1],speed[1:])
+        return CycleTime(self.routineNames,moveTimes,isRapid,routine,dwellTimes)
+
+
+class CycleTime(object):
+    """
+    Cycle time estimate returned by CycleTimeEstimator. All times in seconds.
+
+    total       = total time
+    rapidTime   = time in rapid motions
+    feedTime    = time in feed motions (linear, arcs, splines)
+    dwellTime   = time in dwells
+    moveTimes   = array of times for the (non-zero length) moves
+    routineList = list of (name, time) in order of the routines in the
+                  program, the name is None for commands outside of routines.
+    """
+
+    def __init__(self,routineNames,moveTimes,isRapid,moveRoutines,dwellTimes):
+        self.moveTimes = moveTimes
+        self.rapidTime = float(moveTimes[isRapid].sum())
+        self.feedTime = float(moveTimes[~isRapid].sum())
+        self.dwellTime = float(dwellTimes.sum())
+        self.total = self.rapidTime + self.feedTime + self.dwellTime
+        routineTimes = numpy.bincount(moveRoutines,weights=moveTimes,minlength=len(routineNames))
+        routineTimes = routineTimes + dwellTimes
+        self.routineList = [(name,float(t)) for name, t in zip(routineNames,routineTimes)]
+        if self.routineList[0][1] == 0:
+            self.routineList = self.routineList[1:]
+
+    def getRoutineTotals(self):
+        """
+        Returns OrderedDict of total time by routine name.
+        """
+        totals = collections.OrderedDict()
+        for name, t in self.routineList:
+            totals[name] = totals.get(name,0.0) + t
+        return totals
+
+    def __str__(self):
+        lines = ['Cycle time: {0}'.format(formatTime(self.total))]
+        lines.append('  rapid:  {0}'.format(formatTime(self.rapidTime)))
+        lines.append('  feed:   {0}'.format(formatTime(self.feedTime)))
+        lines.append('  dwell:  {0}'.format(formatTime(self.dwellTime)))
+        for name, t in self.routineList:
+            if name is None:
+                name = '(outside routines)'
+            lines.append('  {0}: {1}'.format(name,formatTime(t)))
+        return '\n'.join(lines)
+
+
+# Utility functions
+# -----------------------------------------------------------------------------
+
+def estimateCycleTime(obj,**kwargs):
+    """
+    Returns CycleTime for GCodeProg or ToolPath obj. The keyword arguments are
+    passed to CycleTimeEstimator.
+    """
+    return CycleTimeEstimator(**kwargs).estimate(obj)
+
+
+def getToolPath(prog):
+    """
+    Returns toolpath.ToolPath with the commands in prog. The motion codes and
+    words are gathered in bulk with C level iterators (itertools and operator
+    getters) instead of ToolPath.add per command, and ModalMotions are stored
+    as explicit rapids or linear feeds of the current motion mode.
+    """
+    listOfCmds = prog.listOfCmds
+    numCmds = len(listOfCmds)
+    if numCmds == 0:
+        return toolpath.ToolPath()
+    classes = itertools.imap(type,listOfCmds)
+    codes = numpy.fromiter(itertools.imap(CLASS_TO_MOTION.get,classes,itertools.repeat(0)),dtype=int,count=numCmds)
+
+    isArc = codes >= toolpath.MOTION_ARC_XY_CW
+    arcRows = numpy.flatnonzero(isArc)
+    arcCodes = codes[arcRows]
+    offsets = numpy.full((numCmds,3),numpy.nan)
+    for cls, getter, columns in ARC_OFFSETS:
+        rows = arcRows[arcCodes == CLASS_TO_MOTION[cls]]
+        if rows.shape[0]:
+            offsets[rows[:,None],columns] = gatherMotionWords(listOfCmds,rows,getter,2)
+    arcCmds = map(listOfCmds.__getitem__,arcRows.tolist())
+    if arcCmds:
+        codes[arcRows] += numpy.array(map(DIRECTION_GETTER,arcCmds)) == 'ccw'
+
+    # Modal motions continue the last rapid or linear feed. After canned
+    # cycle commands they are kept in the side table as cycle repeats.
+    isCycle = codes == -2
+    codes[isCycle] = toolpath.MOTION_NONE
+    isModal = codes < 0
+    if isModal.any():
+        isSet = (codes > 0) | isCycle
+        lastIndex = numpy.maximum.accumulate(numpy.where(isSet,numpy.arange(numCmds),0))
+        lastCode = numpy.where(isSet[lastIndex],codes[lastIndex],0)
+        lastCode[lastCode >= toolpath.MOTION_ARC_XY_CW] = 0
+        codes[isModal] = lastCode[isModal]
+
+    motionRows = numpy.flatnonzero(codes > 0)
+    axes = numpy.full((numCmds,3),numpy.nan)
+    axes[motionRows] = gatherMotionWords(listOfCmds,motionRows,AXES_GETTER,3)
+
+    toolPath = toolpath.ToolPath(capacity=numCmds)
+    toolPath.addRows(codes.astype(numpy.uint8),axes,offsets)
+    for i in numpy.flatnonzero(codes == toolpath.MOTION_NONE).tolist():
+        toolPath.sideTable[i] = listOfCmds[i]
+    arcTurns = map(TURNS_GETTER,map(MOTION_DICT_GETTER,arcCmds))
+    for i, p in zip(arcRows.tolist(),arcTurns):
+        if p is not None:
+            toolPath.sideTable[i] = {'p': p}
+    return toolPath
+
+
+def gatherMotionWords(listOfCmds,rows,getter,numWords):
+    """
+    Returns (len(rows),numWords) array of the motionDict values given by
+    getter (an itemgetter of numWords words) of the commands at rows, with
+    NaN for missing (None) words.
+    """
+    motionDicts = itertools.imap(MOTION_DICT_GETTER,itertools.imap(listOfCmds.__getitem__,rows.tolist()))
+    values = list(itertools.chain.from_iterable(itertools.imap(getter,motionDicts)))
+    return numpy.array(values,dtype=float).reshape((rows.shape[0],numWords))
+
+
+def fillForward(axes,initial):
+    """
+    Returns copy of axes with NaN values replaced by the last value above in
+    the same column (or by initial).
+    """
+    filled = numpy.vstack((initial,axes))
+    index = numpy.where(numpy.isnan(filled),0,numpy.arange(filled.shape[0])[:,None])
+    numpy.maximum.accumulate(index,axis=0,out=index)
+    return filled[index,numpy.arange(filled.shape[1])][1:]
+
+
+def getArcMotions(codes,start,end,offsets,turns):
+    """
+    Returns lengths, start and end directions (unit vectors) and radii of the
+    helical motions with given motion codes, start and end points, i,j,k
+    offsets and number of turns.
+    """
+    rows = numpy.arange(codes.shape[0])
+    axis0, axis1, axisH, sense = ARC_TABLE[codes].T
+    center = start + numpy.nan_to_num(offsets)
+    u0 = start[rows,axis0] - center[rows,axis0]
+    v0 = start[rows,axis1] - center[rows,axis1]
+    u1 = end[rows,axis0] - center[rows,axis0]
+    v1 = end[rows,axis1] - center[rows,axis1]
+    radius = numpy.sqrt(u0**2 + v0**2)
+    angle0 = numpy.arctan2(v0,u0)
+    angle1 = numpy.arctan2(v1,u1)
+    sweep = numpy.mod(sense*(angle1 - angle0),2*math.pi)
+    sweep[sweep < 1.0e-9] = 2*math.pi
+    sweep += 2*math.pi*(turns - 1)
+    height = end[rows,axisH] - start[rows,axisH]
+    length = numpy.sqrt((radius*sweep)**2 + height**2)
+
+    dirList = []
+    for angle in (angle0, angle1):
+        direction = numpy.zeros(start.shape)
+        with numpy.errstate(invalid='ignore',divide='ignore'):
+            direction[rows,axis0] = -sense*numpy.sin(angle)*radius*sweep/length
+            direction[rows,axis1] = sense*numpy.cos(angle)*radius*sweep/length
+            direction[rows,axisH] = height/length
+        dirList.append(direction)
+    return length, dirList[0], dirList[1], radius
+
+
+def getJunctionSpeedSqr(cosTheta,accel,deviation):
+    """
+    Returns the squared max speeds through junctions (junction deviation
+    model). cosTheta is the cosine of the angle between the reversed incoming
+    and the outgoing direction, i.e. -1 for colinear moves and 1 for a
+    reversal.
+    """
+    sinHalf = numpy.sqrt(numpy.clip(0.5*(1.0 - cosTheta),0.0,1.0))
+    with numpy.errstate(invalid='ignore',divide='ignore'):
+        speedSqr = accel*deviation*sinHalf/(1.0 - sinHalf)
+    speedSqr[sinHalf >= 1.0 - 1.0e-12] = numpy.inf
+    speedSqr[numpy.isnan(speedSqr)] = 0.0
+    return speedSqr
+
+
+def planSpeedSqr(speedSqr,deltaSqr):
+    """
+    Lowers the squared junction speeds (length n+1) so that each move (length
+    n) can be traversed, i.e. speedSqr[i+1] <= speedSqr[i] + deltaSqr[i] and
+    speedSqr[i] <= speedSqr[i+1] + deltaSqr[i], where deltaSqr = 2*accel*length.
+    The backward and forward passes of the usual planner are written as
+    cumulative minimums over (speedSqr - cumulative deltaSqr).
+    """
+    suffixSum = numpy.zeros(speedSqr.shape)
+    suffixSum[:-1] = numpy.cumsum(deltaSqr[::-1])[::-1]
+    speedSqr = suffixSum + numpy.minimum.accumulate((speedSqr - suffixSum)[::-1])[::-1]
+    prefixSum = numpy.zeros(speedSqr.shape)
+    prefixSum[1:] = numpy.cumsum(deltaSqr)
+    speedSqr = prefixSum + numpy.minimum.accumulate(speedSqr - prefixSum)
+    return numpy.maximum(speedSqr,0.0)
+
+
+def getMoveTimes(length,velocity,accel,entrySpeed,exitSpeed):
+    """
+    Returns times for moves with trapezoidal (or triangular) velocity profiles
+    given the lengths, cruise velocities, accelerations and entry and exit
+    speeds.
+    """
+    entrySqr = entrySpeed**2
+    exitSqr = exitSpeed**2
+    peakSqr = numpy.minimum(0.5*(entrySqr + exitSqr) + accel*length, velocity**2)
+    peakSqr = numpy.maximum(peakSqr,numpy.maximum(entrySqr,exitSqr))
+    peakSpeed = numpy.sqrt(peakSqr)
+    accelDist = (peakSqr - entrySqr)/(2.0*accel)
+    decelDist = (peakSqr - exitSqr)/(2.0*accel)
+    cruiseDist = numpy.maximum(length - accelDist - decelDist, 0.0)
+    return (peakSpeed - entrySpeed)/accel + (peakSpeed - exitSpeed)/accel + cruiseDist/peakSpeed
+
+
+def getFloatOrNan(value):
+    if value is None:
+        return numpy.nan
+    else:
+        return float(value)
+
+
+def formatTime(seconds):
+    """
+    Returns time string h:mm:ss.s
+    """
+    minutes, seconds = divmod(seconds,60.0)
+    hours, minutes = divmod(int(minutes),60)
+    return '{0}:{1:02d}:{2:04.1f}'.format(hours,minutes,seconds)
+
+
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    import sys
+    import time
+
+    if len(sys.argv) > 1:
+        import gcode_reader
+        t0 = time.time()
+        toolPath = gcode_reader.readToolPath(sys.argv[1])
+        t1 = time.time()
+        feedRate = float(sys.argv[2]) if len(sys.argv) > 2 else None
+        cycleTime = estimateCycleTime(toolPath,feedRate=feedRate)
+        t2 = time.time()
+        print(cycleTime)
+        print('read: {0:1.2f}s, estimate: {1:1.2f}s'.format(t1-t0,t2-t1))
+    else:
+        import cnc_path
+        prog = gcode_cmd.GCodeProg()
+        prog.add(gcode_cmd.GenericStart())
+        prog.add(gcode_cmd.FeedRate(10.0))
+        prog.add(gcode_cmd.RapidMotion(x=0,y=0,z=0.1))
+        prog.add(cnc_path.RectPath((0,0),(1,2),radius=0.2,helix=(0,-0.1)))
+        prog.add(gcode_cmd.Dwell(0.5))
+        prog.add(gcode_cmd.PeckDrillCycle(x=0.5,y=0.5,z=-0.5,r=0.1,q=0.1))
+        print(estimateCycleTime(prog))
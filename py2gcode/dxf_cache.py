@@ -0,0 +1,253 @@
+"""
+
+Copyright 2014 IO Rodeo Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+from __future__ import print_function
+import os
+import hashlib
+import tempfile
+import cPickle as pickle
+import dxfgrabber
+
+CACHE_VERSION = 1
+CACHE_FILE_EXT = '.dxfcache'
+DEFAULT_MAX_CACHE_SIZE = 256*2**20
+
+# Entity types stored in cache and the geometry attributes for each type
+CACHE_ENTITY_ATTR = {
+        'LINE'   : ('start', 'end'),
+        'ARC'    : ('center', 'radius', 'start_angle', 'end_angle'),
+        'CIRCLE' : ('center', 'radius'),
+        'POINT'  : ('point',),
+        }
+
+
+class CachedLayer(object):
+
+    __slots__ = ('name',)
+
+    def __init__(self,name):
+        self.name = name
+
+
+class CachedEntity(object):
+    """
+    Light weight stand-in for dxfgrabber entities restored from the cache.
+    Only the attributes used by py2gcode are provided.
+    """
+
+    __slots__ = (
+            'dxftype',
+            'layer',
+            'start',
+            'end',
+            'center',
+            'radius',
+            'start_angle',
+            'end_angle',
+            'point',
+            )
+
+    def __init__(self,dxftype,layer,geometry):
+        self.dxftype = dxftype
+        self.layer = layer
+        for name, value in zip(CACHE_ENTITY_ATTR[dxftype], geometry):
+            setattr(self,name,value)
+
+    @property
+    def startangle(self):
+        return self.start_angle
+
+    @property
+    def endangle(self):
+        return self.end_angle
+
+
+class CachedDrawing(object):
+    """
+    Drawing restored from the cache. Has the same 'layers' and 'entities'
+    interface as dxfgrabber drawings for the cached entity types.
+    """
+
+    def __init__(self,filename,layerNameList,entityList):
+        self.filename = filename
+        self.layers = [CachedLayer(name) for name in layerNameList]
+        self.entities = entityList
+
+
+class DxfCache(object):
+    """
+    Disk cache of parsed dxf files. Only the entities types in
+    CACHE_ENTITY_ATTR are stored, in a compact form consisting of the entity
+    type, layer and geometry.  Cache entries are keyed by file path,
+    modification time and size and the total size of the cache directory is
+    kept below maxSize by removing the least recently used entries.
+    """
+
+    def __init__(self,cacheDir,maxSize=DEFAULT_MAX_CACHE_SIZE):
+        self.cacheDir = os.path.abspath(os.path.expanduser(cacheDir))
+        self.maxSize = int(maxSize)
+        if not os.path.isdir(self.cacheDir):
+            os.makedirs(self.cacheDir)
+
+    def readfile(self,fileName):
+        cacheFileName = self.getCacheFileName(fileName)
+        try:
+            dwg = self.load(cacheFileName)
+        except (IOError, OSError):
+            # Missing or unreadable entry
+            dwg = None
+        except Exception:
+            # Corrupt, truncated or stale entry - unpickling can raise almost
+            # anything, so remove the entry and re-read the dxf file.
+            self.remove(cacheFileName)
+            dwg = None
+        if dwg is None:
+            dwg = dxfgrabber.readfile(fileName)
+            self.store(cacheFileName,dwg)
+        return dwg
+
+    def getKey(self,fileName):
+        fileName = os.path.abspath(fileName)
+        fileStat = os.stat(fileName)
+        keyStr = '{0}|{1!r}|{2}|{3}'.format(
+                fileName,
+                fileStat.st_mtime,
+                fileStat.st_size,
+                CACHE_VERSION
+                )
+        return hashlib.sha1(keyStr.encode('utf-8')).hexdigest()
+
+    def getCacheFileName(self,fileName):
+        return os.path.join(self.cacheDir, self.getKey(fileName) + CACHE_FILE_EXT)
+
+    def load(self,cacheFileName):
+        with open(cacheFileName,'rb') as f:
+            filename, layerNameList, entityLayerList, compactList = pickle.load(f)
+        # Touch cache file so that it is the most recently used
+        os.utime(cacheFileName,None)
+        entityList = [
+                CachedEntity(dxftype,entityLayerList[layerInd],geometry)
+                for dxftype, layerInd, geometry in compactList
+                ]
+        return CachedDrawing(filename,layerNameList,entityList)
+
+    def store(self,cacheFileName,dwg):
+        layerNameList = [layer.name for layer in dwg.layers]
+        entityLayerList = []
+        layerToIndDict = {}
+        compactList = []
+        for entity in dwg.entities:
+            try:
+                attrNames = CACHE_ENTITY_ATTR[entity.dxftype]
+            except KeyError:
+                continue
+            try:
+                layerInd = layerToIndDict[entity.layer]
+            except KeyError:
+                layerInd = len(entityLayerList)
+                entityLayerList.append(entity.layer)
+                layerToIndDict[entity.layer] = layerInd
+            geometry = tuple(getEntityAttr(entity,name) for name in attrNames)
+            compactList.append((entity.dxftype, layerInd, geometry))
+        data = (getattr(dwg,'filename',None), layerNameList, entityLayerList, compactList)
+
+        # Write to temporary file then rename so that partial files are never read
+        fd, tmpFileName = tempfile.mkstemp(dir=self.cacheDir)
+        with os.fdopen(fd,'wb') as f:
+            pickle.dump(data,f,pickle.HIGHEST_PROTOCOL)
+        os.rename(tmpFileName,cacheFileName)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes least recently used entries until cache size <= maxSize.
+        """
+        entryList = []
+        for name in os.listdir(self.cacheDir):
+            if not name.endswith(CACHE_FILE_EXT):
+                continue
+            cacheFileName = os.path.join(self.cacheDir,name)
+            try:
+                fileStat = os.stat(cacheFileName)
+            except OSError:
+                continue
+            entryList.append((fileStat.st_mtime, fileStat.st_size, cacheFileName))
+        entryList.sort()
+        totalSize = sum(size for mtime, size, cacheFileName in entryList)
+        for mtime, size, cacheFileName in entryList:
+            if totalSize <= self.maxSize:
+                break
+            try:
+                os.remove(cacheFileName)
+            except OSError:
+                continue
+            totalSize -= size
+
+    def remove(self,cacheFileName):
+        try:
+            os.remove(cacheFileName)
+        except OSError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.cacheDir):
+            if name.endswith(CACHE_FILE_EXT):
+                os.remove(os.path.join(self.cacheDir,name))
+
+
+# Utility functions
+# -----------------------------------------------------------------------------
+
+def getDrawing(param):
+    """
+    Returns drawing for the given routine parameters. Uses param['dwg'] if
+    given, otherwise reads param['fileName'] - via the cache when
+    param['dxfCacheDir'] is given.
+    """
+    try:
+        return param['dwg']
+    except KeyError:
+        pass
+    try:
+        cacheDir = param['dxfCacheDir']
+    except KeyError:
+        cacheDir = None
+    try:
+        maxCacheSize = param['dxfCacheMaxSize']
+    except KeyError:
+        maxCacheSize = DEFAULT_MAX_CACHE_SIZE
+    return readfile(param['fileName'],cacheDir=cacheDir,maxCacheSize=maxCacheSize)
+
+def readfile(fileName,cacheDir=None,maxCacheSize=DEFAULT_MAX_CACHE_SIZE):
+    if cacheDir is None:
+        return dxfgrabber.readfile(fileName)
+    else:
+        return DxfCache(cacheDir,maxSize=maxCacheSize).readfile(fileName)
+
+def getEntityAttr(entity,name):
+    if name in ('start_angle', 'end_angle'):
+        try:
+            value = getattr(entity,name)
+        except AttributeError:
+            value = getattr(entity,name.replace('_',''))
+    else:
+        value = getattr(entity,name)
+    if isinstance(value,(tuple,list)):
+        value = tuple(float(x) for x in value)
+    else:
+        value = float(value)
+    return value
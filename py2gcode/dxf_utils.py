@@ -17,6 +17,65 @@ limitations under the License.
 """
 from __future__ import print_function
 import math
+import heapq
+import weakref
+import geom_utils
+
+# Entity indices shared by all routines using the same drawing
+_entityIndexCache = weakref.WeakKeyDictionary()
+
+
+class EntityIndex(object):
+    """
+    Index of drawing entities by (layer, dxftype). Stores the position of
+    each entity in dwg.entities so that lookups return entities in drawing
+    order.
+    """
+
+    def __init__(self,dwg):
+        self.entities = list(dwg.entities)
+        self.layerNameList = [layer.name for layer in dwg.layers]
+        self.posDict = {}
+        for pos, entity in enumerate(self.entities):
+            key = (entity.layer, entity.dxftype)
+            try:
+                self.posDict[key].append(pos)
+            except KeyError:
+                self.posDict[key] = [pos]
+
+    def getEntityList(self,layerNames,dxfTypes):
+        """
+        Returns list of entities, in drawing order, whose layer is in
+        layerNames and whose type is in dxfTypes.
+        """
+        dxfTypes = set(dxfTypes)
+        posListList = []
+        for layer in set(layerNames):
+            for dxfType in dxfTypes:
+                try:
+                    posListList.append(self.posDict[(layer,dxfType)])
+                except KeyError:
+                    pass
+        if len(posListList) == 1:
+            posIter = posListList[0]
+        else:
+            posIter = heapq.merge(*posListList)
+        return [self.entities[pos] for pos in posIter]
+
+
+def getEntityIndex(dwg):
+    """
+    Returns the EntityIndex for the drawing. The index is built once per
+    drawing and shared by all callers.
+    """
+    try:
+        return _entityIndexCache[dwg]
+    except KeyError:
+        pass
+    entityIndex = EntityIndex(dwg)
+    _entityIndexCache[dwg] = entityIndex
+    return entityIndex
+
 
 def getEntityStartAndEndPts(entity):
     if entity.dxftype == 'LINE':
@@ -33,6 +92,20 @@ def getDxfArcStartAndEndPts(arc):
     xc = arc.center[0]
     yc = arc.center[1]
     r = arc.radius
+    angStart, angEnd = getDxfArcAngles(arc)
+    x0 = xc + r*math.cos(angStart)
+    y0 = yc + r*math.sin(angStart)
+    x1 = xc + r*math.cos(angEnd)
+    y1 = yc + r*math.sin(angEnd)
+    startPt = x0,y0
+    endPt = x1,y1
+    return startPt,endPt
+
+def getDxfArcAngles(arc):
+    """
+    Returns start and end angles (radians) of dxf arc. The end angle is
+    adjusted so that it is >= the start angle.
+    """
     try:
         angStart = (math.pi/180.0)*arc.start_angle
     except AttributeError:
@@ -43,13 +116,53 @@ def getDxfArcStartAndEndPts(arc):
         angEnd = (math.pi/180.0)*arc.endangle
     if angEnd < angStart:
         angEnd += 2.0*math.pi 
-    x0 = xc + r*math.cos(angStart)
-    y0 = yc + r*math.sin(angStart)
-    x1 = xc + r*math.cos(angEnd)
-    y1 = yc + r*math.sin(angEnd)
-    startPt = x0,y0
-    endPt = x1,y1
-    return startPt,endPt
+    return angStart, angEnd
+
+def getArcTessellation(param):
+    """
+    Returns (maxArcLen, maxChordErr, minSegLen) for arc tessellation from the
+    parameter dictionary. When the optional maxChordErr parameter is given arcs
+    are tessellated by chord error, bounded by the optional minSegLen and
+    maxSegLen parameters, instead of by maxArcLen.
+    """
+    if 'maxChordErr' in param:
+        maxSegLen = param.get('maxSegLen',None)
+        return maxSegLen, param['maxChordErr'], param.get('minSegLen',None)
+    else:
+        return param['maxArcLen'], None, None
+
+def getDxfArcPointArray(arc, maxArcLen, maxChordErr=None, minSegLen=None):
+    """
+    Returns (N,2) array of points along dxf arc from start to end point. See
+    geom_utils.getArcMaxStepAngle for the tessellation options.
+    """
+    angStart, angEnd = getDxfArcAngles(arc)
+    return geom_utils.getArcPointArray(arc.center[:2],arc.radius,angStart,angEnd,maxArcLen,
+            maxChordErr,minSegLen)
+
+def getDxfArcSeg(arc):
+    """
+    Returns geom_utils.ArcSeg2D for dxf arc, counter clockwise from start to
+    end point.
+    """
+    angStart, angEnd = getDxfArcAngles(arc)
+    return geom_utils.ArcSeg2D(arc.center[:2],arc.radius,angStart,angEnd,'ccw')
+
+def getDxfArcPointArrayList(arcList, maxArcLen, maxChordErr=None, minSegLen=None):
+    """
+    Returns list of (N,2) point arrays, one for each dxf arc in arcList. All
+    arcs are tessellated together.
+    """
+    angList = [getDxfArcAngles(arc) for arc in arcList]
+    return geom_utils.getArcPointArrayList(
+            [arc.center[:2] for arc in arcList],
+            [arc.radius for arc in arcList],
+            [angStart for angStart, angEnd in angList],
+            [angEnd for angStart, angEnd in angList],
+            maxArcLen,
+            maxChordErr,
+            minSegLen
+            )
 
 def getDxfCircleStartAndEndPts(circle):
     xc = circle.center[0]
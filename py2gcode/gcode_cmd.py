@@ -16,12 +16,30 @@ limitations under the License.
 
 """
 from __future__ import print_function
+import math
+import collections
+import operator
+import itertools
+
+# Minimum length of a run of motion commands to be formatted as a block
+MIN_BLOCK_SIZE = 16
+
+# Markers placed after values in block templates (see GCodeFormat.trimBlock)
+TRIM_WORD_END = '\0'
+FIXED_WORD_END = '\1'
 
 
 # GCode program
 # -----------------------------------------------------------------------------
 class GCodeProg(object):
 
+    lineNumbers = False
+    lineNumberStep = 2
+    writeChunkSize = 2000  # number of lines formatted per write when streaming
+    fmt = None             # GCodeFormat number formatting policy (None = default)
+    statsHeader = False    # write ProgStats as header comment block if True
+    _stats = None
+
     def __init__(self):
         self.listOfCmds = []
         self.lineNumbers = False
@@ -33,20 +51,117 @@ class GCodeProg(object):
                 obj.comment = True
             self.listOfCmds.append(obj)
         else:
+            if isinstance(obj,GCodeProg) and (self._stats is not None or obj._stats is not None):
+                # Stats have been requested - record child for merging
+                self._getStats().addChild(len(self.listOfCmds),obj)
             self.listOfCmds.extend(obj.listOfCmds)
 
+    def _getStats(self):
+        stats = self._stats
+        if stats is None or not stats.isTracking(self.listOfCmds):
+            stats = ProgStats()
+            stats.listRef = self.listOfCmds
+            self._stats = stats
+        return stats
+
+    def getStats(self):
+        """
+        Returns ProgStats for the program. The stats are kept between calls
+        and updated incrementally - only commands added since the last call
+        are processed and the stats of added programs are merged.
+        """
+        stats = self._getStats()
+        stats.updateList(self.listOfCmds)
+        return stats
+
+    def getStatsHeader(self):
+        """
+        Returns list of comment commands with the program stats.
+        """
+        listOfCmds = [Comment(x) for x in self.getStats().getCommentList()]
+        listOfCmds.append(Space())
+        return listOfCmds
+
     def __str__(self):
-        listOfStr = [x.__str__() for x in self.listOfCmds]
+        return ''.join(self.iterChunks())
+
+    def iterLines(self):
+        """
+        Generator which yields the program lines (w/o newlines) one at a time.
+        Line numbers are added on the fly if enabled.
+        """
+        fmt = self.fmt
+        if self.statsHeader:
+            for cmd in self.getStatsHeader():
+                yield cmd.format(fmt)
         if self.lineNumbers:
             step = self.lineNumberStep
-            listOfStr = ['N{0} {1}'.format(step*i,x) for i,x in enumerate(listOfStr)]
-        listOfStr.append('')
-        return '\n'.join(listOfStr)
+            for i, cmd in enumerate(self.listOfCmds):
+                yield 'N{0} {1}'.format(step*i,cmd.format(fmt))
+        else:
+            for cmd in self.listOfCmds:
+                yield cmd.format(fmt)
 
+    def iterChunks(self,chunkSize=None):
+        """
+        Generator which yields the program text in chunks of at most chunkSize
+        lines. Each chunk ends with a newline.
+        """
+        if chunkSize is None:
+            chunkSize = self.writeChunkSize
+        if self.statsHeader:
+            yield formatCmdList(self.getStatsHeader(),self.fmt)
+        for i in range(0,len(self.listOfCmds),chunkSize):
+            yield self.formatCmds(self.listOfCmds[i:i+chunkSize],lineStart=i)
+
+    def formatCmds(self,listOfCmds,lineStart=0):
+        """
+        Returns program text, newline terminated lines, for listOfCmds. 
+        lineStart is the position of the first command in the program (for
+        line numbers). Runs of RapidMotions, LinearFeeds or ModalMotions are
+        formatted as blocks from coordinate arrays.
+        """
+        return ''.join(self.iterRunText(listOfCmds,lineStart))
 
-    def write(self,filename):
-        with open(filename,'w') as f:
-            f.write(self.__str__());
+    def iterRunText(self,listOfCmds,lineStart=0):
+        """
+        Generator which yields the text of each run of commands in listOfCmds,
+        see formatCmds.
+        """
+        fmt = self.fmt
+        step = self.lineNumberStep
+        for i0, i1, isBlock in getMotionRunList(listOfCmds):
+            lineNumber = step*(lineStart + i0) if self.lineNumbers else None
+            if isBlock:
+                yield formatMotionRun(listOfCmds[i0:i1],fmt,lineNumber,step)
+            else:
+                yield formatCmdList(listOfCmds[i0:i1],fmt,lineNumber,step)
+
+    def write(self,filename,chunkSize=None):
+        """
+        Writes program to filename, or to filename.write if filename is a file
+        like object (e.g. sys.stdout, a pipe or a gzip.GzipFile). The program
+        is formatted and written in chunks so the full program string is never
+        created.
+        """
+        if hasattr(filename,'write'):
+            self.writeStream(filename,chunkSize=chunkSize)
+        else:
+            with open(filename,'w') as f:
+                self.writeStream(f,chunkSize=chunkSize)
+
+    def writeStream(self,stream,chunkSize=None):
+        """
+        Writes program to stream. The text of each run of commands (see
+        formatCmds) is written as soon as it is formatted.
+        """
+        if chunkSize is None:
+            chunkSize = self.writeChunkSize
+        if self.statsHeader:
+            stream.write(formatCmdList(self.getStatsHeader(),self.fmt))
+        for i in range(0,len(self.listOfCmds),chunkSize):
+            for text in self.iterRunText(self.listOfCmds[i:i+chunkSize],lineStart=i):
+                stream.write(text)
 
 
 # Basic program starts (TODO: move this to separate module)
@@ -74,6 +189,640 @@ class GenericStart(GCodeProg):
             self.add(FeedRate(feedrate),comment=comment)
 
 
+# Number formatting
+# -----------------------------------------------------------------------------
+
+class GCodeFormat(object):
+    """
+    Number formatting policy for gcode output. Set as the fmt attribute of a
+    GCodeProg - when fmt is None the default formatting is used.
+
+    Values are written with a fixed number of decimal places for each group
+    of words, trailing zeros (and decimal points) are trimmed and negative
+    zero is written as 0.
+
+    linearPlaces  = decimal places for linear axes (x,y,z,u,v,w) and canned
+                    cycle r and q words
+    angularPlaces = decimal places for rotary axes (a,b,c)
+    offsetPlaces  = decimal places for arc and spline offsets (i,j,k),
+                    defaults to linearPlaces
+    otherPlaces   = decimal places for everything else (feed rate, dwell etc.)
+    trimZeros     = trim trailing zeros if True
+    """
+
+    linearWords = ('x','y','z','u','v','w','r','q')
+    angularWords = ('a','b','c')
+    offsetWords = ('i','j','k')
+
+    def __init__(self,linearPlaces=4,angularPlaces=3,offsetPlaces=None,otherPlaces=4,trimZeros=True):
+        if offsetPlaces is None:
+            offsetPlaces = linearPlaces
+        self.linearPlaces = int(linearPlaces)
+        self.angularPlaces = int(angularPlaces)
+        self.offsetPlaces = int(offsetPlaces)
+        self.otherPlaces = int(otherPlaces)
+        self.trimZeros = trimZeros
+        self.wordToPlaces = {}
+        for words, places in (
+                (self.linearWords, self.linearPlaces),
+                (self.angularWords, self.angularPlaces),
+                (self.offsetWords, self.offsetPlaces),
+                ):
+            for word in words:
+                self.wordToPlaces[word] = places
+        self.valueFormatterDict = {}
+        self.wordTemplateListDict = {}
+        self.wordTemplateDictDict = {}
+
+    def getValueFormatter(self,places):
+        """
+        Returns function which formats a value with given number of decimal
+        places.
+        """
+        try:
+            return self.valueFormatterDict[places]
+        except KeyError:
+            pass
+        template, trim, negZeroStr, zeroStr = self.getTemplateInfo('',places)
+        def formatValue(value):
+            valueStr = template % float(value)
+            if valueStr[-1] == '0':
+                if trim:
+                    valueStr = valueStr.rstrip('0')
+                    if valueStr[-1] == '.':
+                        valueStr = valueStr[:-1]
+                        if valueStr == negZeroStr:
+                            valueStr = zeroStr
+                elif valueStr == negZeroStr:
+                    valueStr = zeroStr
+            return valueStr
+        self.valueFormatterDict[places] = formatValue
+        return formatValue
+
+    def getWordFormatter(self,word):
+        places = self.wordToPlaces.get(word.lower(),self.otherPlaces)
+        return self.getValueFormatter(places)
+
+    def getTemplateInfo(self,prefix,places):
+        """
+        Returns (template, trim, negZeroStr, zeroStr) for values with the given
+        prefix and number of decimal places. negZeroStr is negative zero as
+        formatted (and trimmed), to be replaced by zeroStr. Both end in '0',
+        so values which don't end in '0' need no further checks.
+        """
+        template = '{0}%.{1}f'.format(prefix,places)
+        trim = self.trimZeros and places > 0
+        negZeroStr = template % -0.0
+        zeroStr = template % 0.0
+        if trim:
+            negZeroStr = negZeroStr.rstrip('0').rstrip('.')
+            zeroStr = zeroStr.rstrip('0').rstrip('.')
+        return template, trim, negZeroStr, zeroStr
+
+    def getWordTemplateList(self,cls,words,intWords=()):
+        """
+        Returns list of (word, template, valueType, trim, negZeroStr, zeroStr)
+        for the given command class and words, see getTemplateInfo. The list
+        is computed once per class.
+        """
+        try:
+            return self.wordTemplateListDict[cls]
+        except KeyError:
+            pass
+        wordTemplateList = []
+        for word in words:
+            if word in intWords:
+                templateInfo = ('{0}%d'.format(word.upper()), False, None, None)
+                valueType = int
+            else:
+                places = self.wordToPlaces.get(word,self.otherPlaces)
+                templateInfo = self.getTemplateInfo(word.upper(),places)
+                valueType = float
+            wordTemplateList.append((word, templateInfo[0], valueType) + templateInfo[1:])
+        self.wordTemplateListDict[cls] = wordTemplateList
+        self.wordTemplateDictDict[cls] = dict((x[0], x[1:]) for x in wordTemplateList)
+        return wordTemplateList
+
+    def appendWords(self,cmdList,cls,words,valueDict,intWords=()):
+        """
+        Appends formatted words, for values in valueDict which aren't None, to
+        cmdList. Words in intWords are written as integers.
+        """
+        try:
+            wordTemplateDict = self.wordTemplateDictDict[cls]
+        except KeyError:
+            self.getWordTemplateList(cls,words,intWords)
+            wordTemplateDict = self.wordTemplateDictDict[cls]
+        for word in words:
+            value = valueDict[word]
+            if value is None:
+                continue
+            template, valueType, trim, negZeroStr, zeroStr = wordTemplateDict[word]
+            try:
+                valueStr = template % value
+            except TypeError:
+                valueStr = template % valueType(value)
+            if valueStr[-1] == '0':
+                if trim:
+                    valueStr = valueStr.rstrip('0')
+                    if valueStr[-1] == '.':
+                        valueStr = valueStr[:-1]
+                        if valueStr == negZeroStr:
+                            valueStr = zeroStr
+                elif valueStr == negZeroStr:
+                    valueStr = zeroStr
+            cmdList.append(valueStr)
+
+    def getBlockTemplateList(self,cls,words):
+        """
+        Returns list of value templates, for formatting blocks of commands of
+        the given class, each followed by a marker for trimBlock.
+        """
+        templateList = []
+        for word, template, valueType, trim, negZeroStr, zeroStr in self.getWordTemplateList(cls,words):
+            templateList.append(template + (TRIM_WORD_END if trim else FIXED_WORD_END))
+        return templateList
+
+    def trimBlock(self,text):
+        """
+        Trims zeros and negative zeros in block text formatted with the
+        templates from getBlockTemplateList and removes the markers. Uses a
+        few str.replace passes over the whole block.
+        """
+        placesList = sorted(set(self.wordToPlaces.values() + [self.otherPlaces]))
+        if TRIM_WORD_END in text:
+            # The decimal point stops the zero trimming before integer digits
+            for n in range(placesList[-1],0,-1):
+                text = text.replace('0'*n + TRIM_WORD_END, TRIM_WORD_END)
+            text = text.replace('.' + TRIM_WORD_END, TRIM_WORD_END)
+            text = text.replace('-0' + TRIM_WORD_END, '0' + TRIM_WORD_END)
+            text = text.replace(TRIM_WORD_END, '')
+        if FIXED_WORD_END in text:
+            for places in placesList:
+                zeroStr = '%.{0}f'.format(places) % 0.0 + FIXED_WORD_END
+                text = text.replace('-' + zeroStr, zeroStr)
+            text = text.replace(FIXED_WORD_END, '')
+        return text
+
+    def formatValue(self,value,word=None):
+        if word is None:
+            return self.getValueFormatter(self.otherPlaces)(value)
+        else:
+            return self.getWordFormatter(word)(value)
+
+
+# Program statistics
+# -----------------------------------------------------------------------------
+
+class PathTotals(object):
+    """
+    Extents of the tool position, z range of the feed motions and cut (feed)
+    and rapid path lengths of part of a program.
+    """
+
+    def __init__(self):
+        self.extentsMin = [float('inf')]*3
+        self.extentsMax = [float('-inf')]*3
+        self.cutZMin = float('inf')
+        self.cutZMax = float('-inf')
+        self.cutLength = 0.0
+        self.rapidLength = 0.0
+
+    def addPoint(self,point):
+        for k, value in enumerate(point):
+            if value is not None:
+                if value < self.extentsMin[k]:
+                    self.extentsMin[k] = value
+                if value > self.extentsMax[k]:
+                    self.extentsMax[k] = value
+
+    def addCutZ(self,z):
+        if z is not None:
+            self.cutZMin = min(self.cutZMin,z)
+            self.cutZMax = max(self.cutZMax,z)
+
+    def merge(self,other):
+        self.extentsMin = [min(a,b) for a,b in zip(self.extentsMin,other.extentsMin)]
+        self.extentsMax = [max(a,b) for a,b in zip(self.extentsMax,other.extentsMax)]
+        self.cutZMin = min(self.cutZMin,other.cutZMin)
+        self.cutZMax = max(self.cutZMax,other.cutZMax)
+        self.cutLength += other.cutLength
+        self.rapidLength += other.rapidLength
+
+
+class ProgStats(object):
+    """
+    Aggregate statistics of a program: extents (bounding box) of the tool
+    position, z range of the feed motions, cut (feed) and rapid path lengths
+    and a histogram of the command classes. Returned by GCodeProg.getStats.
+
+    Stats are updated one command at a time. Programs are assumed to start in
+    absolute distance mode and 'prior' canned cycle return mode at an unknown
+    position. Commands before the motion mode is known, and while an axis
+    has been moved relative to its unknown start value (e.g. by a canned
+    cycle), are kept in a head list, which is replayed when the stats are
+    merged into those of an enclosing program. After the head an unknown axis
+    still has the value it had at the start of the program, so the (at most
+    one per axis) segments moving an axis from its unknown start value are
+    kept, with the fact that feeds were made at the start z, and completed
+    with the enclosing program's position when merging. Merging thus doesn't
+    depend on the number of commands after the head. Programs with arcs,
+    splines, canned cycles or incremental moves depending on unknown start
+    values after the head, or with modal moves in the head merged after a
+    canned cycle, are processed one command at a time. Lengths of moves from
+    unknown positions and canned cycles in incremental mode aren't counted.
+    """
+
+    helicalAxesDict = {}  # Filled in below the helical motion classes
+
+    def __init__(self):
+        self.numCmds = 0
+        self.classCounts = collections.Counter()
+        self.position = [None, None, None]
+        self.absolute = True
+        self.motionClass = None
+        self.cycleParams = None
+        self.returnMode = 'prior'
+        self.head = []
+        self.headTotals = None
+        self.totals = PathTotals()
+        self.pendingSegments = []
+        self.cutAtStartZ = False
+        self.mergeable = True
+        self.lostAxes = set()
+        self.modalInHead = False
+        # Tracking of the program's list of commands
+        self.listRef = None
+        self.lastCmd = None
+        self.childQueue = collections.deque()
+
+    @property
+    def resolved(self):
+        return self.headTotals is not None
+
+    def getTotals(self):
+        """
+        Returns PathTotals for the whole program.
+        """
+        totals = PathTotals()
+        if self.headTotals is not None:
+            totals.merge(self.headTotals)
+        totals.merge(self.totals)
+        return totals
+
+    @property
+    def extents(self):
+        """
+        List of (min, max) for the x,y,z axes, None for axes which are never
+        set.
+        """
+        totals = self.getTotals()
+        extents = []
+        for minValue, maxValue in zip(totals.extentsMin,totals.extentsMax):
+            extents.append(None if minValue > maxValue else (minValue,maxValue))
+        return extents
+
+    @property
+    def zRange(self):
+        return self.extents[2]
+
+    @property
+    def cutZRange(self):
+        """
+        (min, max) z of the feed motions, None if there are none.
+        """
+        totals = self.getTotals()
+        if totals.cutZMin > totals.cutZMax:
+            return None
+        return (totals.cutZMin, totals.cutZMax)
+
+    @property
+    def cutLength(self):
+        return self.getTotals().cutLength
+
+    @property
+    def rapidLength(self):
+        return self.getTotals().rapidLength
+
+    def isTracking(self,listOfCmds):
+        """
+        Returns True if the stats are for the first numCmds commands of
+        listOfCmds.
+        """
+        if listOfCmds is not self.listRef or len(listOfCmds) < self.numCmds:
+            return False
+        return self.numCmds == 0 or listOfCmds[self.numCmds-1] is self.lastCmd
+
+    def addChild(self,index,prog):
+        """
+        Records that the commands of prog were added to the program at index.
+        """
+        self.childQueue.append((index,len(prog.listOfCmds),prog))
+
+    def updateList(self,listOfCmds):
+        """
+        Updates the stats with the commands of listOfCmds added since the last
+        update. The stats of added child programs are merged if possible.
+        """
+        childQueue = self.childQueue
+        i = self.numCmds
+        n = len(listOfCmds)
+        while i < n:
+            while childQueue and childQueue[0][0] < i:
+                childQueue.popleft()
+            if childQueue and childQueue[0][0] == i:
+                index, count, prog = childQueue.popleft()
+                childStats = prog.getStats()
+                if count and childStats.numCmds == count and childStats.lastCmd is listOfCmds[i+count-1]:
+                    if self.merge(childStats):
+                        i += count
+                        continue
+            stop = childQueue[0][0] if childQueue else n
+            for cmd in listOfCmds[i:max(min(stop,n),i+1)]:
+                self.update(cmd)
+            i = self.numCmds
+        self.listRef = listOfCmds
+        self.lastCmd = listOfCmds[n-1] if n else None
+
+    def update(self,cmd):
+        self.numCmds += 1
+        self.classCounts[type(cmd).__name__] += 1
+        self.track(cmd)
+
+    def track(self,cmd):
+        if self.headTotals is None:
+            self.head.append(cmd)
+            self.apply(cmd)
+            if self.motionClass is not None and not self.lostAxes:
+                self.headTotals = self.totals
+                self.totals = PathTotals()
+        else:
+            self.apply(cmd)
+
+    def merge(self,other):
+        """
+        Merges stats of a program following this one. Returns False, w/o
+        changing the stats, if the state at the end of this program isn't the
+        assumed initial state.
+        """
+        if not self.absolute or self.returnMode != 'prior' or not other.mergeable:
+            return False
+        if other.modalInHead and self.isCycleMode():
+            return False
+        for cmd in other.head:
+            self.track(cmd)
+        self.numCmds += other.numCmds
+        self.classCounts.update(other.classCounts)
+        if other.resolved and not self.resolved:
+            # This program's head extends past the other's head
+            for cmd in other.listRef[len(other.head):other.numCmds]:
+                self.track(cmd)
+        elif other.resolved:
+            start = self.position
+            self.totals.merge(other.totals)
+            for segStart, segEnd, isFeed in other.pendingSegments:
+                self.addLength(fillUnknown(segStart,start),fillUnknown(segEnd,start),isFeed)
+            if other.cutAtStartZ:
+                self.addCutZ(start[2])
+            self.position = fillUnknown(other.position,start)
+            self.absolute = other.absolute
+            self.motionClass = other.motionClass
+            self.cycleParams = other.cycleParams
+            self.returnMode = other.returnMode
+        return True
+
+    def isCycleMode(self):
+        return self.motionClass is not None and issubclass(self.motionClass,DrillCycleBase)
+
+    def apply(self,cmd):
+        """
+        Updates position, modal state and totals for command.
+        """
+        cls = type(cmd)
+        if cls is RapidMotion or cls is LinearFeed:
+            self.motionClass = cls
+            self.addLinearMotion(cmd.motionDict,cls is LinearFeed)
+        elif cls is ModalMotion:
+            if self.motionClass in (RapidMotion, LinearFeed):
+                self.addLinearMotion(cmd.motionDict,self.motionClass is LinearFeed)
+            elif self.isCycleMode():
+                # Repeat of the canned cycle at the new position
+                param = dict(self.cycleParams)
+                param.update((k,v) for k,v in cmd.motionDict.iteritems() if v is not None)
+                self.addDrillCycle(param)
+            else:
+                if self.motionClass is None and not self.resolved:
+                    self.modalInHead = True
+                self.position = self.getEndPosition(cmd.motionDict)
+                self.totals.addPoint(self.position)
+        elif cls in self.helicalAxesDict:
+            self.motionClass = cls
+            self.addHelicalMotion(cmd)
+        elif isinstance(cmd,DrillCycleBase):
+            self.motionClass = cls
+            self.cycleParams = cmd.params
+            self.addDrillCycle(cmd.params)
+        elif cls is CancelCannedCycle:
+            self.motionClass = None
+        elif cls is QuadraticBSplineXY:
+            self.motionClass = cls
+            self.addSpline(cmd)
+        elif cls is AbsoluteMode:
+            self.absolute = True
+        elif cls is IncrementalMode:
+            self.absolute = False
+        elif cls is CannedCycleReturnMode:
+            self.returnMode = cmd.mode
+
+    def getEndPosition(self,motionDict):
+        end = list(self.position)
+        for k, name in enumerate(('x','y','z')):
+            value = motionDict.get(name)
+            if value is not None:
+                if self.absolute:
+                    end[k] = float(value)
+                    self.lostAxes.discard(k)
+                elif end[k] is not None:
+                    end[k] += float(value)
+                else:
+                    self.setStartDependent((k,))
+        return end
+
+    def setStartDependent(self,axes=()):
+        """
+        Records that a command's effect depends on unknown start values in a
+        way which can't be completed when merging. In the head the given axes
+        are marked as no longer being at their start values, which keeps the
+        head open until they're set.
+        """
+        if self.resolved:
+            self.mergeable = False
+        else:
+            self.lostAxes.update(axes)
+
+    def addSegment(self,start,end,isFeed,length=None):
+        """
+        Adds straight segment (or curve with given length) from start to end.
+        """
+        self.totals.addPoint(end)
+        self.addLength(start,end,isFeed,length)
+        self.position = end
+
+    def addLength(self,start,end,isFeed,length=None):
+        """
+        Adds length and cut z of segment from start to end to the totals. The
+        length is only counted if no axis moves from an unknown value - after
+        the head such segments are kept for merging.
+        """
+        totals = self.totals
+        if length is None:
+            length = 0.0
+            for s, e in zip(start,end):
+                if s is None:
+                    if e is not None:
+                        length = None
+                        break
+                elif e is not None:
+                    length += (e - s)**2
+            if length is not None:
+                length = math.sqrt(length)
+            elif self.resolved:
+                self.pendingSegments.append((start,end,isFeed))
+        if length is not None:
+            if isFeed:
+                totals.cutLength += length
+            else:
+                totals.rapidLength += length
+        if isFeed:
+            self.addCutZ(start[2])
+            self.addCutZ(end[2])
+
+    def addCutZ(self,z):
+        if z is not None:
+            self.totals.addCutZ(z)
+        elif self.resolved:
+            self.cutAtStartZ = True
+
+    def addLinearMotion(self,motionDict,isFeed):
+        self.addSegment(self.position,self.getEndPosition(motionDict),isFeed)
+
+    def addHelicalMotion(self,cmd):
+        axis0, axis1, axisH = self.helicalAxesDict[type(cmd)]
+        motionDict = cmd.motionDict
+        start = self.position
+        end = self.getEndPosition(motionDict)
+        if start[axisH] is None and end[axisH] is not None:
+            self.setStartDependent()
+        if start[axis0] is None or start[axis1] is None:
+            self.setStartDependent()
+            self.addSegment(start,end,True)
+            return
+        offsetNames = ('i','j','k')
+        center0 = start[axis0] + float(motionDict.get(offsetNames[axis0]) or 0.0)
+        center1 = start[axis1] + float(motionDict.get(offsetNames[axis1]) or 0.0)
+        radius = math.hypot(start[axis0] - center0, start[axis1] - center1)
+        angle0 = math.atan2(start[axis1] - center1, start[axis0] - center0)
+        angle1 = math.atan2(end[axis1] - center1, end[axis0] - center0)
+        sense = 1.0 if cmd.direction == 'ccw' else -1.0
+        sweep = (sense*(angle1 - angle0)) % (2*math.pi)
+        if sweep < 1.0e-9:
+            sweep = 2*math.pi
+        turns = motionDict.get('p')
+        if turns is not None:
+            sweep += 2*math.pi*(int(turns) - 1)
+        height = 0.0
+        if start[axisH] is not None and end[axisH] is not None:
+            height = end[axisH] - start[axisH]
+        for i in range(4):
+            angle = 0.5*math.pi*i
+            if (sense*(angle - angle0)) % (2*math.pi) <= sweep:
+                point = [None, None, None]
+                point[axis0] = center0 + radius*math.cos(angle)
+                point[axis1] = center1 + radius*math.sin(angle)
+                self.totals.addPoint(point)
+        self.addSegment(start,end,True,length=math.hypot(radius*sweep,height))
+
+    def addDrillCycle(self,param):
+        """
+        Adds moves of G73, G81, G82 or G83 canned cycle with the given params
+        (in absolute mode). The small retracts between the pecks of G73 are
+        machine dependent and aren't counted.
+        """
+        if not self.absolute:
+            self.setStartDependent((0,1,2))
+            self.position = [None, None, None]
+            return
+        x, y, z, r = [float(param[k]) for k in ('x','y','z','r')]
+        reps = 1 if param['l'] is None else int(param['l'])
+        peck = param.get('q')
+        if self.motionClass is HighSpeedPeckDrillCycle:
+            peck = None
+        z0 = self.position[2]
+        if z0 is None:
+            self.setStartDependent((2,))
+        if z0 is None or self.returnMode == 'r-word':
+            clearZ = r
+        else:
+            clearZ = max(z0,r)
+        if z0 is not None and z0 < r:
+            self.addSegment(self.position,[self.position[0],self.position[1],r],False)
+        for i in range(reps):
+            self.addSegment(self.position,[x,y,self.position[2]],False)
+            self.addSegment(self.position,[x,y,r],False)
+            if peck is None:
+                self.addSegment(self.position,[x,y,z],True)
+            else:
+                depth = r
+                while depth > z:
+                    if depth < r:
+                        self.addSegment(self.position,[x,y,depth],False)
+                    depth = max(depth - float(peck), z)
+                    self.addSegment(self.position,[x,y,depth],True)
+                    if depth > z:
+                        self.addSegment(self.position,[x,y,r],False)
+            self.addSegment(self.position,[x,y,clearZ],False)
+        self.lostAxes.difference_update((0,1))
+
+    def addSpline(self,cmd):
+        param = cmd.splineArgs
+        start = self.position
+        end = self.getEndPosition(param)
+        if start[0] is None or start[1] is None:
+            self.setStartDependent()
+            self.addSegment(start,end,True)
+            return
+        import numpy
+        p0 = numpy.array(start[:2])
+        p1 = p0 + [float(param[k] or 0.0) for k in ('i','j')]
+        p2 = numpy.array(end[:2])
+        s = numpy.linspace(0.0,1.0,33)[:,None]
+        curve = (1-s)**2*p0 + 2*s*(1-s)*p1 + s**2*p2
+        for point in curve.tolist():
+            self.totals.addPoint(point + [None])
+        length = numpy.sqrt((numpy.diff(curve,axis=0)**2).sum(axis=1)).sum()
+        self.addSegment(start,end,True,length=float(length))
+
+    def getCommentList(self):
+        """
+        Returns list of comment strings describing the stats.
+        """
+        commentList = ['Program stats', '-'*60]
+        for name, axisExtents in zip(('x','y','z'),self.extents):
+            if axisExtents is not None:
+                commentList.append('{0} extents: {1:1.4f} to {2:1.4f}'.format(name,*axisExtents))
+        if self.cutZRange is not None:
+            commentList.append('cut z range: {0:1.4f} to {1:1.4f}'.format(*self.cutZRange))
+        commentList.append('cut length: {0:1.4f}'.format(self.cutLength))
+        commentList.append('rapid length: {0:1.4f}'.format(self.rapidLength))
+        commentList.append('commands: {0}'.format(self.numCmds))
+        for name, count in sorted(self.classCounts.iteritems()):
+            commentList.append('  {0}: {1}'.format(name,count))
+        return commentList
+
+    def __str__(self):
+        return '\n'.join(self.getCommentList())
+
+
 # Base classes
 # -----------------------------------------------------------------------------
 
@@ -89,12 +838,19 @@ class GCodeCmd(object):
         self.commentStr = ''
 
     def __str__(self):
-        cmdList= self.getCmdList()
+        return self.format()
+
+    def format(self,fmt=None):
+        """
+        Returns command string with numbers formatted using GCodeFormat fmt
+        (None = default formatting).
+        """
+        cmdList= self.getCmdList(fmt)
         if self.comment and self.commentStr:
             cmdList.append('({0})'.format(self.commentStr))
         return ' '.join(cmdList)
 
-    def getCmdList(self):
+    def getCmdList(self,fmt=None):
         return [self.code]
 
 
@@ -108,9 +864,12 @@ class GCodeSingleArgCmd(GCodeCmd):
         self.valueType = valueType # float, int, str
         self.value = value
 
-    def getCmdList(self):
-        cmdList = super(GCodeSingleArgCmd,self).getCmdList()
-        cmdList.append('{0}'.format(self.valueType(self.value)))
+    def getCmdList(self,fmt=None):
+        cmdList = super(GCodeSingleArgCmd,self).getCmdList(fmt)
+        if fmt is not None and self.valueType is float:
+            cmdList.append(fmt.formatValue(self.value))
+        else:
+            cmdList.append('{0}'.format(self.valueType(self.value)))
         return cmdList
 
 
@@ -128,12 +887,15 @@ class GCodeAxisArgCmd(GCodeCmd):
         if not [ v for k, v in self.motionDict.iteritems() if v is not None]:
             raise RuntimeError('missing commands')
 
-    def getCmdList(self):
-        cmdList = super(GCodeAxisArgCmd,self).getCmdList()
-        for axis in self.axisNames:  # Use order in axisNames list
-            motion = self.motionDict[axis] 
-            if motion is not None:
-                cmdList.append('{0}{1:1.8f}'.format(axis.upper(),float(motion)))
+    def getCmdList(self,fmt=None):
+        cmdList = super(GCodeAxisArgCmd,self).getCmdList(fmt)
+        if fmt is None:
+            for axis in self.axisNames:  # Use order in axisNames list
+                motion = self.motionDict[axis] 
+                if motion is not None:
+                    cmdList.append('{0}{1:1.8f}'.format(axis.upper(),float(motion)))
+        else:
+            fmt.appendWords(cmdList,self.__class__,self.axisNames,self.motionDict)
         return cmdList
 
 
@@ -162,15 +924,18 @@ class GCodeHelicalMotion(GCodeCmd):
             raise RuntimeError('missing required key: {0}'.format(self.requiredKeys))
 
 
-    def getCmdList(self):
-        cmdList = super(GCodeHelicalMotion,self).getCmdList()
-        for name in self.motionArgs:
-            value = self.motionDict[name]
-            if value is not None:
-                if name == 'p':
-                    cmdList.append('{0}{1}'.format(name.upper(),int(value)))
-                else:
-                    cmdList.append('{0}{1:1.8f}'.format(name.upper(),float(value)))
+    def getCmdList(self,fmt=None):
+        cmdList = super(GCodeHelicalMotion,self).getCmdList(fmt)
+        if fmt is None:
+            for name in self.motionArgs:
+                value = self.motionDict[name]
+                if value is not None:
+                    if name == 'p':
+                        cmdList.append('{0}{1}'.format(name.upper(),int(value)))
+                    else:
+                        cmdList.append('{0}{1:1.8f}'.format(name.upper(),float(value)))
+        else:
+            fmt.appendWords(cmdList,self.__class__,self.motionArgs,self.motionDict,intWords=('p',))
         return cmdList
 
 
@@ -193,6 +958,22 @@ class LinearFeed(GCodeAxisArgCmd):
         self.commentStr = 'Linear feed'
 
 
+class ModalMotion(GCodeAxisArgCmd):
+    """
+    Axis words w/o a motion code - continues the current motion mode (G0 or
+    G1) or, after a canned cycle, repeats the cycle at the new position.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ModalMotion,self).__init__(*args, **kwargs)
+        self.code = ''
+        self.commentStr = 'Modal motion'
+
+    def getCmdList(self,fmt=None):
+        cmdList = super(ModalMotion,self).getCmdList(fmt)
+        return cmdList[1:]
+
+
 class Dwell(GCodeSingleArgCmd):
 
     def __init__(self,value):
@@ -200,9 +981,12 @@ class Dwell(GCodeSingleArgCmd):
         self.code = 'G4'
         self.commentStr = 'Dwell'
 
-    def getCmdList(self):
-        cmdList = super(GCodeSingleArgCmd,self).getCmdList()
-        cmdList.append('P{0}'.format(self.valueType(self.value)))
+    def getCmdList(self,fmt=None):
+        cmdList = super(GCodeSingleArgCmd,self).getCmdList(fmt)
+        if fmt is None:
+            cmdList.append('P{0}'.format(self.valueType(self.value)))
+        else:
+            cmdList.append('P{0}'.format(fmt.formatValue(self.value)))
         return cmdList
 
 
@@ -264,7 +1048,7 @@ class HelicalMotionYZ(GCodeHelicalMotion):
 
     motionArgs = ('y', 'z', 'x', 'j', 'k', 'p')
     kwargsKeys = ('d',) + motionArgs
-    requiredKeys = ('i','k') # Must have at least one of these
+    requiredKeys = ('j','k') # Must have at least one of these
 
 
     def __init__(self,*args, **kwargs):
@@ -284,10 +1068,17 @@ class HelicalMotionYZ(GCodeHelicalMotion):
 
         """
         kwargs = normalizeToKwargs(self.kwargsKeys,args,kwargs)
-        super(HelicalMotionYZ,self).__init__()
+        super(HelicalMotionYZ,self).__init__(**kwargs)
         self.commentStr = 'Helical motion yz-plane, {0}'.format(self.direction)
 
 
+ProgStats.helicalAxesDict = {
+        HelicalMotionXY: (0, 1, 2),
+        HelicalMotionXZ: (2, 0, 1),
+        HelicalMotionYZ: (1, 2, 0),
+        }
+
+
 class CancelCannedCycle(GCodeCmd):
 
     def __init__(self):
@@ -310,12 +1101,15 @@ class QuadraticBSplineXY(GCodeCmd):
         self.commentStr = 'Quadratic B-Spline'
         self.splineArgs = kwargs
 
-    def getCmdList(self):
-        cmdList = super(QuadraticBSplineXY,self).getCmdList()
-        for key in self.kwargsKeys:  # Use order in axisNames list
-            value = self.splineArgs[key]
-            if value is not None:
-                cmdList.append('{0}{1}'.format(key.upper(),float(value)))
+    def getCmdList(self,fmt=None):
+        cmdList = super(QuadraticBSplineXY,self).getCmdList(fmt)
+        if fmt is None:
+            for key in self.kwargsKeys:  # Use order in axisNames list
+                value = self.splineArgs[key]
+                if value is not None:
+                    cmdList.append('{0}{1}'.format(key.upper(),float(value)))
+        else:
+            fmt.appendWords(cmdList,self.__class__,self.kwargsKeys,self.splineArgs)
         return cmdList
 
 
@@ -335,8 +1129,11 @@ class DrillCycleBase(GCodeCmd):
         checkRequiredKwargs(self.requiredKeys,kwargs) 
         self.params = kwargs
 
-    def getCmdList(self):
-        cmdList = super(DrillCycleBase,self).getCmdList()
+    def getCmdList(self,fmt=None):
+        cmdList = super(DrillCycleBase,self).getCmdList(fmt)
+        if fmt is not None:
+            fmt.appendWords(cmdList,self.__class__,self.kwargsKeys,self.params,intWords=('l',))
+            return cmdList
         for name in self.kwargsKeys:
             value = self.params[name]
             if value is not None:
@@ -389,6 +1186,19 @@ class PeckDrillCycle(DrillCycleBase):
         if self.params['q'] <= 0:
             raise ValueError('increment q must be >= 0')
         self.code = 'G83'
+
+
+class HighSpeedPeckDrillCycle(PeckDrillCycle):
+
+    """
+    High speed (chip breaking) peck drilling - retracts a small distance after
+    each peck instead of all the way to r. Arguments as for PeckDrillCycle.
+    """
+
+    def __init__(self,*args,**kwargs):
+        super(HighSpeedPeckDrillCycle,self).__init__(*args,**kwargs)
+        self.code = 'G73'
+        self.commentStr = 'High speed peck drill cycle'
         
 
 # Distance Mode 
@@ -476,8 +1286,8 @@ class EnableToolLengthOffset(GCodeCmd):
         if self.tool is not None:
             self.commentStr = "{0} for tool {1}".format(self.commentStr,self.tool)
 
-    def getCmdList(self):
-        cmdList = super(EnableToolLengthOffset,self).getCmdList()
+    def getCmdList(self,fmt=None):
+        cmdList = super(EnableToolLengthOffset,self).getCmdList(fmt)
         if self.tool is not None:
             cmdList.append('H{0}'.format(int(self.tool)))
         return cmdList
@@ -531,12 +1341,15 @@ class CutterCompensation(GCodeCmd):
         else:
             self.commentStr = 'Added cutter radius compensation, {0}'.format(self.side)
 
-    def getCmdList(self):
-        cmdList = super(CutterCompensation,self).getCmdList()
+    def getCmdList(self,fmt=None):
+        cmdList = super(CutterCompensation,self).getCmdList(fmt)
         if self.toolNumber is not None:
             cmdList.append('D{0}'.format(self.toolNumber))
         elif self.diameter is not None:
-            cmdList.append('D{0}'.format(self.diameter))
+            if fmt is None:
+                cmdList.append('D{0}'.format(self.diameter))
+            else:
+                cmdList.append('D{0}'.format(fmt.formatValue(self.diameter,'x')))
         return cmdList
 
 
@@ -677,12 +1490,16 @@ class PathBlendMode(GCodeCmd):
         self.code = 'G64'
         self.commentStr = 'path blend mode'
 
-    def getCmdList(self):
-        cmdList = super(PathBlendMode,self).getCmdList()
+    def getCmdList(self,fmt=None):
+        cmdList = super(PathBlendMode,self).getCmdList(fmt)
         for name in self.kwargsKeys:
             value = self.params[name]
             if value is not None:
-                cmdList.append('{0}{1}'.format(name,float(value)))
+                if fmt is None:
+                    cmdList.append('{0}{1}'.format(name,float(value)))
+                else:
+                    # p and q are path tolerances
+                    cmdList.append('{0}{1}'.format(name.upper(),fmt.formatValue(value,'x')))
         return cmdList
 
 
@@ -743,8 +1560,8 @@ class DigitalOutput(GCodeSingleArgCmd):
         else:
             self.commentStr = 'Immediant digital output'
 
-    def getCmdList(self):
-        cmdList = super(GCodeSingleArgCmd,self).getCmdList()
+    def getCmdList(self,fmt=None):
+        cmdList = super(GCodeSingleArgCmd,self).getCmdList(fmt)
         cmdList.append('P{0}'.format(self.valueType(self.value)))
         return cmdList
 
@@ -813,8 +1630,8 @@ class SelectAndChangeTool(SelectTool):
         super(SelectAndChangeTool,self).__init__(value,valueType=int)
         self.commentStr = 'Select and change tool'
 
-    def getCmdList(self):
-        cmdList = super(SelectAndChangeTool,self).getCmdList()
+    def getCmdList(self,fmt=None):
+        cmdList = super(SelectAndChangeTool,self).getCmdList(fmt)
         cmdList.append(ChangeTool().code)
         return cmdList
 
@@ -843,6 +1660,15 @@ class End(GCodeCmd):
         self.code = 'M2'
         self.commentStr = 'End program'
 
+
+class EndAndReset(End):
+
+    def __init__(self):
+        super(EndAndReset,self).__init__()
+        self.code = 'M30'
+        self.commentStr = 'End program and reset'
+
+
 class Comment(GCodeSingleArgCmd):
 
     def __init__(self, value):
@@ -856,9 +1682,151 @@ class Space(GCodeCmd):
         self.code  = ''
         self.commentStr = '' 
 
+# Commands which can be formatted as blocks
+BLOCK_CLASS_IDS = {RapidMotion: 1, LinearFeed: 2, ModalMotion: 3}
+
+
 # Utility functions
 #  ----------------------------------------------------------------------------
 
+def getMotionRunList(listOfCmds,minSize=MIN_BLOCK_SIZE):
+    """
+    Splits list of commands into runs. Returns list of (start, stop, isBlock)
+    where isBlock is True for runs of at least minSize consecutive motion
+    commands, w/o comments, of the same class in BLOCK_CLASS_IDS.
+    """
+    numCmds = len(listOfCmds)
+    if numCmds < minSize:
+        return [(0, numCmds, False)] if numCmds else []
+    import numpy
+    classIds = numpy.array(map(
+        BLOCK_CLASS_IDS.get, 
+        map(type,listOfCmds), 
+        itertools.repeat(0,numCmds)
+        ))
+    comments = numpy.array(map(operator.attrgetter('comment'),listOfCmds),dtype=bool)
+    classIds[comments] = 0
+    boundList = [0] + (numpy.flatnonzero(classIds[1:] != classIds[:-1]) + 1).tolist() + [numCmds]
+    runList = []
+    for i0, i1 in zip(boundList[:-1], boundList[1:]):
+        isBlock = bool(classIds[i0]) and (i1 - i0 >= minSize)
+        if runList and not isBlock and not runList[-1][2]:
+            runList[-1] = (runList[-1][0], i1, False)
+        else:
+            runList.append((i0, i1, isBlock))
+    return runList
+
+def formatCmdList(listOfCmds,fmt=None,lineNumber=None,lineNumberStep=2):
+    """
+    Returns text for list of commands formatted one at a time. Line numbers
+    start at lineNumber, None = no line numbers.
+    """
+    if lineNumber is None:
+        lineList = [cmd.format(fmt) for cmd in listOfCmds]
+    else:
+        lineList = [
+                'N{0} {1}'.format(lineNumber + lineNumberStep*i, cmd.format(fmt)) 
+                for i, cmd in enumerate(listOfCmds)
+                ]
+    lineList.append('')
+    return '\n'.join(lineList)
+
+def formatMotionRun(listOfCmds,fmt=None,lineNumber=None,lineNumberStep=2):
+    """
+    Returns text for run of motion commands of the same class, the same as
+    formatting the commands one at a time.  The axis values are gathered
+    (into an array when the axes used change within the run) and each
+    sub-run using the same axes is formatted with a single template.
+    """
+    cls = type(listOfCmds[0])
+    codeList = map(operator.attrgetter('code'),listOfCmds)
+    if codeList.count(codeList[0]) != len(codeList):
+        return formatCmdList(listOfCmds,fmt,lineNumber,lineNumberStep)
+    if cls is ModalMotion:
+        codeList = []
+    else:
+        codeList = [codeList[0]]
+
+    axisNames = cls.axisNames
+    if fmt is None:
+        templateList = ['{0}%.8f'.format(axis.upper()) for axis in axisNames]
+    else:
+        templateList = fmt.getBlockTemplateList(cls,axisNames)
+    if lineNumber is not None:
+        codeList.insert(0,'N%d')
+    motionDictList = map(operator.attrgetter('motionDict'),listOfCmds)
+
+    # Fast path - all commands use the same axes as the first one
+    motionDict = motionDictList[0]
+    axisInd = [j for j, axis in enumerate(axisNames) if motionDict[axis] is not None]
+    otherAxes = [axis for axis in axisNames if motionDict[axis] is None]
+    if otherAxes:
+        getOther = operator.itemgetter(*otherAxes)
+        otherNone = getOther(dict.fromkeys(otherAxes))
+        isUniform = map(getOther,motionDictList).count(otherNone) == len(listOfCmds)
+    else:
+        isUniform = True
+    if isUniform and axisInd:
+        lineTemplate = ' '.join(codeList + [templateList[j] for j in axisInd]) + '\n'
+        valueTupleList = map(operator.itemgetter(*[axisNames[j] for j in axisInd]),motionDictList)
+        if len(axisInd) == 1:
+            valueTupleList = zip(valueTupleList)
+        if lineNumber is not None:
+            lineNumberList = range(lineNumber, lineNumber + lineNumberStep*len(listOfCmds), lineNumberStep)
+            valueTupleList = map(operator.add, zip(lineNumberList), valueTupleList)
+        try:
+            text = (lineTemplate*len(listOfCmds)) % tuple(itertools.chain.from_iterable(valueTupleList))
+        except TypeError:
+            # Non-numeric values - use general path
+            text = None
+        if text is not None:
+            return postProcessBlock(text,fmt)
+
+    # General path - gather values in array with NaNs for missing axes
+    import numpy
+    valueArray = numpy.array(map(operator.itemgetter(*axisNames),motionDictList),dtype=float)
+    if lineNumber is not None:
+        lineNumberArray = lineNumber + lineNumberStep*numpy.arange(len(listOfCmds))
+
+    # Split into sub-runs which use the same axes
+    axisMask = ~numpy.isnan(valueArray)
+    axisPattern = axisMask.dot(1 << numpy.arange(len(axisNames)))
+    boundList = [0] + (numpy.flatnonzero(axisPattern[1:] != axisPattern[:-1]) + 1).tolist()
+    boundList.append(len(listOfCmds))
+
+    textList = []
+    for i0, i1 in zip(boundList[:-1], boundList[1:]):
+        axisInd = numpy.flatnonzero(axisMask[i0])
+        if not axisInd.size:
+            if lineNumber is not None:
+                subLineNumber = lineNumber + lineNumberStep*i0
+            else:
+                subLineNumber = None
+            textList.append(formatCmdList(listOfCmds[i0:i1],fmt,subLineNumber,lineNumberStep))
+            continue
+        lineTemplate = ' '.join(codeList + [templateList[j] for j in axisInd]) + '\n'
+        dataArray = valueArray[i0:i1,axisInd]
+        if lineNumber is not None:
+            dataArray = numpy.column_stack((lineNumberArray[i0:i1], dataArray))
+        textList.append((lineTemplate*(i1-i0)) % tuple(dataArray.ravel().tolist()))
+    return postProcessBlock(''.join(textList),fmt)
+
+def fillUnknown(position,knownPosition):
+    """
+    Returns position with unknown (None) values taken from knownPosition.
+    """
+    return [k if v is None else v for v, k in zip(position,knownPosition)]
+
+def postProcessBlock(text,fmt=None):
+    """
+    Trims zeros and removes signs from negative zeros in text of block of
+    commands, as GCodeFormat does for individual values.
+    """
+    if fmt is not None:
+        text = fmt.trimBlock(text)
+    return text
+
+
 def normalizeToKwargs(expectedKeys,argsTuple,kwargsDict):
     """
     Normalize, arguments For functions that can take either position or
@@ -1024,6 +1992,9 @@ if __name__ == '__main__':
 
     cmd = PeckDrillCycle(x=0,y=0,z=-0.5,r=0.1,q=0.1)
     print(cmd)
+
+    cmd = HighSpeedPeckDrillCycle(x=0,y=0,z=-0.5,r=0.1,q=0.1)
+    print(cmd)
     
     cmd = QuadraticBSplineXY(1.0,1.0,1.1,1.5)
     print(cmd)
@@ -0,0 +1,508 @@
+"""
+
+Copyright 2014 IO Rodeo Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+from __future__ import print_function
+import numpy
+import gcode_cmd
+import geom_utils
+
+# Commands which don't change the modal state tracked by the optimizer
+PASS_CLASSES = (
+        gcode_cmd.Comment,
+        gcode_cmd.Space,
+        gcode_cmd.Dwell,
+        gcode_cmd.SpindleSpeed,
+        gcode_cmd.StartSpindleCW,
+        gcode_cmd.StartSpindleCCW,
+        gcode_cmd.StopSpindle,
+        gcode_cmd.DigitalOutput,
+        gcode_cmd.MistCoolantOn,
+        gcode_cmd.FloodCoolantOn,
+        gcode_cmd.CoolantOff,
+        gcode_cmd.Pause,
+        gcode_cmd.OptionalPause,
+        gcode_cmd.ExactPathMode,
+        gcode_cmd.ExactStopMode,
+        gcode_cmd.PathBlendMode,
+        gcode_cmd.CannedCycleReturnMode,
+        )
+
+# Commands after which the position is unknown (the axis words mean
+# something different or the machine may have moved)
+POSITION_RESET_CLASSES = (
+        gcode_cmd.CoordinateSystem,
+        gcode_cmd.EnableToolLengthOffset,
+        gcode_cmd.SetToolLengthOffset,
+        gcode_cmd.CancelToolLengthOffset,
+        gcode_cmd.ChangeTool,
+        gcode_cmd.SelectTool,
+        )
+
+# Commands which change feed rate interpretation
+FEED_MODE_CLASSES = (
+        gcode_cmd.InverseTimeMode,
+        gcode_cmd.UnitsPerMinuteMode,
+        gcode_cmd.UnitsPerRevMode,
+        )
+
+MOTION_CLASSES = (gcode_cmd.RapidMotion, gcode_cmd.LinearFeed)
+
+
+class ModalOptimizer(object):
+    """
+    Removes redundant words and codes from a list of gcode commands by
+    tracking the modal state of the machine - motion mode, position, feed
+    rate, plane, units and distance mode. The following are left out:
+
+      * repeated G0/G1 codes - replaced by gcode_cmd.ModalMotion,
+      * axis words equal to the current position,
+      * rapid motions and linear feeds which don't move any axis (except
+        directly after a synchronized digital output),
+      * repeated feed rate, plane, units and distance mode commands.
+
+    In inverse time feed mode (G93) feed rates are never left out and linear
+    feeds always keep their G1 code, as F must be given for each feed move.
+
+    Values are compared after formatting with fmt (a gcode_cmd.GCodeFormat,
+    None = default formatting), so the optimized program is interpreted
+    exactly as the original. Position tracking is only done in
+    absolute distance mode and is reset by unit changes, tool length
+    offsets, coordinate system changes and tool changes. Programs are passed
+    through unchanged while cutter compensation is active, but the feed rate,
+    plane, units and distance mode set there are still recorded. Unknown
+    commands reset all state.
+    """
+
+    def __init__(self,fmt=None):
+        self.fmt = fmt
+        self.reset()
+
+    def reset(self):
+        self.motionCode = None
+        self.position = {}
+        self.feedRate = None
+        self.inverseTime = False
+        self.planeCode = None
+        self.unitsCode = None
+        self.absolute = None
+        self.cutterComp = False
+        self.syncOutput = False
+
+    def resetPosition(self):
+        self.position = {}
+
+    def optimize(self,listOfCmds):
+        """
+        Returns optimized list of commands.
+        """
+        listOfCmdsOpt = []
+        for cmd in listOfCmds:
+            cmdOpt = self.optimizeCmd(cmd)
+            if cmdOpt is not None:
+                listOfCmdsOpt.append(cmdOpt)
+        return listOfCmdsOpt
+
+    def optimizeCmd(self,cmd):
+        """
+        Returns optimized command or None if the command is redundant.
+        """
+        if self.cutterComp:
+            if isinstance(cmd,gcode_cmd.CancelCutterCompensation):
+                self.cutterComp = False
+                self.motionCode = None
+                self.resetPosition()
+            else:
+                self.updateCutterCompState(cmd)
+            return cmd
+        if type(cmd) in MOTION_CLASSES or type(cmd) is gcode_cmd.ModalMotion:
+            return self.optimizeMotion(cmd)
+        elif isinstance(cmd,gcode_cmd.GCodeHelicalMotion):
+            self.motionCode = cmd.code
+            self.syncOutput = False
+            self.updatePosition(cmd.motionDict)
+        elif isinstance(cmd,gcode_cmd.FeedRate):
+            value = cmd.format(self.fmt)
+            if value == self.feedRate and not self.inverseTime:
+                return None
+            self.feedRate = value
+        elif isinstance(cmd,gcode_cmd.SelectPlane):
+            if cmd.code == self.planeCode:
+                return None
+            self.planeCode = cmd.code
+        elif isinstance(cmd,gcode_cmd.Units):
+            if cmd.code == self.unitsCode:
+                return None
+            self.unitsCode = cmd.code
+            self.feedRate = None
+            self.resetPosition()
+        elif isinstance(cmd,gcode_cmd.AbsoluteMode):
+            if self.absolute:
+                return None
+            self.absolute = True
+            self.resetPosition()
+        elif isinstance(cmd,gcode_cmd.IncrementalMode):
+            self.absolute = False
+            self.resetPosition()
+        elif isinstance(cmd,gcode_cmd.CancelCannedCycle):
+            self.motionCode = None
+        elif isinstance(cmd,gcode_cmd.CutterCompensation):
+            self.motionCode = None
+            self.resetPosition()
+            self.cutterComp = True
+        elif isinstance(cmd,gcode_cmd.CancelCutterCompensation):
+            pass
+        elif isinstance(cmd,gcode_cmd.DigitalOutput):
+            if cmd.code in ('M62', 'M63'):
+                # Synchronized outputs take effect with the next motion
+                self.syncOutput = True
+        elif isinstance(cmd,FEED_MODE_CLASSES):
+            self.feedRate = None
+            self.inverseTime = isinstance(cmd,gcode_cmd.InverseTimeMode)
+        elif isinstance(cmd,POSITION_RESET_CLASSES):
+            self.resetPosition()
+        elif not isinstance(cmd,PASS_CLASSES):
+            self.reset()
+        return cmd
+
+    def updateCutterCompState(self,cmd):
+        """
+        Records the modal state set by a command passed through while cutter
+        compensation is active.
+        """
+        if isinstance(cmd,gcode_cmd.FeedRate):
+            self.feedRate = cmd.format(self.fmt)
+        elif isinstance(cmd,gcode_cmd.SelectPlane):
+            self.planeCode = cmd.code
+        elif isinstance(cmd,gcode_cmd.Units):
+            self.unitsCode = cmd.code
+            self.feedRate = None
+        elif isinstance(cmd,gcode_cmd.AbsoluteMode):
+            self.absolute = True
+        elif isinstance(cmd,gcode_cmd.IncrementalMode):
+            self.absolute = False
+        elif isinstance(cmd,FEED_MODE_CLASSES):
+            self.feedRate = None
+            self.inverseTime = isinstance(cmd,gcode_cmd.InverseTimeMode)
+        elif isinstance(cmd,gcode_cmd.DigitalOutput):
+            if cmd.code in ('M62', 'M63'):
+                self.syncOutput = True
+        elif type(cmd) in MOTION_CLASSES or type(cmd) is gcode_cmd.ModalMotion:
+            self.syncOutput = False
+        elif isinstance(cmd,gcode_cmd.GCodeHelicalMotion):
+            self.syncOutput = False
+        elif not isinstance(cmd,PASS_CLASSES + POSITION_RESET_CLASSES):
+            self.reset()
+            self.cutterComp = True
+
+    def optimizeMotion(self,cmd):
+        if type(cmd) is gcode_cmd.ModalMotion:
+            if self.motionCode not in ('G0', 'G1'):
+                # Can't tell what the motion is
+                self.motionCode = None
+                self.resetPosition()
+                return cmd
+            code = self.motionCode
+        else:
+            code = cmd.code
+        # Feed moves in inverse time mode are kept as given
+        keepFeed = self.inverseTime and code == 'G1'
+        motionDict = {}
+        for axis, value in cmd.motionDict.iteritems():
+            if value is None:
+                continue
+            if self.absolute and self.formatValue(value,axis) == self.position.get(axis):
+                continue
+            motionDict[axis] = value
+        if not motionDict:
+            if not (self.syncOutput or keepFeed):
+                # Move to current position
+                return None
+            motionDict = dict((k,v) for k,v in cmd.motionDict.iteritems() if v is not None)
+        self.syncOutput = False
+        self.updatePosition(motionDict)
+        if keepFeed:
+            cmdOpt = gcode_cmd.LinearFeed(**motionDict)
+            self.motionCode = code
+        elif code == self.motionCode:
+            cmdOpt = gcode_cmd.ModalMotion(**motionDict)
+        else:
+            cmdOpt = type(cmd)(**motionDict)
+            self.motionCode = code
+        cmdOpt.comment = cmd.comment
+        cmdOpt.commentStr = cmd.commentStr
+        return cmdOpt
+
+    def updatePosition(self,motionDict):
+        if not self.absolute:
+            return
+        for axis in gcode_cmd.GCodeAxisArgCmd.axisNames:
+            value = motionDict.get(axis)
+            if value is not None:
+                self.position[axis] = self.formatValue(value,axis)
+
+    def formatValue(self,value,axis):
+        """
+        Returns value formatted as in the gcode output.
+        """
+        if self.fmt is None:
+            return '{0:1.8f}'.format(float(value))
+        else:
+            return self.fmt.formatValue(value,axis)
+
+
+class ArcFitter(object):
+    """
+    Replaces runs of linear feeds whose end points lie on a circle by xy-plane
+    arcs (gcode_cmd.HelicalMotionXY). A run is replaced if it has at least
+    minPoints points (including the start position), no point or segment is
+    more than tol from the arc and z varies linearly along the arc to within
+    tol - so tessellated arcs and helical passes are turned back into G2/G3
+    moves. See geom_utils.getArcFitList.
+
+    Only linear feeds in x,y,z starting from a known position are fitted. The
+    power-on defaults - xy-plane (G17) and absolute distance mode (G90) - are
+    assumed until a plane select or distance mode command is seen.  Modal
+    motions which follow a fitted arc get an explicit G1.
+    """
+
+    def __init__(self,tol,minPoints=4):
+        self.tol = tol
+        self.minPoints = minPoints
+        self.reset()
+
+    def reset(self):
+        self.position = {}
+        self.inCode = None
+        self.outCode = None
+        self.planeCode = 'G17'
+        self.absolute = True
+        self.runPointList = []
+        self.runCmdList = []
+
+    def fit(self,listOfCmds):
+        """
+        Returns list of commands with arcs fitted to the linear feeds.
+        """
+        listOfCmdsFit = []
+        for cmd in listOfCmds:
+            self.fitCmd(cmd,listOfCmdsFit)
+        self.flushRun(listOfCmdsFit)
+        return listOfCmdsFit
+
+    def fitCmd(self,cmd,listOfCmdsFit):
+        cmdType = type(cmd)
+        if cmdType is gcode_cmd.ModalMotion:
+            code = self.inCode
+        else:
+            code = getattr(cmd,'code',None)
+        if code == 'G1' and cmdType in (gcode_cmd.LinearFeed, gcode_cmd.ModalMotion):
+            if self.addToRun(cmd):
+                return
+        self.flushRun(listOfCmdsFit)
+        if cmdType in MOTION_CLASSES or cmdType is gcode_cmd.ModalMotion:
+            if code in ('G0', 'G1'):
+                self.addMotion(cmd,code,listOfCmdsFit)
+                self.updatePosition(cmd.motionDict)
+            else:
+                # Can't tell what the motion is
+                listOfCmdsFit.append(cmd)
+                self.inCode = self.outCode = None
+                self.resetPosition()
+            return
+        listOfCmdsFit.append(cmd)
+        if isinstance(cmd,gcode_cmd.GCodeHelicalMotion):
+            self.inCode = self.outCode = cmd.code
+            self.updatePosition(cmd.motionDict)
+        elif isinstance(cmd,gcode_cmd.SelectPlane):
+            self.planeCode = cmd.code
+        elif isinstance(cmd,gcode_cmd.AbsoluteMode):
+            self.absolute = True
+        elif isinstance(cmd,gcode_cmd.IncrementalMode):
+            self.absolute = False
+            self.resetPosition()
+        elif isinstance(cmd,gcode_cmd.CancelCannedCycle):
+            self.inCode = self.outCode = None
+        elif isinstance(cmd,(gcode_cmd.Units,) + POSITION_RESET_CLASSES):
+            self.resetPosition()
+        elif isinstance(cmd,gcode_cmd.CutterCompensation):
+            pass
+        elif isinstance(cmd,gcode_cmd.CancelCutterCompensation):
+            pass
+        elif isinstance(cmd,(gcode_cmd.FeedRate,) + FEED_MODE_CLASSES + PASS_CLASSES):
+            pass
+        else:
+            self.inCode = self.outCode = None
+            self.resetPosition()
+
+    def resetPosition(self):
+        self.position = {}
+
+    def updatePosition(self,motionDict):
+        if not self.absolute:
+            return
+        for axis in gcode_cmd.GCodeAxisArgCmd.axisNames:
+            value = motionDict.get(axis)
+            if value is not None:
+                self.position[axis] = float(value)
+
+    def addToRun(self,cmd):
+        """
+        Adds linear feed to the current run. Returns False if it can't be
+        part of a run.
+        """
+        self.inCode = 'G1'
+        if not self.absolute or self.planeCode != 'G17':
+            return False
+        if 'x' not in self.position or 'y' not in self.position:
+            return False
+        motionDict = dict((k,v) for k,v in cmd.motionDict.iteritems() if v is not None)
+        if not set(motionDict).issubset(('x','y','z')):
+            return False
+        if 'z' in motionDict and 'z' not in self.position:
+            return False
+        keys = ('x','y','z') if 'z' in self.position else ('x','y')
+        if not self.runPointList:
+            self.runPointList.append([self.position[k] for k in keys])
+        self.updatePosition(motionDict)
+        self.runPointList.append([self.position[k] for k in keys])
+        self.runCmdList.append(cmd)
+        return True
+
+    def addMotion(self,cmd,code,listOfCmdsFit):
+        """
+        Adds G0/G1 motion, replacing modal motions if the emitted motion mode
+        differs from the original.
+        """
+        if type(cmd) is gcode_cmd.ModalMotion and self.outCode != code:
+            motionDict = dict((k,v) for k,v in cmd.motionDict.iteritems() if v is not None)
+            if code == 'G0':
+                cmdFit = gcode_cmd.RapidMotion(**motionDict)
+            else:
+                cmdFit = gcode_cmd.LinearFeed(**motionDict)
+            cmdFit.comment = cmd.comment
+            cmd = cmdFit
+        listOfCmdsFit.append(cmd)
+        self.inCode = self.outCode = code
+
+    def flushRun(self,listOfCmdsFit):
+        """
+        Fits arcs to the current run and adds the resulting commands.
+        """
+        if not self.runCmdList:
+            return
+        inCode = self.inCode
+        pointArray = numpy.array(self.runPointList)
+        if len(self.runCmdList) + 1 >= self.minPoints:
+            moveList = geom_utils.getArcFitList(pointArray,self.tol,self.minPoints)
+        else:
+            moveList = [(k, None, None) for k in range(1,pointArray.shape[0])]
+        index = 0
+        for endIndex, center, direction in moveList:
+            if center is None:
+                self.addMotion(self.runCmdList[endIndex-1],'G1',listOfCmdsFit)
+            else:
+                p0, p1 = pointArray[index], pointArray[endIndex]
+                arcArgs = {
+                        'x': p1[0],
+                        'y': p1[1],
+                        'i': center[0] - p0[0],
+                        'j': center[1] - p0[1],
+                        'd': direction,
+                        }
+                if pointArray.shape[1] > 2:
+                    arcArgs['z'] = p1[2]
+                arc = gcode_cmd.HelicalMotionXY(**arcArgs)
+                arc.comment = self.runCmdList[index].comment
+                listOfCmdsFit.append(arc)
+                self.outCode = arc.code
+            index = endIndex
+        self.inCode = inCode
+        self.runPointList = []
+        self.runCmdList = []
+
+
+# Utility functions
+# -----------------------------------------------------------------------------
+
+def optimizeProg(prog):
+    """
+    Returns new GCodeProg with the redundant words and codes of prog removed.
+    See ModalOptimizer.
+    """
+    progOpt = gcode_cmd.GCodeProg()
+    progOpt.lineNumbers = prog.lineNumbers
+    progOpt.lineNumberStep = prog.lineNumberStep
+    progOpt.fmt = prog.fmt
+    progOpt.listOfCmds = ModalOptimizer(fmt=prog.fmt).optimize(prog.listOfCmds)
+    return progOpt
+
+def fitArcs(prog,tol,minPoints=4):
+    """
+    Returns new GCodeProg with arcs fitted to the runs of linear feeds in
+    prog. See ArcFitter.
+    """
+    progFit = gcode_cmd.GCodeProg()
+    progFit.lineNumbers = prog.lineNumbers
+    progFit.lineNumberStep = prog.lineNumberStep
+    progFit.fmt = prog.fmt
+    progFit.listOfCmds = ArcFitter(tol,minPoints=minPoints).fit(prog.listOfCmds)
+    return progFit
+
+
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    import cnc_path
+
+    prog = gcode_cmd.GCodeProg()
+    prog.add(gcode_cmd.GenericStart())
+    prog.add(gcode_cmd.FeedRate(10.0))
+    prog.add(gcode_cmd.RapidMotion(x=0.0,y=0.0))
+    prog.add(cnc_path.RectPath((0,0),(1,2)))
+    prog.add(gcode_cmd.FeedRate(10.0))
+    prog.add(cnc_path.RectPath((0,0),(1,2),helix=(0,-0.1)))
+
+    progOpt = optimizeProg(prog)
+    print(progOpt)
+    print('size: {0} -> {1}'.format(len(str(prog)),len(str(progOpt))))
+
+    # Modal state changed inside cutter compensation is restored after G40
+    prog = gcode_cmd.GCodeProg()
+    prog.add(gcode_cmd.FeedRate(10.0))
+    prog.add(gcode_cmd.LinearFeed(x=0.0,y=0.0))
+    prog.add(gcode_cmd.CutterCompensation('left'))
+    prog.add(gcode_cmd.FeedRate(20.0))
+    prog.add(gcode_cmd.LinearFeed(x=1.0))
+    prog.add(gcode_cmd.CancelCutterCompensation())
+    prog.add(gcode_cmd.FeedRate(10.0))
+    prog.add(gcode_cmd.LinearFeed(x=2.0))
+    progOpt = optimizeProg(prog)
+    print(progOpt)
+    assert str(progOpt) == str(prog)
+
+    prog = gcode_cmd.GCodeProg()
+    prog.add(gcode_cmd.AbsoluteMode())
+    prog.add(gcode_cmd.LinearFeed(x=0.0,y=0.0))
+    prog.add(gcode_cmd.CutterCompensation('left'))
+    prog.add(gcode_cmd.IncrementalMode())
+    prog.add(gcode_cmd.LinearFeed(x=1.0))
+    prog.add(gcode_cmd.CancelCutterCompensation())
+    prog.add(gcode_cmd.AbsoluteMode())
+    prog.add(gcode_cmd.LinearFeed(x=2.0))
+    progOpt = optimizeProg(prog)
+    print(progOpt)
+    assert str(progOpt) == str(prog)
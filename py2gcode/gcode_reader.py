@@ -0,0 +1,659 @@
+"""
+
+Copyright 2014 IO Rodeo Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+from __future__ import print_function
+import re
+import string
+import numpy
+import gcode_cmd
+import toolpath
+
+DEFAULT_BATCH_SIZE = 2**20  # approximate number of bytes read per batch
+
+# Tokens are words (letter + number), anything else (including O and E words)
+# is captured as bad
+TOKEN_REGEX = re.compile(r'\s*(?:([A-DF-NP-Za-df-np-z])\s*([-+]?(?:\d+\.?\d*|\.\d+))|(\S))')
+PAREN_COMMENT_REGEX = re.compile(r'\(([^)]*)\)')
+# Program number lines (e.g. O1000) - kept as comments
+PROGRAM_NUMBER_REGEX = re.compile(r'\s*([Oo]\s*\d+)\s*\Z')
+
+# Lines with only an optional G0-G3 code and x,y,z,i,j,k words - runs of these
+# are read directly into ToolPath arrays.
+MOTION_LINE_REGEX = re.compile(
+        r'\s*(?:[Gg]0*[0-3](?![\d.])\s*)?(?:[XYZIJKxyzijk]\s*[-+]?(?:\d+\.?\d*|\.\d+)\s*)+\Z'
+        )
+# Translation tables splitting runs of motion lines into letters (and line ends)
+# and numbers
+RUN_LETTERS = 'GXYZIJKgxyzijk\n'
+RUN_LETTER_DELETE = ''.join(chr(i) for i in range(256) if chr(i) not in RUN_LETTERS)
+RUN_NUMBER_TABLE = string.maketrans(RUN_LETTERS,' '*len(RUN_LETTERS))
+RUN_CODE_COLUMN = 6
+RUN_LETTER_TO_COLUMN = numpy.zeros((256,),dtype=int)
+for _i, _letter in enumerate('xyzijkg'):
+    RUN_LETTER_TO_COLUMN[ord(_letter)] = _i
+    RUN_LETTER_TO_COLUMN[ord(_letter.upper())] = _i
+RUN_LETTER_TO_COLUMN[ord('\n')] = -1
+
+AXIS_WORDS = frozenset(gcode_cmd.GCodeAxisArgCmd.axisNames)
+OFFSET_WORDS = frozenset(('i','j','k'))
+XY_WORDS = frozenset(('x','y'))
+
+# Commands w/o arguments
+SIMPLE_CODE_TO_CLASS = {
+        'G40'   : gcode_cmd.CancelCutterCompensation,
+        'G49'   : gcode_cmd.CancelToolLengthOffset,
+        'G61'   : gcode_cmd.ExactPathMode,
+        'G61.1' : gcode_cmd.ExactStopMode,
+        'G80'   : gcode_cmd.CancelCannedCycle,
+        'G90'   : gcode_cmd.AbsoluteMode,
+        'G91'   : gcode_cmd.IncrementalMode,
+        'G93'   : gcode_cmd.InverseTimeMode,
+        'G94'   : gcode_cmd.UnitsPerMinuteMode,
+        'G95'   : gcode_cmd.UnitsPerRevMode,
+        'M0'    : gcode_cmd.Pause,
+        'M1'    : gcode_cmd.OptionalPause,
+        'M2'    : gcode_cmd.End,
+        'M30'   : gcode_cmd.EndAndReset,
+        'M3'    : gcode_cmd.StartSpindleCW,
+        'M4'    : gcode_cmd.StartSpindleCCW,
+        'M5'    : gcode_cmd.StopSpindle,
+        'M6'    : gcode_cmd.ChangeTool,
+        'M7'    : gcode_cmd.MistCoolantOn,
+        'M8'    : gcode_cmd.FloodCoolantOn,
+        'M9'    : gcode_cmd.CoolantOff,
+        }
+
+PLANE_CODE_TO_NAME = dict((v,k) for k,v in gcode_cmd.SelectPlane.planeToCodeDict.iteritems())
+UNITS_CODE_TO_NAME = {'G20': 'in', 'G21': 'mm'}
+COORD_CODE_TO_NUMBER = dict((v,k) for k,v in gcode_cmd.CoordinateSystem.Number2Code.iteritems())
+RETURN_CODE_TO_MODE = dict((v,k) for k,v in gcode_cmd.CannedCycleReturnMode.modeDict.iteritems())
+DIGITAL_OUTPUT_CODES = {'M62': (1,True), 'M63': (0,True), 'M64': (1,False), 'M65': (0,False)}
+CUTTER_COMP_CODES = {'G41': 'left', 'G42': 'right', 'G41.1': 'left', 'G42.1': 'right'}
+HOME_CODES = frozenset(('G28','G30','G28.1','G30.1'))
+
+MOTION_CODES = frozenset(('G0','G1','G2','G3','G5.1','G73','G81','G82','G83'))
+CYCLE_CODES = frozenset(('G73','G81','G82','G83'))
+PLANE_TO_HELICAL = {
+        'G17': (gcode_cmd.HelicalMotionXY, ('i','j')),
+        'G18': (gcode_cmd.HelicalMotionXZ, ('i','k')),
+        'G19': (gcode_cmd.HelicalMotionYZ, ('j','k')),
+        }
+
+# Order of execution of the codes on a line (RS274/NGC)
+CODE_ORDER = [
+        ('G93','G94','G95'),
+        ('F',),
+        ('S',),
+        ('T',),
+        ('M6',),
+        ('M3','M4','M5'),
+        ('M7','M8','M9'),
+        ('M62','M63','M64','M65'),
+        ('G4',),
+        ('G17','G18','G19','G17.1','G18.1','G19.1'),
+        ('G20','G21'),
+        ('G40','G41','G42','G41.1','G42.1'),
+        ('G43','G43.1','G49'),
+        ('G54','G55','G56','G57','G58','G59'),
+        ('G61','G61.1','G64'),
+        ('G90','G91'),
+        ('G98','G99'),
+        ('G80',) + tuple(sorted(MOTION_CODES)),
+        ('M0','M1','M2','M30'),
+        ]
+CODE_TO_ORDER = dict((code,i) for i, codes in enumerate(CODE_ORDER) for code in codes)
+MOTION_ORDER = CODE_TO_ORDER['G0']
+
+# ToolPath motion type codes (indexed by G0-G3) and allowed x,y,z,i,j,k
+# words (indexed by G0-G3 and column) for each plane
+RUN_MOTION_NUMBER = {'G0': 0, 'G1': 1, 'G2': 2, 'G3': 3}
+RUN_PLANE_TABLES = {
+        'G17': ((toolpath.MOTION_ARC_XY_CW, toolpath.MOTION_ARC_XY_CCW), (3,4)),
+        'G18': ((toolpath.MOTION_ARC_XZ_CW, toolpath.MOTION_ARC_XZ_CCW), (3,5)),
+        'G19': ((toolpath.MOTION_ARC_YZ_CW, toolpath.MOTION_ARC_YZ_CCW), (4,5)),
+        }
+for _plane, (_arcCodes, _offsetCols) in RUN_PLANE_TABLES.items():
+    _codeTable = numpy.array((toolpath.MOTION_RAPID, toolpath.MOTION_LINEAR) + _arcCodes)
+    _allowedTable = numpy.zeros((4,6),dtype=bool)
+    _allowedTable[:,:3] = True
+    _allowedTable[2:,_offsetCols] = True
+    _offsetTable = numpy.zeros((6,),dtype=bool)
+    _offsetTable[list(_offsetCols)] = True
+    RUN_PLANE_TABLES[_plane] = (_codeTable, _allowedTable, _offsetTable)
+
+
+class GCodeReader(object):
+    """
+    Reads gcode programs (e.g. .ngc files) into lists of gcode_cmd commands.
+    Lines are tokenized with a compiled regular expression and parsed in
+    batches of about batchSize bytes.
+
+    Supported are line numbers (N words), comments - ';' comments become
+    gcode_cmd.Comment commands and parenthesized comments are attached to the
+    command on the same line - and the codes for which there are gcode_cmd
+    commands, including helical motions with IJK offsets and the G73 and
+    G81-G83 canned cycles. Program number lines (O words) and the text of
+    '%' delimiter lines are kept as comments. Multiple codes on one line are
+    returned in execution order.
+    Modal state (motion mode, plane, canned cycle z, r, p and q words) is
+    tracked, so that axis words w/o a motion code become ModalMotion commands
+    (G0/G1) or repeat the current arc or canned cycle. Words or codes which
+    can't be represented raise a ValueError giving the line number - in
+    particular programs using G28/G30 (return to home), whose end position
+    isn't known, and O word subroutines and flow control are rejected.
+    """
+
+    def __init__(self,batchSize=DEFAULT_BATCH_SIZE):
+        self.batchSize = batchSize
+        self.reset()
+
+    def reset(self):
+        self.lineCount = 0
+        self.motionCode = None
+        self.planeCode = 'G17'
+        self.cycleParam = {}
+        self.lineNumberList = []
+
+    @property
+    def lineNumberStep(self):
+        """
+        Step between the first two line numbers read (None if less than two
+        line numbers have been read). Only the first two are kept.
+        """
+        if len(self.lineNumberList) < 2:
+            return None
+        return self.lineNumberList[1] - self.lineNumberList[0]
+
+    def read(self,filename):
+        """
+        Reads program from filename, or from filename.read if filename is a
+        file like object, and returns a GCodeProg.
+        """
+        prog = gcode_cmd.GCodeProg()
+        for listOfCmds in self.iterBatches(filename):
+            prog.listOfCmds.extend(listOfCmds)
+        self.setLineNumbers(prog)
+        return prog
+
+    def readToolPath(self,filename):
+        """
+        Reads program from filename (or file like object) and returns a
+        toolpath.ToolPath. Lines with only G0-G3 and x,y,z,i,j,k words are
+        written directly to the arrays w/o creating command objects. Motions
+        continuing the current G0/G1 mode are stored as explicit motions.
+        """
+        toolPath = toolpath.ToolPath()
+        if hasattr(filename,'read'):
+            self.readStreamToToolPath(filename,toolPath)
+        else:
+            with open(filename,'r') as f:
+                self.readStreamToToolPath(f,toolPath)
+        return toolPath
+
+    def readStreamToToolPath(self,stream,toolPath):
+        while True:
+            lines = stream.readlines(self.batchSize)
+            if not lines:
+                break
+            self.parseLinesToToolPath(lines,toolPath)
+
+    def parseLinesToToolPath(self,lines,toolPath):
+        """
+        Parses list of lines and appends them to toolPath. Runs of lines
+        matching MOTION_LINE_REGEX are parsed together, see addMotionRun.
+        """
+        runLines = []
+        for line in lines:
+            if MOTION_LINE_REGEX.match(line) is not None:
+                runLines.append(line)
+                continue
+            if runLines:
+                self.addMotionRun(runLines,toolPath)
+                runLines = []
+            self.addLine(line,toolPath)
+        if runLines:
+            self.addMotionRun(runLines,toolPath)
+
+    def addMotionRun(self,runLines,toolPath):
+        """
+        Adds run of G0-G3 motion lines to toolPath. The letters and numbers of
+        the whole run are split with str.translate and placed in the arrays
+        with numpy, w/o creating per word python objects. Runs which can't be
+        handled this way (no motion mode, repeated words, offsets which aren't
+        allowed for the motion or plane, arcs w/o an in plane offset) are
+        passed line by line to addLine, which raises for invalid lines.
+        """
+        text = ''.join(runLines)
+        if not text.endswith('\n'):
+            text += '\n'
+        letterArray = numpy.frombuffer(text.translate(None,RUN_LETTER_DELETE),dtype=numpy.uint8)
+        tokenCols = RUN_LETTER_TO_COLUMN[letterArray]
+        isNewline = tokenCols < 0
+        tokenRows = numpy.cumsum(isNewline) - isNewline
+        wordRows = tokenRows[~isNewline]
+        wordCols = tokenCols[~isNewline]
+        wordValues = numpy.fromstring(text.translate(RUN_NUMBER_TABLE),sep=' ')
+        numRows = len(runLines)
+
+        canAdd = self.planeCode in RUN_PLANE_TABLES
+        canAdd = canAdd and wordValues.shape[0] == wordCols.shape[0]
+        if canAdd:
+            # Motion code (0-3) of each row from G words and the current mode
+            isCode = wordCols == RUN_CODE_COLUMN
+            rowMotion = numpy.full((numRows,),-1,dtype=int)
+            rowMotion[wordRows[isCode]] = wordValues[isCode]
+            if rowMotion[0] < 0:
+                rowMotion[0] = RUN_MOTION_NUMBER.get(self.motionCode,-1)
+            setIndex = numpy.where(rowMotion >= 0, numpy.arange(numRows), 0)
+            rowMotion = rowMotion[numpy.maximum.accumulate(setIndex)]
+            wordRows = wordRows[~isCode]
+            wordCols = wordCols[~isCode]
+            wordValues = wordValues[~isCode]
+            key = 6*wordRows + wordCols
+            codeTable, allowedTable, offsetTable = RUN_PLANE_TABLES[self.planeCode]
+            # Arc rows need at least one in plane offset
+            rowHasOffset = numpy.zeros((numRows,),dtype=bool)
+            rowHasOffset[wordRows[offsetTable[wordCols]]] = True
+            canAdd = rowMotion[0] >= 0
+            canAdd = canAdd and numpy.bincount(key).max() <= 1
+            canAdd = canAdd and allowedTable[rowMotion[wordRows],wordCols].all()
+            canAdd = canAdd and rowHasOffset[rowMotion >= 2].all()
+        if not canAdd:
+            for line in runLines:
+                self.addLine(line,toolPath)
+            return
+
+        block = numpy.full((numRows*6,),numpy.nan)
+        block[key] = wordValues
+        block = block.reshape((numRows,6))
+        toolPath.addRows(codeTable[rowMotion],block[:,:3],block[:,3:])
+        self.motionCode = 'G{0}'.format(rowMotion[-1])
+        self.lineCount += numRows
+
+    def addLine(self,line,toolPath):
+        """
+        Parses single line and adds the commands to toolPath. Motions
+        continuing the current G0/G1 mode are stored as explicit motions and
+        canned cycle repeats are kept as ModalMotions.
+        """
+        for cmd in self.parseLine(line):
+            if type(cmd) is gcode_cmd.ModalMotion and not cmd.comment and self.motionCode in ('G0','G1'):
+                cls = gcode_cmd.RapidMotion if self.motionCode == 'G0' else gcode_cmd.LinearFeed
+                cmd = cls(**dict((k,v) for k,v in cmd.motionDict.iteritems() if v is not None))
+            toolPath.addCmd(cmd)
+
+    def iterBatches(self,filename):
+        """
+        Generator which yields lists of commands, one for each batch of lines
+        read from filename (or file like object).
+        """
+        if hasattr(filename,'read'):
+            for listOfCmds in self.iterStreamBatches(filename):
+                yield listOfCmds
+        else:
+            with open(filename,'r') as f:
+                for listOfCmds in self.iterStreamBatches(f):
+                    yield listOfCmds
+
+    def iterStreamBatches(self,stream):
+        while True:
+            lines = stream.readlines(self.batchSize)
+            if not lines:
+                break
+            yield self.parseLines(lines)
+
+    def parseString(self,progStr):
+        """
+        Parses program string and returns a GCodeProg.
+        """
+        prog = gcode_cmd.GCodeProg()
+        prog.listOfCmds = self.parseLines(progStr.splitlines())
+        self.setLineNumbers(prog)
+        return prog
+
+    def setLineNumbers(self,prog):
+        if self.lineNumberList:
+            prog.lineNumbers = True
+            if self.lineNumberStep > 0:
+                prog.lineNumberStep = self.lineNumberStep
+
+    def parseLines(self,lines):
+        """
+        Returns list of commands for list of lines.
+        """
+        listOfCmds = []
+        parseLine = self.parseLine
+        for line in lines:
+            listOfCmds.extend(parseLine(line))
+        return listOfCmds
+
+    def parseLine(self,line):
+        """
+        Returns list of commands for a single line.
+        """
+        self.lineCount += 1
+        line = line.strip()
+        if not line:
+            return [gcode_cmd.Space()]
+
+        # Strip comments
+        semiComment = None
+        if ';' in line:
+            line, semiComment = line.split(';',1)
+            semiComment = semiComment.strip()
+        parenCommentList = None
+        if '(' in line:
+            parenCommentList = PAREN_COMMENT_REGEX.findall(line)
+            line = PAREN_COMMENT_REGEX.sub(' ',line)
+        if line.startswith('%'):
+            header = line[1:].strip()
+            return [gcode_cmd.Comment(header)] if header else []
+        match = PROGRAM_NUMBER_REGEX.match(line)
+        if match is not None:
+            commentList = [match.group(1)] + (parenCommentList or [])
+            listOfCmds = [gcode_cmd.Comment(' '.join(commentList))]
+            if semiComment is not None:
+                listOfCmds.append(gcode_cmd.Comment(semiComment))
+            return listOfCmds
+
+        # Split into codes and words
+        codeList = []
+        wordDict = {}
+        for letter, number, bad in TOKEN_REGEX.findall(line):
+            if bad:
+                self.raiseError('unsupported syntax {0!r}'.format(bad))
+            letter = letter.upper()
+            if letter == 'G' or letter == 'M':
+                codeList.append(getCode(letter,number))
+            elif letter == 'N':
+                if codeList or wordDict:
+                    self.raiseError('line number must be first word')
+                if len(self.lineNumberList) < 2:
+                    self.lineNumberList.append(int(float(number)))
+            else:
+                letter = letter.lower()
+                if letter in wordDict:
+                    self.raiseError('repeated word {0}'.format(letter.upper()))
+                wordDict[letter] = float(number)
+
+        if codeList or wordDict:
+            listOfCmds = self.getCmdList(codeList,wordDict)
+        else:
+            listOfCmds = []
+
+        # Add comments
+        if parenCommentList:
+            commentStr = ' '.join(parenCommentList)
+            if listOfCmds:
+                listOfCmds[0].comment = True
+                listOfCmds[0].commentStr = commentStr
+            else:
+                listOfCmds.append(gcode_cmd.Comment(commentStr))
+        if semiComment is not None:
+            listOfCmds.append(gcode_cmd.Comment(semiComment))
+        return listOfCmds
+
+    def getCmdList(self,codeList,wordDict):
+        """
+        Returns list of commands for the codes and words on a line.
+        """
+        # Fast path for axis words continuing a G0/G1 motion
+        if not codeList and self.motionCode in ('G0','G1') and AXIS_WORDS.issuperset(wordDict):
+            return [gcode_cmd.ModalMotion(**wordDict)]
+
+        orderList = []
+        for code in codeList:
+            try:
+                orderList.append((CODE_TO_ORDER[code], code))
+            except KeyError:
+                if code in HOME_CODES:
+                    self.raiseError('unsupported code {0} (return to home position)'.format(code))
+                self.raiseError('unsupported code {0}'.format(code))
+        for letter in ('f', 's', 't'):
+            if letter in wordDict:
+                orderList.append((CODE_TO_ORDER[letter.upper()], letter.upper()))
+        orderList.sort()
+        for (order0, code0), (order1, code1) in zip(orderList[:-1],orderList[1:]):
+            if order0 == order1:
+                self.raiseError('codes {0} and {1} in same modal group'.format(code0,code1))
+
+        usedWords = set(['f','s','t'])
+        listOfCmds = []
+        motionCode = None
+        for order, code in orderList:
+            if order == MOTION_ORDER:
+                motionCode = code
+            elif order < MOTION_ORDER:
+                cmd = self.getCmd(code,wordDict,codeList,usedWords)
+                if cmd is not None:
+                    listOfCmds.append(cmd)
+
+        # Motion, either explicit or continuing the current motion mode
+        motionWords = [k for k in wordDict if k not in usedWords]
+        if motionCode == 'G80':
+            listOfCmds.append(gcode_cmd.CancelCannedCycle())
+            self.motionCode = None
+            motionCode = None
+        if motionCode is not None or motionWords:
+            if motionCode is None:
+                motionCode = self.motionCode
+                if motionCode is None:
+                    self.raiseError('words {0} w/o motion mode'.format(','.join(sorted(motionWords)).upper()))
+                explicit = False
+            else:
+                explicit = True
+            motionDict = dict((k,wordDict[k]) for k in motionWords)
+            listOfCmds.append(self.getMotionCmd(motionCode,motionDict,explicit))
+            self.motionCode = motionCode
+
+        # Remaining non-motion codes (program stops)
+        for order, code in orderList:
+            if order > MOTION_ORDER:
+                listOfCmds.append(SIMPLE_CODE_TO_CLASS[code]())
+        return listOfCmds
+
+    def getCmd(self,code,wordDict,codeList,usedWords):
+        """
+        Returns non-motion command for code. Words used by the command are
+        added to usedWords.
+        """
+        if code in SIMPLE_CODE_TO_CLASS:
+            if code == 'M6' and 't' in wordDict:
+                return None
+            return SIMPLE_CODE_TO_CLASS[code]()
+        elif code == 'F':
+            return gcode_cmd.FeedRate(wordDict['f'])
+        elif code == 'S':
+            return gcode_cmd.SpindleSpeed(wordDict['s'])
+        elif code == 'T':
+            if 'M6' in codeList:
+                return gcode_cmd.SelectAndChangeTool(int(wordDict['t']))
+            return gcode_cmd.SelectTool(int(wordDict['t']))
+        elif code in DIGITAL_OUTPUT_CODES:
+            value, synchronized = DIGITAL_OUTPUT_CODES[code]
+            pin = self.popWord('p',wordDict,usedWords,code)
+            return gcode_cmd.DigitalOutput(int(pin),value,synchronized)
+        elif code == 'G4':
+            return gcode_cmd.Dwell(self.popWord('p',wordDict,usedWords,code))
+        elif code in PLANE_CODE_TO_NAME:
+            self.planeCode = code
+            return gcode_cmd.SelectPlane(PLANE_CODE_TO_NAME[code])
+        elif code in UNITS_CODE_TO_NAME:
+            return gcode_cmd.Units(UNITS_CODE_TO_NAME[code])
+        elif code in CUTTER_COMP_CODES:
+            side = CUTTER_COMP_CODES[code]
+            if 'd' not in wordDict:
+                return gcode_cmd.CutterCompensation(side)
+            value = self.popWord('d',wordDict,usedWords,code)
+            if code.endswith('.1'):
+                return gcode_cmd.CutterCompensation(side,diameter=value)
+            else:
+                return gcode_cmd.CutterCompensation(side,toolNumber=int(value))
+        elif code == 'G43':
+            if 'h' in wordDict:
+                return gcode_cmd.EnableToolLengthOffset(int(self.popWord('h',wordDict,usedWords,code)))
+            return gcode_cmd.EnableToolLengthOffset()
+        elif code == 'G43.1':
+            axisDict = dict((k,v) for k,v in wordDict.iteritems() if k in AXIS_WORDS)
+            usedWords.update(axisDict)
+            return gcode_cmd.SetToolLengthOffset(**axisDict)
+        elif code in COORD_CODE_TO_NUMBER:
+            return gcode_cmd.CoordinateSystem(COORD_CODE_TO_NUMBER[code])
+        elif code == 'G64':
+            param = {}
+            for k in ('p','q'):
+                if k in wordDict:
+                    param[k] = self.popWord(k,wordDict,usedWords,code)
+            return gcode_cmd.PathBlendMode(**param)
+        elif code in RETURN_CODE_TO_MODE:
+            return gcode_cmd.CannedCycleReturnMode(RETURN_CODE_TO_MODE[code])
+        self.raiseError('unsupported code {0}'.format(code))
+
+    def getMotionCmd(self,code,motionDict,explicit):
+        """
+        Returns motion command for code and motion words. If explicit is False
+        the command continues the current motion mode.
+        """
+        try:
+            if code in ('G0','G1'):
+                if not AXIS_WORDS.issuperset(motionDict):
+                    self.raiseError('unsupported words for {0}'.format(code))
+                if not explicit:
+                    return gcode_cmd.ModalMotion(**motionDict)
+                elif code == 'G0':
+                    return gcode_cmd.RapidMotion(**motionDict)
+                else:
+                    return gcode_cmd.LinearFeed(**motionDict)
+            elif code in ('G2','G3'):
+                return self.getHelicalCmd(code,motionDict)
+            elif code == 'G5.1':
+                return gcode_cmd.QuadraticBSplineXY(**motionDict)
+            elif code in CYCLE_CODES:
+                if not explicit and XY_WORDS.issuperset(motionDict):
+                    return gcode_cmd.ModalMotion(**motionDict)
+                return self.getCycleCmd(code,motionDict)
+        except (RuntimeError, TypeError) as err:
+            self.raiseError('{0}: {1}'.format(code,err))
+        self.raiseError('unsupported motion code {0}'.format(code))
+
+    def getHelicalCmd(self,code,motionDict):
+        try:
+            cls, offsetWords = PLANE_TO_HELICAL[self.planeCode]
+        except KeyError:
+            self.raiseError('arcs not supported in plane {0}'.format(self.planeCode))
+        for k in motionDict:
+            if k in OFFSET_WORDS and k not in offsetWords:
+                self.raiseError('offset {0} not allowed in plane {1}'.format(k.upper(),self.planeCode))
+            if k not in cls.motionArgs:
+                self.raiseError('unsupported word {0} for {1}'.format(k.upper(),code))
+        if 'p' in motionDict:
+            motionDict['p'] = int(motionDict['p'])
+        motionDict['d'] = 'cw' if code == 'G2' else 'ccw'
+        return cls(**motionDict)
+
+    def getCycleCmd(self,code,motionDict):
+        if code != self.motionCode:
+            self.cycleParam = {}
+        if code == 'G83':
+            cls, stickyWords = gcode_cmd.PeckDrillCycle, ('z','r','q')
+        elif code == 'G73':
+            cls, stickyWords = gcode_cmd.HighSpeedPeckDrillCycle, ('z','r','q')
+        else:
+            cls, stickyWords = gcode_cmd.DrillCycle, ('z','r','p')
+        for k in motionDict:
+            if k not in cls.kwargsKeys:
+                self.raiseError('unsupported word {0} for {1}'.format(k.upper(),code))
+        for k in stickyWords:
+            if k in motionDict:
+                self.cycleParam[k] = motionDict[k]
+            elif k in self.cycleParam:
+                motionDict[k] = self.cycleParam[k]
+        if 'l' in motionDict:
+            motionDict['l'] = int(motionDict['l'])
+        if code == 'G81':
+            motionDict.pop('p',None)
+        elif code == 'G82' and 'p' not in motionDict:
+            self.raiseError('missing dwell P for G82')
+        return cls(**motionDict)
+
+    def popWord(self,letter,wordDict,usedWords,code):
+        if letter not in wordDict:
+            self.raiseError('missing {0} word for {1}'.format(letter.upper(),code))
+        usedWords.add(letter)
+        return wordDict[letter]
+
+    def raiseError(self,msg):
+        raise ValueError('line {0}: {1}'.format(self.lineCount,msg))
+
+
+# Utility functions
+# -----------------------------------------------------------------------------
+
+def getCode(letter,number):
+    """
+    Returns normalized G or M code string, e.g. G01 -> G1.
+    """
+    value = float(number)
+    if value == int(value):
+        return '{0}{1}'.format(letter,int(value))
+    else:
+        return '{0}{1:g}'.format(letter,value)
+
+def readProg(filename,batchSize=DEFAULT_BATCH_SIZE):
+    """
+    Reads gcode program from filename (or file like object) and returns a
+    GCodeProg. See GCodeReader.
+    """
+    return GCodeReader(batchSize=batchSize).read(filename)
+
+def readToolPath(filename,batchSize=DEFAULT_BATCH_SIZE):
+    """
+    Reads gcode program from filename (or file like object) and returns a
+    toolpath.ToolPath. See GCodeReader.
+    """
+    return GCodeReader(batchSize=batchSize).readToolPath(filename)
+
+def parseProg(progStr):
+    """
+    Parses gcode program string and returns a GCodeProg.
+    """
+    return GCodeReader().parseString(progStr)
+
+
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    import sys
+    import time
+    import gcode_optimize
+
+    if len(sys.argv) > 1:
+        t0 = time.time()
+        prog = readProg(sys.argv[1])
+        t1 = time.time()
+        print('read {0} commands in {1:1.2f}s'.format(len(prog.listOfCmds),t1-t0))
+    else:
+        import cnc_path
+        prog = gcode_cmd.GCodeProg()
+        prog.add(gcode_cmd.GenericStart())
+        prog.add(gcode_cmd.FeedRate(10.0))
+        prog.add(cnc_path.RectPath((0,0),(1,2),radius=0.2,helix=(0,-0.1)))
+        progStr = str(prog)
+        progRead = parseProg(progStr)
+        print(progRead)
+        print('round trip: {0}'.format(str(progRead) == progStr))
+        print(gcode_optimize.optimizeProg(progRead))
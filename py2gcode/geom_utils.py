@@ -61,20 +61,45 @@ class LineSeg2D(object):
     def midPoint(self):
         return midPoint2D(self.startPoint, self.endPoint)
 
-    def getFeedCmd(self,plane='xy'):
+    @property
+    def startTangent(self):
+        """
+        Unit direction of travel at the start point.
+        """
+        length = self.length
+        dx = self.endPoint[0] - self.startPoint[0]
+        dy = self.endPoint[1] - self.startPoint[1]
+        return dx/length, dy/length
+
+    @property
+    def endTangent(self):
+        """
+        Unit direction of travel at the end point.
+        """
+        return self.startTangent
+
+    def getFeedCmd(self,plane='xy',helix=None):
+        """
+        Returns linear feed to end point. If helix = (startZ, stopZ) is given
+        the feed moves to stopZ along the axis normal to the plane.
+        """
         kx, ky = tuple(plane)
         feedArgs = {kx: self.endPoint[0], ky: self.endPoint[1]}
+        if helix is not None:
+            feedArgs[cnc_path.PLANE_NORM_COORD[plane]] = helix[1]
         return gcode_cmd.LinearFeed(**feedArgs)
 
-    def getFeedToStartCmd(self, plane='xy'):
+    def getFeedToStartCmd(self, plane='xy',helix=None):
         kx, ky = tuple(plane)
         feedArgs = {kx: self.startPoint[0], ky: self.startPoint[1]}
+        if helix is not None:
+            feedArgs[cnc_path.PLANE_NORM_COORD[plane]] = helix[0]
         return gcode_cmd.LinearFeed(**feedArgs)
 
     def getRapidCmd(self,plane='xy'):
         kx, ky = tuple(plane)
         feedArgs = {kx: self.endPoint[0], ky: self.endPoint[1]}
-        return gcode_cmd.RapidMotion(feedArgs)
+        return gcode_cmd.RapidMotion(**feedArgs)
 
     def getRapidToStartCmd(self,plane='xy'):
         kx, ky = tuple(plane)
@@ -103,6 +128,15 @@ class LineSeg2D(object):
     def reverse(self):
         return  LineSeg2D(self.endPoint, self.startPoint)
 
+    def truncate(self,length):
+        """
+        Returns the initial part of the segment with the given length.
+        """
+        t = length/self.length
+        x = self.startPoint[0] + t*(self.endPoint[0] - self.startPoint[0])
+        y = self.startPoint[1] + t*(self.endPoint[1] - self.startPoint[1])
+        return LineSeg2D(self.startPoint, (x,y))
+
 
 
 class ArcSeg2D(object):
@@ -161,28 +195,62 @@ class ArcSeg2D(object):
         return x,y
 
     @property
-    def length(self):
+    def totalAngle(self):
+        """
+        Angle (radians) swept by the arc.
+        """
         if self.direction == 'ccw':
             totalAngle = self.endAngleAdj - self.startAngle
         else: 
             totalAngle = 2.0*math.pi - (self.endAngleAdj - self.startAngle)
-        return totalAngle*self.radius
+        return totalAngle
+
+    @property
+    def length(self):
+        return self.totalAngle*self.radius
 
-    def getFeedCmd(self,plane='xy'):
-        cmd = cnc_path.CircArcPath(
+    @property
+    def startTangent(self):
+        """
+        Unit direction of travel at the start point.
+        """
+        return self.getTangent(self.startAngle)
+
+    @property
+    def endTangent(self):
+        """
+        Unit direction of travel at the end point.
+        """
+        return self.getTangent(self.endAngle)
+
+    def getTangent(self,angle):
+        if self.direction == 'ccw':
+            return -math.sin(angle), math.cos(angle)
+        else:
+            return math.sin(angle), -math.cos(angle)
+
+    def getFeedCmd(self,plane='xy',helix=None):
+        """
+        Returns helical motion command to the end point. If helix = (startZ,
+        stopZ) is given the motion moves to stopZ along the axis normal to the
+        plane.
+        """
+        path = cnc_path.CircArcPath(
                 self.center, 
                 self.radius, 
                 ang = (self.startAngleDeg, self.endAngleDeg),
                 plane=plane,
                 direction = self.direction,
-                helix = None,
+                helix = helix,
                 includeFeedToStart = False,
                 )
-        return cmd
+        return path.listOfCmds[0]
 
-    def getFeedToStartCmd(self,plane='xy'):
+    def getFeedToStartCmd(self,plane='xy',helix=None):
         kx, ky = tuple(plane)
         feedArgs = {kx: self.startPoint[0], ky: self.startPoint[1]}
+        if helix is not None:
+            feedArgs[cnc_path.PLANE_NORM_COORD[plane]] = helix[0]
         return gcode_cmd.LinearFeed(**feedArgs)
 
     def getRapidToStartCmd(self,plane='xy'):
@@ -190,24 +258,26 @@ class ArcSeg2D(object):
         feedArgs = {kx: self.startPoint[0], ky: self.startPoint[1]}
         return gcode_cmd.RapidMotion(**feedArgs)
 
-    def convertToLineSegList(self, maxArcLen=1.0e-5):
-        totalAngle = abs(self.endAngleAdj - self.startAngle)
-        maxStepAngle = maxArcLen/self.radius
-        numPts = int(math.ceil(totalAngle/maxStepAngle))
-
+    def convertToPointArray(self, maxArcLen=None, maxChordErr=None, minSegLen=None):
+        """
+        Returns (N,2) array of points along the arc from start to end point.
+        See getArcMaxStepAngle for the tessellation options. If neither
+        maxArcLen nor maxChordErr is given maxArcLen defaults to 1.0e-5; with
+        maxChordErr an explicit maxArcLen is an upper bound on segment length.
+        """
+        if maxArcLen is None and maxChordErr is None:
+            maxArcLen = 1.0e-5
         if self.direction == 'ccw':
-            stepAngleArray = numpy.linspace(self.startAngle, self.endAngleAdj, numPts)
+            startAngle = self.startAngle
         else:
-            stepAngleArray = numpy.linspace(self.startAngle+2.0*math.pi, self.endAngleAdj, numPts)
-
-        lineSegList = []
-        for ang0, ang1 in zip(stepAngleArray[:-1], stepAngleArray[1:]):
-            x0 = self.center[0] + self.radius*math.cos(ang0)
-            y0 = self.center[1] + self.radius*math.sin(ang0)
-            x1 = self.center[0] + self.radius*math.cos(ang1)
-            y1 = self.center[1] + self.radius*math.sin(ang1)
-            lineSeg = LineSeg2D((x0,y0), (x1,y1))
-            lineSegList.append(lineSeg)
+            startAngle = self.startAngle + 2.0*math.pi
+        return getArcPointArray(self.center,self.radius,startAngle,self.endAngleAdj,maxArcLen,
+                maxChordErr,minSegLen)
+
+    def convertToLineSegList(self, maxArcLen=None, maxChordErr=None, minSegLen=None):
+        pointArray = self.convertToPointArray(maxArcLen,maxChordErr,minSegLen)
+        pointList = pointArray.tolist()
+        lineSegList = [LineSeg2D(p,q) for p,q in zip(pointList[:-1], pointList[1:])]
         return lineSegList
 
     def divideEqual(self,num):
@@ -221,7 +291,22 @@ class ArcSeg2D(object):
         return segList
 
     def reverse(self):
-        return ArcSeg2D(self.center, self.radius, self.endAngle, self.startAngle)
+        if self.direction == 'ccw':
+            direction = 'cw'
+        else:
+            direction = 'ccw'
+        return ArcSeg2D(self.center, self.radius, self.endAngle, self.startAngle, direction)
+
+    def truncate(self,length):
+        """
+        Returns the initial part of the arc with the given length.
+        """
+        angle = length/self.radius
+        if self.direction == 'ccw':
+            endAngle = self.startAngle + angle
+        else:
+            endAngle = self.startAngle - angle
+        return ArcSeg2D(self.center, self.radius, self.startAngle, endAngle, self.direction)
 
     def plot(self,color=None,maxArcLen=1.0e-2,showStartPoint=False):
         if havePlt:
@@ -287,6 +372,190 @@ def plotSegList(segList,color=None):
     for seg in segList:
         seg.plot(color=color)
 
+def joinPointArrayList(pointArrayList):
+    """
+    Joins a list of (N,2) polyline point arrays, where each polyline starts
+    where the previous one ends, into a single (M,2) point array. The start
+    point of each polyline is kept at the junctions.
+    """
+    arrayList = [x[:-1] for x in pointArrayList]
+    arrayList.append(pointArrayList[-1][-1:])
+    return numpy.concatenate(arrayList)
+
+def simplifyPolyline(pointArray,tol):
+    """
+    Returns simplified copy of (N,D) polyline point array. Consecutive
+    duplicate points are removed and then points are removed by the
+    Douglas-Peucker algorithm - so that no removed point is more than tol from
+    the simplified polyline. Collinear runs are merged into a single segment.
+    The first and last points are always kept. 
+    """
+    pointArray = numpy.asarray(pointArray,dtype=float)
+    if pointArray.shape[0] < 2:
+        return pointArray.copy()
+
+    # Remove consecutive duplicates (keeping the last point)
+    isDuplicate = numpy.all(pointArray[1:] == pointArray[:-1],axis=1)
+    keepMask = numpy.ones((pointArray.shape[0],),dtype=bool)
+    keepMask[:-1] = ~isDuplicate
+    pointArray = pointArray[keepMask]
+    numPts = pointArray.shape[0]
+    if numPts < 3:
+        return pointArray
+
+    tolSqr = float(tol)**2
+    keepMask = numpy.zeros((numPts,),dtype=bool)
+    keepMask[0] = True
+    keepMask[-1] = True
+    rangeStack = [(0, numPts-1)]
+    while rangeStack:
+        i0, i1 = rangeStack.pop()
+        if i1 - i0 < 2:
+            continue
+        distSqr = getPointSegDistSqr(pointArray[i0+1:i1],pointArray[i0],pointArray[i1])
+        j = int(numpy.argmax(distSqr))
+        if distSqr[j] > tolSqr:
+            k = i0 + 1 + j
+            keepMask[k] = True
+            rangeStack.append((i0,k))
+            rangeStack.append((k,i1))
+    return pointArray[keepMask]
+
+def getPointSegDistSqr(pointArray,p0,p1):
+    """
+    Returns array of squared distances from the points in (N,D) pointArray to
+    the line segment from p0 to p1.
+    """
+    vec = p1 - p0
+    vecLenSqr = numpy.dot(vec,vec)
+    diff = pointArray - p0
+    if vecLenSqr > 0:
+        t = numpy.clip(numpy.dot(diff,vec)/vecLenSqr,0.0,1.0)
+        diff = diff - t[:,numpy.newaxis]*vec
+    return numpy.einsum('ij,ij->i',diff,diff)
+
+def getArcFitList(pointArray,tol,minPoints=4):
+    """
+    Fits circular arcs to runs of points in an (N,2) or (N,3) polyline point
+    array. Returns list of moves (index, center, direction) which together
+    traverse the polyline, where index is the index of the end point of the
+    move. For linear moves center and direction are None, for arcs center is
+    the (x,y) center and direction is 'cw' or 'ccw'. A run of at least
+    minPoints points is replaced by an arc if no point is more than tol from
+    the arc, no segment is more than tol from the arc (sagitta) and - for
+    (N,3) arrays - z varies linearly with angle to within tol.  
+    """
+    pointArray = numpy.asarray(pointArray,dtype=float)
+    numPts = pointArray.shape[0]
+    minPoints = max(int(minPoints),3)
+    moveList = []
+    if numPts < 2:
+        return moveList
+
+    # Candidate runs are runs of vertices turning in the same direction
+    vecArray = numpy.diff(pointArray[:,:2],axis=0)
+    cross = vecArray[:-1,0]*vecArray[1:,1] - vecArray[:-1,1]*vecArray[1:,0]
+    turnArray = numpy.sign(cross).astype(int)
+    runList = []
+    k = 0
+    while k < turnArray.shape[0]:
+        if turnArray[k] == 0:
+            k += 1
+            continue
+        m = k
+        while m + 1 < turnArray.shape[0] and turnArray[m+1] == turnArray[k]:
+            m += 1
+        # Vertices k+1 ... m+1 -> points k ... m+2
+        if m + 3 - k >= minPoints:
+            runList.append((k, m+2))
+        k = m + 1
+
+    index = 0
+    for lo, hi in runList:
+        while index < lo:
+            index += 1
+            moveList.append((index, None, None))
+        index = max(index,lo)
+        while index < hi:
+            end = index + minPoints - 1
+            arc = fitArc(pointArray[index:end+1],tol) if end <= hi else None
+            if arc is None:
+                index += 1
+                moveList.append((index, None, None))
+                continue
+            # Grow arc by doubling then bisect for the longest fit
+            good, bad, step = end, None, minPoints
+            while good < hi:
+                test = min(good + step, hi)
+                testArc = fitArc(pointArray[index:test+1],tol)
+                if testArc is None:
+                    bad = test
+                    break
+                good, arc = test, testArc
+                step *= 2
+            while bad is not None and bad - good > 1:
+                test = (good + bad)//2
+                testArc = fitArc(pointArray[index:test+1],tol)
+                if testArc is None:
+                    bad = test
+                else:
+                    good, arc = test, testArc
+            index = good
+            moveList.append((index, arc[0], arc[1]))
+    while index < numPts - 1:
+        index += 1
+        moveList.append((index, None, None))
+    return moveList
+
+def fitArc(pointArray,tol):
+    """
+    Returns (center, direction) of the arc through the first, middle and last
+    points of an (N,2) or (N,3) point array if the polyline lies within tol
+    of it (see getArcFitList) and None otherwise. Straight runs, which are
+    within tol of the chord, aren't fitted.
+    """
+    p0 = pointArray[0,:2]
+    p1 = pointArray[-1,:2]
+    b = pointArray[pointArray.shape[0]//2,:2] - p0
+    c = p1 - p0
+    d = 2.0*(b[0]*c[1] - b[1]*c[0])
+    if d == 0:
+        return None
+    bb, cc = numpy.dot(b,b), numpy.dot(c,c)
+    center = p0 + numpy.array([c[1]*bb - b[1]*cc, b[0]*cc - c[0]*bb])/d
+    radius = math.sqrt(numpy.dot(center-p0,center-p0))
+
+    tolSqr = float(tol)**2
+    if getPointSegDistSqr(pointArray[:,:2],p0,p1).max() <= tolSqr:
+        return None
+    relArray = pointArray[:,:2] - center
+    if numpy.abs(numpy.hypot(relArray[:,0],relArray[:,1]) - radius).max() > tol:
+        return None
+
+    # Angle steps must all have the same sign and sweep less than a turn
+    angArray = numpy.arctan2(relArray[:,1],relArray[:,0])
+    stepArray = numpy.diff(angArray)
+    stepArray = (stepArray + math.pi) % (2*math.pi) - math.pi
+    if (stepArray > 0).all():
+        direction = 'ccw'
+    elif (stepArray < 0).all():
+        direction = 'cw'
+    else:
+        return None
+    stepArray = numpy.abs(stepArray)
+    sweepArray = numpy.cumsum(stepArray)
+    if sweepArray[-1] >= 2*math.pi:
+        return None
+    if radius*(1.0 - numpy.cos(0.5*stepArray.max())) > tol:
+        return None
+
+    if pointArray.shape[1] > 2:
+        z = pointArray[:,2]
+        zFit = z[0] + (z[-1] - z[0])*sweepArray/sweepArray[-1]
+        if numpy.abs(z[1:] - zFit).max() > tol:
+            return None
+    return center, direction
+
 
 # Basic geometery
 # -----------------------------------------------------------------------------
@@ -301,6 +570,90 @@ def midPoint2D(p,q):
     return 0.5*(p[0] + q[0]), 0.5*(p[1] + q[1])
 
 
+# Arc tessellation
+# -----------------------------------------------------------------------------
+
+def getArcMaxStepAngle(radius, maxArcLen, maxChordErr=None, minSegLen=None):
+    """
+    Returns the maximum angle (radians) between tessellation points of an arc.
+    If maxChordErr is given the step is the largest for which the chord
+    deviates from the arc by no more than maxChordErr (sagitta), bounded below
+    by minSegLen and above by maxArcLen (either may be None). Otherwise the
+    step is set by maxArcLen alone. Works on scalars or arrays.
+    """
+    if maxArcLen is not None and maxArcLen <= 0:
+        raise ValueError('maxArcLen must be > 0')
+    if maxChordErr is not None and maxChordErr <= 0:
+        raise ValueError('maxChordErr must be > 0')
+    radius = numpy.asarray(radius,dtype=float)
+    if maxChordErr is None:
+        if maxArcLen is None:
+            raise ValueError('maxArcLen or maxChordErr must be given')
+        return maxArcLen/radius
+    cosHalfStep = numpy.clip(1.0 - maxChordErr/radius,-1.0,1.0)
+    maxStepAngle = 2.0*numpy.arccos(cosHalfStep)
+    if minSegLen is not None:
+        maxStepAngle = numpy.maximum(maxStepAngle,minSegLen/radius)
+    if maxArcLen is not None:
+        maxStepAngle = numpy.minimum(maxStepAngle,maxArcLen/radius)
+    return maxStepAngle
+
+def getArcNumPts(radius, totalAngle, maxArcLen, maxChordErr=None, minSegLen=None):
+    """
+    Returns the number of points (>= 2) needed to tessellate an arc so that
+    no step exceeds the maximum step angle (see getArcMaxStepAngle). Works on
+    scalars or arrays.
+    """
+    maxStepAngle = getArcMaxStepAngle(radius, maxArcLen, maxChordErr, minSegLen)
+    numPts = numpy.ceil(numpy.abs(totalAngle)/maxStepAngle).astype(int) + 1
+    return numpy.maximum(numPts,2)
+
+def getArcPointArray(center, radius, startAngle, endAngle, maxArcLen, maxChordErr=None, minSegLen=None):
+    """
+    Tessellates the arc with given center and radius from startAngle to
+    endAngle (radians) into an (N,2) array of points. The arc is traversed in
+    the direction of increasing angle if endAngle > startAngle and decreasing
+    angle otherwise.
+    """
+    numPts = int(getArcNumPts(radius, endAngle - startAngle, maxArcLen, maxChordErr, minSegLen))
+    angArray = numpy.linspace(startAngle, endAngle, numPts)
+    pointArray = numpy.empty((numPts,2))
+    pointArray[:,0] = center[0] + radius*numpy.cos(angArray)
+    pointArray[:,1] = center[1] + radius*numpy.sin(angArray)
+    return pointArray
+
+def getArcPointArrayList(centerArray, radiusArray, startAngleArray, endAngleArray, maxArcLen,
+        maxChordErr=None, minSegLen=None):
+    """
+    Batch version of getArcPointArray. Tessellates all arcs at once and
+    returns a list of (N,2) point arrays, one for each arc. The arrays are
+    contiguous slices of a single (M,2) array.
+    """
+    centerArray = numpy.asarray(centerArray,dtype=float).reshape(-1,2)
+    radiusArray = numpy.asarray(radiusArray,dtype=float)
+    startAngleArray = numpy.asarray(startAngleArray,dtype=float)
+    endAngleArray = numpy.asarray(endAngleArray,dtype=float)
+    if not radiusArray.size:
+        return []
+    deltaAngleArray = endAngleArray - startAngleArray
+    numPtsArray = getArcNumPts(radiusArray, deltaAngleArray, maxArcLen, maxChordErr, minSegLen)
+    stopIndArray = numpy.cumsum(numPtsArray)
+    startIndArray = stopIndArray - numPtsArray
+
+    # Angles computed as in numpy.linspace, arc by arc
+    arcIndArray = numpy.repeat(numpy.arange(radiusArray.size), numPtsArray)
+    stepIndArray = numpy.arange(stopIndArray[-1]) - startIndArray[arcIndArray]
+    stepAngleArray = deltaAngleArray/(numPtsArray - 1)
+    angArray = stepIndArray*stepAngleArray[arcIndArray] + startAngleArray[arcIndArray]
+    angArray[stopIndArray-1] = endAngleArray
+
+    pointArray = numpy.empty((angArray.size,2))
+    radiusRep = radiusArray[arcIndArray]
+    pointArray[:,0] = centerArray[arcIndArray,0] + radiusRep*numpy.cos(angArray)
+    pointArray[:,1] = centerArray[arcIndArray,1] + radiusRep*numpy.sin(angArray)
+    return [pointArray[i:j] for i,j in zip(startIndArray, stopIndArray)]
+
+
 
 # -----------------------------------------------------------------------------
 if __name__ == '__main__':
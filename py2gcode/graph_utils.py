@@ -15,17 +15,25 @@ See the License for the specific language governing permissions and
 limitations under the License.
 
 """
+import math
+import numpy
 import networkx
 import dxf_utils
 import geom_utils
+import order_utils
+import progress_utils
 
-def getEntityGraph(entityList, ptEquivTol=1.0e-6):
-    print(' create point to node dict')
-    ptToNodeDict = getPtToNodeDict(entityList,ptEquivTol)
-    print(' create graph')
+def getEntityGraph(entityList, ptEquivTol=1.0e-6, progress=None):
+    progress = progress_utils.getProgress(progress)
+    entityPtList = [dxf_utils.getEntityStartAndEndPts(x) for x in entityList]
+    ptList = [p for pts in entityPtList for p in pts]
+    ptToNodeDict = getPtListToNodeDict(ptList,ptEquivTol,progress=progress)
     graph = networkx.Graph()
-    for entity in entityList:
-        startPt, endPt = dxf_utils.getEntityStartAndEndPts(entity)
+    numEntity = len(entityList)
+    reportProgress = progress.enabled
+    for i, (entity, (startPt, endPt)) in enumerate(zip(entityList, entityPtList)):
+        if reportProgress:
+            progress.update('create graph', i+1, numEntity)
         startNode = ptToNodeDict[startPt]
         graph.add_node(startNode,coord=startPt)
         endNode = ptToNodeDict[endPt]
@@ -38,23 +46,213 @@ def getEntityGraph(entityList, ptEquivTol=1.0e-6):
             graph.remove_edge(*edge)
     return graph, ptToNodeDict
 
-def getPtToNodeDict(entityList, ptEquivTol=1.0e-6):
+def getPtToNodeDict(entityList, ptEquivTol=1.0e-6, progress=None):
     ptList = []
     for entity in entityList:
         startPt, endPt = dxf_utils.getEntityStartAndEndPts(entity)
         ptList.extend([startPt, endPt])
+    return getPtListToNodeDict(ptList,ptEquivTol,progress=progress)
+
+def getPtListToNodeDict(ptList, ptEquivTol=1.0e-6, progress=None):
+    """
+    Assigns a node number to each point in ptList. A point is given the node of
+    the first previous point within ptEquivTol of it, otherwise it gets a new
+    node. Previous points are found using a grid hash with cell size ptEquivTol
+    so that only the 3x3 block of cells around each point needs to be checked.
+    """
+    if ptEquivTol <= 0:
+        raise ValueError('ptEquivTol must be > 0')
+    progress = progress_utils.getProgress(progress)
+    numPts = len(ptList)
     ptToNodeDict = {}
+    cellToIndexDict = {}
     nodeCnt = 0
-    numPts = len(ptList)
+    reportProgress = progress.enabled
     for i, p in enumerate(ptList):
-        print('{0:1.0f}%'.format(100*float(i)/float(numPts)))
-        found = False
-        for q in ptList[:i]:
-            if geom_utils.dist2D(p,q) < ptEquivTol:
-                found = True
-                ptToNodeDict[p] = ptToNodeDict[q] 
-                break
-        if not found:
+        if reportProgress:
+            progress.update('create point to node dict', i+1, numPts)
+        cx = int(math.floor(p[0]/ptEquivTol))
+        cy = int(math.floor(p[1]/ptEquivTol))
+        foundIndex = None
+        for nx in (cx-1, cx, cx+1):
+            for ny in (cy-1, cy, cy+1):
+                for j in cellToIndexDict.get((nx,ny),()):
+                    if foundIndex is not None and j > foundIndex:
+                        break
+                    if geom_utils.dist2D(p,ptList[j]) < ptEquivTol:
+                        foundIndex = j
+                        break
+        if foundIndex is None:
             ptToNodeDict[p] = nodeCnt
             nodeCnt += 1
+        else:
+            ptToNodeDict[p] = ptToNodeDict[ptList[foundIndex]]
+        cellToIndexDict.setdefault((cx,cy),[]).append(i)
     return ptToNodeDict
+
+def getCutTaskList(subGraphList, skipIsolated=False):
+    """
+    Splits the connected components of an entity graph into cutting tasks.
+    Returns list of (graph, closed) where closed is True for closed loops
+    (all nodes of degree 2) and False for line strings. Components with nodes
+    of degree > 2 give a line string task per edge. Components without edges
+    are skipped if skipIsolated is True and raise a RuntimeError otherwise.
+    """
+    taskList = []
+    for subGraph in subGraphList:
+        nodeDegreeList = [subGraph.degree(n) for n in subGraph]
+        maxNodeDegree = max(nodeDegreeList)
+        minNodeDegree = min(nodeDegreeList)
+        if maxNodeDegree > 2:
+            for edge in subGraph.edges():
+                taskList.append((subGraph.subgraph(edge), False))
+        elif maxNodeDegree == 2 and minNodeDegree == 2:
+            taskList.append((subGraph, True))
+        elif minNodeDegree == 1:
+            taskList.append((subGraph, False))
+        elif not skipIsolated:
+            errorMsg = 'sub-graph has nodes with degree 0'
+            raise RuntimeError(errorMsg)
+    return taskList
+
+def getCutTaskEntryNodeList(graph, closed):
+    """
+    Returns list of nodes at which a cutting task can start - all nodes for
+    closed loops and the two end nodes for line strings.
+    """
+    if closed:
+        return list(graph.nodes())
+    else:
+        return [n for n in graph if graph.degree(n) == 1] or list(graph.nodes())
+
+def getOrderedCutTaskList(taskList, method, startPt=None, startCond='minX', timeBudget=None,
+        depthList=None):
+    """
+    Orders cutting tasks (see getCutTaskList) to reduce the rapid travel
+    between them, with each closed loop started near the end of the previous
+    task. Returns list of (graph, closed, startNode).
+
+    method     = 'nearest' or 'optimize' (see order_utils.getTaskOrder)
+    startPt    = tool x,y position before the first task. If None the first
+                 task starts at the entry point given by startCond.
+    timeBudget = time budget in secs for 'optimize' (per depth level)
+    depthList  = (optional) depth level of each task. Levels are ordered
+                 separately and cut from the deepest up.
+    """
+    if not taskList:
+        return []
+    entryNodeLists = [getCutTaskEntryNodeList(*task) for task in taskList]
+    entryPtLists = []
+    for (graph, closed), entryNodeList in zip(taskList,entryNodeLists):
+        entryPtLists.append([graph.node[n]['coord'] for n in entryNodeList])
+    closedList = [closed for graph, closed in taskList]
+    if startPt is None:
+        allPtList = [p for ptList in entryPtLists for p in ptList]
+        startPt = allPtList[order_utils.getStartCondIndex(allPtList,startCond)]
+    if depthList is None:
+        depthList = [0]*len(taskList)
+    orderedTaskList = []
+    for depth in sorted(set(depthList),reverse=True):
+        indexList = [i for i, x in enumerate(depthList) if x == depth]
+        plan = order_utils.getTaskOrder(
+                [entryPtLists[i] for i in indexList],
+                [closedList[i] for i in indexList],
+                startPt,
+                method,
+                timeBudget=timeBudget
+                )
+        for k, j in plan:
+            i = indexList[k]
+            orderedTaskList.append(taskList[i] + (entryNodeLists[i][j],))
+            startPt = order_utils.getTaskExitPt(entryPtLists[i],closedList[i],j)
+    return orderedTaskList
+
+def getClosedLoopPath(graph, startNode):
+    """
+    Returns the node path around a closed loop graph (all nodes of degree 2)
+    starting and ending at startNode. The loop is walked from startNode
+    towards its second neighbor so that the path ends by returning from the
+    first neighbor.
+    """
+    neighborList = list(graph.neighbors(startNode))
+    if len(neighborList) != 2:
+        raise RuntimeError('closed loop start node must have degree 2')
+    nodePath = [startNode]
+    prevNode, currNode = startNode, neighborList[1]
+    while currNode != startNode:
+        nodePath.append(currNode)
+        prevNode, currNode = currNode, getNextPathNode(graph, prevNode, currNode)
+    nodePath.append(startNode)
+    return nodePath
+
+def getLineStringPath(graph, startNode, endNode):
+    """
+    Returns the node path from startNode to endNode for a line string graph
+    (all nodes of degree <= 2).
+    """
+    nodePath = [startNode]
+    prevNode, currNode = None, startNode
+    while currNode != endNode:
+        prevNode, currNode = currNode, getNextPathNode(graph, prevNode, currNode)
+        if currNode is None or len(nodePath) >= graph.number_of_nodes():
+            raise RuntimeError('no path from start node to end node')
+        nodePath.append(currNode)
+    return nodePath
+
+def getNextPathNode(graph, prevNode, currNode):
+    """
+    Returns the neighbor of currNode which isn't prevNode, or None if there is
+    no such neighbor, for graphs with node degree <= 2.
+    """
+    nextNodeList = [n for n in graph.neighbors(currNode) if n != prevNode]
+    if len(nextNodeList) > 1:
+        raise RuntimeError('path walk requires node degree <= 2')
+    if nextNodeList:
+        return nextNodeList[0]
+    else:
+        return None
+
+def getNodePathPointArrayList(nodePath, graph, maxArcLen, ptEquivTol=1.0e-6, maxChordErr=None,
+        minSegLen=None):
+    """
+    Returns a list of (N,2) point arrays, one for each edge entity along the
+    node path, oriented in the direction of travel. Arcs are tessellated
+    together so that no segment is longer than maxArcLen or, if maxChordErr
+    is given, by chord error (see geom_utils.getArcMaxStepAngle).
+    """
+    edgeList = zip(nodePath[:-1], nodePath[1:])
+    entityList = [graph[node0][node1]['entity'] for node0, node1 in edgeList]
+    arcList = [x for x in entityList if x.dxftype != 'LINE']
+    arcPointArrayList = dxf_utils.getDxfArcPointArrayList(arcList,maxArcLen,maxChordErr,minSegLen)
+    arcPointArrayIter = iter(arcPointArrayList)
+    pointArrayList = []
+    for (node0, node1), entity in zip(edgeList, entityList):
+        startCoord = graph.node[node0]['coord']
+        endCoord = graph.node[node1]['coord']
+        if entity.dxftype == 'LINE':
+            pointArray = numpy.array([startCoord, endCoord],dtype=float)
+        else:
+            pointArray = next(arcPointArrayIter)
+            if geom_utils.dist2D(pointArray[0],startCoord) > ptEquivTol:
+                pointArray = pointArray[::-1]
+        pointArrayList.append(pointArray)
+    return pointArrayList
+
+def getNodePathSegList(nodePath, graph, ptEquivTol=1.0e-6):
+    """
+    Returns list of geom_utils.LineSeg2D and ArcSeg2D segments, one for each
+    edge entity along the node path, oriented in the direction of travel.
+    """
+    segList = []
+    for node0, node1 in zip(nodePath[:-1], nodePath[1:]):
+        entity = graph[node0][node1]['entity']
+        startCoord = graph.node[node0]['coord']
+        endCoord = graph.node[node1]['coord']
+        if entity.dxftype == 'LINE':
+            seg = geom_utils.LineSeg2D(startCoord, endCoord)
+        else:
+            seg = dxf_utils.getDxfArcSeg(entity)
+            if geom_utils.dist2D(seg.startPoint,startCoord) > ptEquivTol:
+                seg = seg.reverse()
+        segList.append(seg)
+    return segList
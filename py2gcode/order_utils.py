@@ -0,0 +1,540 @@
+"""
+
+Copyright 2014 IO Rodeo Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+from __future__ import print_function
+import math
+import time
+import collections
+import numpy
+import shapely.geometry as geometry
+import shapely.prepared as prepared
+from shapely.strtree import STRtree
+
+ORDER_METHODS = ('nearest', 'optimize')
+DEFAULT_NUM_NEIGHBORS = 8
+MAX_OR_OPT_LEN = 3
+TIME_CHECK_INTERVAL = 256
+MIN_GAIN = 1.0e-9
+
+
+class PointGrid(object):
+    """
+    Grid hash of 2D points for nearest point queries. The cell size is chosen
+    so that there are about two points per cell. Points can be removed, which
+    is used when building nearest neighbor orders.
+    """
+
+    def __init__(self,ptList,cellSize=None):
+        self.xList = [float(p[0]) for p in ptList]
+        self.yList = [float(p[1]) for p in ptList]
+        numPts = len(self.xList)
+        if cellSize is None:
+            cellSize = getDefaultCellSize(self.xList,self.yList)
+        self.cellSize = cellSize
+        self.cellDict = {}
+        for i in range(numPts):
+            self.cellDict.setdefault(self.getCell(i),[]).append(i)
+
+    def __len__(self):
+        return sum(len(v) for v in self.cellDict.itervalues())
+
+    def getCell(self,i):
+        cx = int(math.floor(self.xList[i]/self.cellSize))
+        cy = int(math.floor(self.yList[i]/self.cellSize))
+        return cx, cy
+
+    def remove(self,i):
+        cell = self.getCell(i)
+        indexList = self.cellDict[cell]
+        indexList.remove(i)
+        if not indexList:
+            del self.cellDict[cell]
+
+    def iterRing(self,cx,cy,r):
+        """
+        Generator of the index lists of non-empty cells on the square ring at
+        distance r (in cells) from cell (cx,cy).
+        """
+        cellDict = self.cellDict
+        if r == 0:
+            if (cx,cy) in cellDict:
+                yield cellDict[(cx,cy)]
+            return
+        for nx in range(cx-r, cx+r+1):
+            for ny in (cy-r, cy+r):
+                if (nx,ny) in cellDict:
+                    yield cellDict[(nx,ny)]
+        for ny in range(cy-r+1, cy+r):
+            for nx in (cx-r, cx+r):
+                if (nx,ny) in cellDict:
+                    yield cellDict[(nx,ny)]
+
+    def getNearestList(self,x,y,num=1,exclude=None):
+        """
+        Returns list of (up to) num indices of the points nearest to (x,y),
+        closest first. Point exclude (an index) is skipped.
+
+        Rings of cells around (x,y) are searched until the next ring can't
+        contain a point closer than those found. If the rings get larger than
+        the number of non-empty cells the remaining cells are scanned directly.
+        """
+        xList, yList = self.xList, self.yList
+        cx = int(math.floor(x/self.cellSize))
+        cy = int(math.floor(y/self.cellSize))
+        foundList = []
+        r = 0
+        while True:
+            if foundList and len(foundList) >= num:
+                if (r-1)*self.cellSize >= foundList[num-1][0]:
+                    break
+            if 8*r > len(self.cellDict):
+                for (nx,ny), indexList in self.cellDict.iteritems():
+                    if max(abs(nx-cx),abs(ny-cy)) >= r:
+                        foundList.extend(self.getDistList(x,y,indexList,exclude))
+                foundList.sort()
+                break
+            for indexList in self.iterRing(cx,cy,r):
+                foundList.extend(self.getDistList(x,y,indexList,exclude))
+            foundList.sort()
+            r += 1
+        return [i for dist, i in foundList[:num]]
+
+    def getDistList(self,x,y,indexList,exclude=None):
+        xList, yList = self.xList, self.yList
+        return [(math.hypot(xList[i]-x, yList[i]-y), i) for i in indexList if i != exclude]
+
+    def getNearest(self,x,y):
+        """
+        Returns index of the point nearest to (x,y) or None if the grid is
+        empty.
+        """
+        if not self.cellDict:
+            return None
+        return self.getNearestList(x,y,1)[0]
+
+
+class PathOptimizer(object):
+    """
+    Local search for short open paths through a list of points. The first
+    point of the path is fixed and the end is free. Improves the path with
+    2-opt (reversal of a sub-path) and Or-opt (moving a sub-path of up to
+    MAX_OR_OPT_LEN points, possibly reversed) moves, considering only moves
+    which join points to their numNeighbors nearest neighbors.
+
+    Moves are searched from a queue of points whose path neighbors changed
+    (don't look bits), so each pass only revisits the changed parts of the
+    path. The search stops at a local optimum or when timeBudget (secs) is
+    used up.
+    """
+
+    def __init__(self,ptList,order,numNeighbors=DEFAULT_NUM_NEIGHBORS,timeBudget=None):
+        self.xList = [float(p[0]) for p in ptList]
+        self.yList = [float(p[1]) for p in ptList]
+        self.order = list(order)
+        self.pos = [None]*len(self.xList)
+        for k, i in enumerate(self.order):
+            self.pos[i] = k
+        self.timeBudget = timeBudget
+        self.startTime = time.time()
+        grid = PointGrid(ptList)
+        self.neighborList = []
+        for i in range(len(self.xList)):
+            nearList = grid.getNearestList(self.xList[i],self.yList[i],numNeighbors,exclude=i)
+            self.neighborList.append([(self.dist(i,j),j) for j in nearList])
+
+    def dist(self,i,j):
+        return math.hypot(self.xList[i]-self.xList[j], self.yList[i]-self.yList[j])
+
+    def edgeLen(self,k):
+        """
+        Length of the path edge leaving position k (0 at the end of the path).
+        """
+        order = self.order
+        if k+1 >= len(order):
+            return 0.0
+        return self.dist(order[k],order[k+1])
+
+    def linkLen(self,i,k):
+        """
+        Length of an edge from point i to the point at position k (0 past the
+        end of the path).
+        """
+        if k >= len(self.order):
+            return 0.0
+        return self.dist(i,self.order[k])
+
+    def run(self):
+        """
+        Runs the local search and returns the improved order.
+        """
+        numPts = len(self.order)
+        if numPts < 3:
+            return list(self.order)
+        queue = collections.deque(self.order)
+        inQueue = [True]*numPts
+        count = 0
+        while queue:
+            count += 1
+            if self.timeBudget is not None and count % TIME_CHECK_INTERVAL == 0:
+                if time.time() - self.startTime > self.timeBudget:
+                    break
+            i = queue.popleft()
+            inQueue[i] = False
+            changedList = self.improvePoint(i)
+            if changedList:
+                for j in changedList + [i]:
+                    if not inQueue[j]:
+                        queue.append(j)
+                        inQueue[j] = True
+        return list(self.order)
+
+    def improvePoint(self,i):
+        """
+        Applies first improving move found involving point i. Returns list of
+        points with new path neighbors (empty list if there is no move).
+        """
+        changedList = self.tryTwoOpt(i)
+        if not changedList:
+            changedList = self.tryOrOpt(i)
+        return changedList
+
+    def tryTwoOpt(self,i):
+        order, pos = self.order, self.pos
+        k = pos[i]
+        # Join i to a neighbor j, replacing the edge leaving i or the edge
+        # entering i. Only neighbors closer than the replaced edge can give a
+        # shorter path.
+        for a0, b0 in ((k, 0), (k-1, -1)):
+            if a0 < 0:
+                continue
+            removedLen = self.edgeLen(a0)
+            for distIJ, j in self.neighborList[i]:
+                if distIJ >= removedLen:
+                    break
+                a, b = a0, pos[j] + b0
+                if a == b or b < 0:
+                    continue
+                a, b = min(a,b), max(a,b)
+                gain = self.edgeLen(a) + self.edgeLen(b) - self.dist(order[a],order[b])
+                gain -= self.linkLen(order[a+1],b+1)
+                if gain > MIN_GAIN:
+                    return self.applyTwoOpt(a,b)
+        return []
+
+    def applyTwoOpt(self,a,b):
+        """
+        Reverses the sub-path between positions a+1 and b (inclusive).
+        """
+        order, pos = self.order, self.pos
+        changedList = [order[a], order[a+1], order[b]]
+        if b+1 < len(order):
+            changedList.append(order[b+1])
+        order[a+1:b+1] = order[a+1:b+1][::-1]
+        for k in range(a+1,b+1):
+            pos[order[k]] = k
+        return changedList
+
+    def tryOrOpt(self,i):
+        order, pos = self.order, self.pos
+        numPts = len(order)
+        s = pos[i]
+        if s == 0:
+            return []
+        for segLen in range(1,MAX_OR_OPT_LEN+1):
+            e = s + segLen - 1
+            if e >= numPts:
+                break
+
+            first, last = order[s], order[e]
+            removeGain = self.edgeLen(s-1) + self.edgeLen(e) - self.linkLen(order[s-1],e+1)
+            if removeGain <= MIN_GAIN:
+                continue
+            candList = set()
+            for distIJ, j in self.neighborList[first] + self.neighborList[last]:
+                if distIJ >= removeGain:
+                    continue
+                m = pos[j]
+                candList.update((m-1, m))
+            for k in candList:
+                if k < 0 or s-1 <= k <= e:
+                    continue
+                prev = order[k]
+                baseLen = self.edgeLen(k)
+                forwardCost = self.dist(prev,first) + self.linkLen(last,k+1) - baseLen
+                reverseCost = self.dist(prev,last) + self.linkLen(first,k+1) - baseLen
+                if removeGain - min(forwardCost,reverseCost) > MIN_GAIN:
+                    return self.applyOrOpt(s,e,k,reverseCost < forwardCost)
+        return []
+
+    def applyOrOpt(self,s,e,k,reverse):
+        """
+        Moves sub-path at positions s..e to between positions k and k+1.
+        """
+        order, pos = self.order, self.pos
+        changedList = [order[s-1], order[s], order[e], order[k]]
+        for m in (e+1, k+1):
+            if m < len(order):
+                changedList.append(order[m])
+        seg = order[s:e+1]
+        if reverse:
+            seg.reverse()
+        if k < s:
+            order[k+1:e+1] = seg + order[k+1:s]
+            lo, hi = k+1, e+1
+        else:
+            order[s:k+1] = order[e+1:k+1] + seg
+            lo, hi = s, k+1
+        for m in range(lo,hi):
+            pos[order[m]] = m
+        return changedList
+
+
+# Utility functions
+# -----------------------------------------------------------------------------
+
+def getOrder(ptList,method='optimize',startIndex=0,timeBudget=None,numNeighbors=DEFAULT_NUM_NEIGHBORS):
+    """
+    Returns list of indices giving an order of the points in ptList which
+    reduces the total travel between them. The path starts at ptList[startIndex].
+
+    method = 'nearest'  - nearest neighbor order
+             'optimize' - nearest neighbor order improved by 2-opt and Or-opt
+                          moves until a local optimum or the timeBudget (secs)
+                          is used up.
+    """
+    if method not in ORDER_METHODS:
+        raise ValueError('unknown order method {0}'.format(method))
+    order = getNearestNeighborOrder(ptList,startIndex)
+    if method == 'optimize':
+        optimizer = PathOptimizer(ptList,order,numNeighbors,timeBudget)
+        order = optimizer.run()
+    return order
+
+def getNearestNeighborOrder(ptList,startIndex=0):
+    """
+    Returns order of visiting the points in ptList, starting at startIndex and
+    always moving to the nearest point not yet visited.
+    """
+    if not ptList:
+        return []
+    grid = PointGrid(ptList)
+    order = [startIndex]
+    grid.remove(startIndex)
+    for k in range(len(ptList)-1):
+        i = order[-1]
+        i = grid.getNearest(grid.xList[i],grid.yList[i])
+        grid.remove(i)
+        order.append(i)
+    return order
+
+def getTaskOrder(entryPtLists,closedList,startPt,method='optimize',timeBudget=None):
+    """
+    Orders tasks, e.g. cuts of the connected components of a drawing, to
+    reduce rapid travel between them and chooses where each task starts.
+
+    entryPtLists = list of lists of points at which each task can be started
+    closedList   = list of flags, True for tasks which end where they start
+                   (closed loops) and False for tasks with two entry points
+                   which end at the other entry point (line strings)
+    startPt      = position of the tool before the first task
+
+    Returns list of (task index, entry index) pairs in cutting order.
+
+    The 'nearest' method always moves to the nearest entry point of the
+    remaining tasks. The 'optimize' method then improves the task order with
+    PathOptimizer, treating the tasks as points, and reselects the entry
+    points along the new order - the result is kept if it is shorter.
+    """
+    if method not in ORDER_METHODS:
+        raise ValueError('unknown order method {0}'.format(method))
+    entryArrayList = [numpy.array([p[:2] for p in ptList],dtype=float) for ptList in entryPtLists]
+    plan = getNearestTaskPlan(entryPtLists,closedList,startPt)
+    if method == 'optimize' and len(plan) > 2:
+        ptList = [startPt[:2]]
+        for i, j in plan:
+            if closedList[i]:
+                ptList.append(entryPtLists[i][j][:2])
+            else:
+                ptList.append(tuple(entryArrayList[i].mean(axis=0)))
+        order = PathOptimizer(ptList,range(len(ptList)),timeBudget=timeBudget).run()
+        taskOrder = [plan[k-1][0] for k in order[1:]]
+        newPlan = getTaskPlanEntries(taskOrder,entryArrayList,closedList,startPt)
+        newLength = getTaskPlanLength(newPlan,entryPtLists,closedList,startPt)
+        if newLength < getTaskPlanLength(plan,entryPtLists,closedList,startPt):
+            plan = newPlan
+    return plan
+
+def getNearestTaskPlan(entryPtLists,closedList,startPt):
+    """
+    Returns nearest neighbor task plan for getTaskOrder. The entry points of
+    all tasks are kept in a PointGrid from which those of finished tasks are
+    removed.
+    """
+    ptList = []
+    ownerList = []
+    for i, entryPtList in enumerate(entryPtLists):
+        for j, p in enumerate(entryPtList):
+            ptList.append(p)
+            ownerList.append((i,j))
+    grid = PointGrid(ptList)
+    firstIndexList = []
+    cnt = 0
+    for entryPtList in entryPtLists:
+        firstIndexList.append(cnt)
+        cnt += len(entryPtList)
+    plan = []
+    pos = startPt
+    while len(plan) < len(entryPtLists):
+        i, j = ownerList[grid.getNearest(pos[0],pos[1])]
+        for k in range(firstIndexList[i],firstIndexList[i]+len(entryPtLists[i])):
+            grid.remove(k)
+        plan.append((i,j))
+        pos = getTaskExitPt(entryPtLists[i],closedList[i],j)
+    return plan
+
+def getTaskPlanEntries(taskOrder,entryArrayList,closedList,startPt):
+    """
+    Returns task plan for tasks in taskOrder, starting each task at the entry
+    point nearest to the end of the previous one.
+    """
+    plan = []
+    pos = startPt
+    for i in taskOrder:
+        entryArray = entryArrayList[i]
+        distSqr = (entryArray[:,0] - pos[0])**2 + (entryArray[:,1] - pos[1])**2
+        j = int(distSqr.argmin())
+        plan.append((i,j))
+        pos = getTaskExitPt(entryArray,closedList[i],j)
+    return plan
+
+def getTaskPlanLength(plan,entryPtLists,closedList,startPt):
+    """
+    Returns total rapid travel of task plan.
+    """
+    length = 0.0
+    pos = startPt
+    for i, j in plan:
+        p = entryPtLists[i][j]
+        length += math.hypot(p[0]-pos[0], p[1]-pos[1])
+        pos = getTaskExitPt(entryPtLists[i],closedList[i],j)
+    return length
+
+def getTaskExitPt(entryPtList,closed,j):
+    if closed or len(entryPtList) < 2:
+        return entryPtList[j]
+    else:
+        return entryPtList[1-j]
+
+def getContainmentDepthList(ringList,testPtList,ringIndexList=None):
+    """
+    Returns list with the number of closed rings (lists of x,y points) in
+    ringList which contain each of the points in testPtList. When given,
+    ringIndexList[k] is the index of the ring which testPtList[k] belongs to
+    (or None) and that ring isn't counted.
+
+    The rings are indexed with an STRtree so that each point is only tested
+    against the rings whose bounding boxes contain it.
+    """
+    polygonList = []
+    for ring in ringList:
+        poly = geometry.Polygon([p[:2] for p in ring])
+        if not poly.is_valid:
+            poly = poly.buffer(0)
+        polygonList.append(poly)
+    indexDict = dict((id(poly),i) for i, poly in enumerate(polygonList) if not poly.is_empty)
+    if not indexDict:
+        return [0]*len(testPtList)
+    tree = STRtree([poly for poly in polygonList if id(poly) in indexDict])
+    preparedDict = {}
+    depthList = []
+    for k, p in enumerate(testPtList):
+        point = geometry.Point(p[0],p[1])
+        depth = 0
+        for poly in tree.query(point):
+            i = indexDict[id(poly)]
+            if ringIndexList is not None and ringIndexList[k] == i:
+                continue
+            if i not in preparedDict:
+                preparedDict[i] = prepared.prep(poly)
+            if preparedDict[i].contains(point):
+                depth += 1
+        depthList.append(depth)
+    return depthList
+
+def getPathLength(ptList,order=None,startPt=None):
+    """
+    Returns length of the path through ptList in the given order (default
+    the list order), from startPt if given.
+    """
+    if order is None:
+        order = range(len(ptList))
+    pathPtList = [ptList[i] for i in order]
+    if startPt is not None:
+        pathPtList.insert(0,startPt)
+    length = 0.0
+    for p, q in zip(pathPtList[:-1],pathPtList[1:]):
+        length += math.hypot(q[0]-p[0], q[1]-p[1])
+    return length
+
+def getStartCondIndex(ptList,startCond):
+    """
+    Returns index of the point with the minimum or maximum x or y coordinate as
+    given by startCond ('minX', 'maxX', 'minY' or 'maxY').
+    """
+    if startCond in ('minX', 'maxX'):
+        coordList = [p[0] for p in ptList]
+    elif startCond in ('minY', 'maxY'):
+        coordList = [p[1] for p in ptList]
+    else:
+        raise ValueError('unknown startCond {0}'.format(startCond))
+    if startCond.startswith('min'):
+        return coordList.index(min(coordList))
+    else:
+        return coordList.index(max(coordList))
+
+def getDefaultCellSize(xList,yList):
+    """
+    Returns grid cell size giving about two points per cell for points spread
+    over their bounding box.
+    """
+    numPts = max(len(xList),1)
+    if numPts < 2:
+        return 1.0
+    width = max(xList) - min(xList)
+    height = max(yList) - min(yList)
+    area = max(width*height, max(width,height)**2/numPts)
+    if area <= 0:
+        return 1.0
+    return math.sqrt(2.0*area/numPts)
+
+
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    import random
+
+    random.seed(5)
+    ptList = [(random.uniform(0,20),random.uniform(0,10)) for i in range(5000)]
+
+    for method in ('list', 'nearest', 'optimize'):
+        t0 = time.time()
+        if method == 'list':
+            order = range(len(ptList))
+        else:
+            order = getOrder(ptList,method)
+        t1 = time.time()
+        print('{0:>8}: length {1:1.2f}, time {2:1.2f}s'.format(method,getPathLength(ptList,order),t1-t0))
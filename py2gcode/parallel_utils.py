@@ -0,0 +1,93 @@
+"""
+
+Copyright 2014 IO Rodeo Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+from __future__ import print_function
+import os
+import multiprocessing
+import progress_utils
+
+CHUNKS_PER_WORKER = 4
+
+# Task function and argument list for the current parallelMap call. Worker
+# processes are forked and inherit these, so neither func nor the arguments
+# are pickled. This also keeps parameter dicts, whose iteration order ends up
+# in the program comments, identical to those in the parent process.
+_taskFunc = None
+_taskArgList = None
+
+
+def parallelMap(func,argList,workers=1,progress=None,stage='tasks'):
+    """
+    Returns [func(arg) for arg in argList]. When workers > 1 the calls are
+    distributed over a pool of forked worker processes and the results, which
+    must be picklable, are returned in the order of argList - so the output
+    is the same as for the serial case.
+
+    Runs serially when workers <= 1, when there are fewer than two tasks or
+    when worker processes can't be forked on this platform.
+    """
+    global _taskFunc
+    global _taskArgList
+    argList = list(argList)
+    numArgs = len(argList)
+    progress = progress_utils.getProgress(progress)
+    if workers <= 1 or numArgs < 2 or not hasattr(os,'fork'):
+        resultList = []
+        for i, arg in enumerate(argList):
+            resultList.append(func(arg))
+            progress.update(stage,i+1,numArgs)
+        return resultList
+
+    _taskFunc, _taskArgList = func, argList
+    chunkSize = max(1, numArgs//(CHUNKS_PER_WORKER*workers))
+    resultList = []
+    try:
+        pool = multiprocessing.Pool(min(workers,numArgs))
+        try:
+            for i, result in enumerate(pool.imap(_runTask,xrange(numArgs),chunkSize)):
+                resultList.append(result)
+                progress.update(stage,i+1,numArgs)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        _taskFunc, _taskArgList = None, None
+    return resultList
+
+def getNumWorkers(workers=1):
+    """
+    Returns number of worker processes. None or values < 1 mean use all cpus.
+    """
+    if workers is None or workers < 1:
+        try:
+            workers = multiprocessing.cpu_count()
+        except NotImplementedError:
+            workers = 1
+    return int(workers)
+
+def popWorkers(param):
+    """
+    Removes number of workers (if any) from routine parameter dict and returns
+    it. It is removed so that the output doesn't depend on the number of
+    workers and so that it isn't passed on to sub-routines. The default is 1
+    (serial).
+    """
+    return getNumWorkers(param.pop('workers',1))
+
+def _runTask(i):
+    return _taskFunc(_taskArgList[i])
@@ -0,0 +1,130 @@
+"""
+
+Copyright 2014 IO Rodeo Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+from __future__ import print_function
+import sys
+import time
+
+DEFAULT_MAX_RATE = 10.0
+
+
+class Progress(object):
+    """
+    Progress reporter for long running operations. Callers report progress
+    with update(stage, done, total) and updates are throttled so that report
+    is called at most maxRate times per second.  The first and last update of
+    each stage are always reported.
+
+    The base class is silent - subclasses override report. Callers in hot
+    loops can skip update altogether when enabled is False.
+    """
+
+    enabled = True
+
+    def __init__(self,maxRate=DEFAULT_MAX_RATE):
+        self.minInterval = 1.0/float(maxRate)
+        self.stage = None
+        self.stageStartTime = None
+        self.lastReportTime = None
+
+    def update(self,stage,done,total=None):
+        currTime = time.time()
+        if stage != self.stage:
+            self.stage = stage
+            self.stageStartTime = currTime
+            self.lastReportTime = None
+        isFirst = self.lastReportTime is None
+        isLast = (total is not None) and (done >= total)
+        if isFirst or isLast or (currTime - self.lastReportTime >= self.minInterval):
+            self.lastReportTime = currTime
+            self.report(stage,done,total,currTime - self.stageStartTime)
+
+    def report(self,stage,done,total,elapsed):
+        """
+        stage   = name of stage
+        done    = number of items done
+        total   = total number of items (None if unknown)
+        elapsed = time since start of stage in secs
+        """
+        pass
+
+
+class NullProgress(Progress):
+    """
+    Progress reporter which ignores all updates, w/o timing them. Used when no
+    progress reporter is given.
+    """
+
+    enabled = False
+
+    def update(self,stage,done,total=None):
+        pass
+
+
+class PrintProgress(Progress):
+    """
+    Prints progress reports to stream (default sys.stderr).
+    """
+
+    def __init__(self,maxRate=DEFAULT_MAX_RATE,stream=None):
+        super(PrintProgress,self).__init__(maxRate=maxRate)
+        self.stream = stream
+
+    def report(self,stage,done,total,elapsed):
+        stream = self.stream if self.stream is not None else sys.stderr
+        if total is None:
+            msg = '{0}: {1} ({2:1.2f}s)'.format(stage,done,elapsed)
+        else:
+            msg = '{0}: {1}/{2} ({3:1.2f}s)'.format(stage,done,total,elapsed)
+        print(msg,file=stream)
+
+
+class CallbackProgress(Progress):
+    """
+    Calls func(stage, done, total, elapsed) for each progress report.
+    """
+
+    def __init__(self,func,maxRate=DEFAULT_MAX_RATE):
+        super(CallbackProgress,self).__init__(maxRate=maxRate)
+        self.func = func
+
+    def report(self,stage,done,total,elapsed):
+        self.func(stage,done,total,elapsed)
+
+
+# Utility functions
+# -----------------------------------------------------------------------------
+
+def getProgress(progress=None):
+    """
+    Returns progress if given, otherwise the shared NullProgress reporter.
+    """
+    if progress is None:
+        return NULL_PROGRESS
+    else:
+        return progress
+
+def popProgress(param):
+    """
+    Removes progress reporter (if any) from routine parameter dict and returns
+    it, or a silent reporter. The reporter is removed so that it isn't dumped
+    in comments or passed on to sub-routines.
+    """
+    return getProgress(param.pop('progress',None))
+
+
+NULL_PROGRESS = NullProgress()
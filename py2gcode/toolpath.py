@@ -0,0 +1,342 @@
+"""
+
+Copyright 2014 IO Rodeo Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+from __future__ import print_function
+import numpy
+import gcode_cmd
+
+# Motion type codes. Rows with MOTION_NONE are stored in the side table.
+MOTION_NONE = 0
+MOTION_RAPID = 1
+MOTION_LINEAR = 2
+MOTION_ARC_XY_CW = 3
+MOTION_ARC_XY_CCW = 4
+MOTION_ARC_XZ_CW = 5
+MOTION_ARC_XZ_CCW = 6
+MOTION_ARC_YZ_CW = 7
+MOTION_ARC_YZ_CCW = 8
+
+AXIS_KEYS = ('x', 'y', 'z')
+OFFSET_KEYS = ('i', 'j', 'k')
+
+MOTION_TO_CLASS = {
+        MOTION_RAPID      : gcode_cmd.RapidMotion,
+        MOTION_LINEAR     : gcode_cmd.LinearFeed,
+        MOTION_ARC_XY_CW  : gcode_cmd.HelicalMotionXY,
+        MOTION_ARC_XY_CCW : gcode_cmd.HelicalMotionXY,
+        MOTION_ARC_XZ_CW  : gcode_cmd.HelicalMotionXZ,
+        MOTION_ARC_XZ_CCW : gcode_cmd.HelicalMotionXZ,
+        MOTION_ARC_YZ_CW  : gcode_cmd.HelicalMotionYZ,
+        MOTION_ARC_YZ_CCW : gcode_cmd.HelicalMotionYZ,
+        }
+
+MOTION_TO_DIRECTION = {
+        MOTION_ARC_XY_CW  : 'cw',
+        MOTION_ARC_XY_CCW : 'ccw',
+        MOTION_ARC_XZ_CW  : 'cw',
+        MOTION_ARC_XZ_CCW : 'ccw',
+        MOTION_ARC_YZ_CW  : 'cw',
+        MOTION_ARC_YZ_CCW : 'ccw',
+        }
+
+CLASS_AND_DIRECTION_TO_MOTION = dict(
+        ((cls, MOTION_TO_DIRECTION.get(code)), code)
+        for code, cls in MOTION_TO_CLASS.iteritems()
+        )
+
+DEFAULT_CAPACITY = 1024
+
+
+class ToolPath(object):
+    """
+    Array backed tool path. Motion commands (RapidMotion, LinearFeed and the
+    HelicalMotion commands) are stored column-wise in a motion type code array
+    and float64 arrays for the x,y,z axes and the i,j,k arc offsets. Missing
+    words are stored as NaN.  Everything else - non-motion commands, rotary
+    and uvw axes, turns (p) and comment flags - goes in a sparse side table
+    keyed by row.
+
+    A ToolPath can be added to a GCodeProg and vice versa, and converts
+    losslessly to and from lists of gcode_cmd objects.
+    """
+
+    def __init__(self,capacity=DEFAULT_CAPACITY):
+        capacity = max(int(capacity),1)
+        self.size = 0
+        self._codes = numpy.zeros((capacity,),dtype=numpy.uint8)
+        self._axes = numpy.empty((capacity,3))
+        self._offsets = numpy.empty((capacity,3))
+        self.sideTable = {}
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def capacity(self):
+        return self._codes.shape[0]
+
+    @property
+    def codes(self):
+        return self._codes[:self.size]
+
+    @property
+    def axes(self):
+        return self._axes[:self.size]
+
+    @property
+    def offsets(self):
+        return self._offsets[:self.size]
+
+    @property
+    def listOfCmds(self):
+        return [self.getCmd(i) for i in range(self.size)]
+
+    @classmethod
+    def fromProg(cls,prog):
+        toolPath = cls(capacity=len(prog.listOfCmds))
+        toolPath.add(prog)
+        return toolPath
+
+    def toProg(self):
+        prog = gcode_cmd.GCodeProg()
+        prog.listOfCmds = self.listOfCmds
+        return prog
+
+    def reserve(self,capacity):
+        """
+        Grows arrays so that they can hold at least capacity rows.
+        """
+        if capacity <= self.capacity:
+            return
+        newCapacity = max(capacity, 2*self.capacity)
+        codes = numpy.zeros((newCapacity,),dtype=numpy.uint8)
+        axes = numpy.empty((newCapacity,3))
+        offsets = numpy.empty((newCapacity,3))
+        codes[:self.size] = self.codes
+        axes[:self.size] = self.axes
+        offsets[:self.size] = self.offsets
+        self._codes, self._axes, self._offsets = codes, axes, offsets
+
+    def add(self,obj,comment=False):
+        """
+        Adds a command, a GCodeProg or another ToolPath.
+        """
+        if isinstance(obj,gcode_cmd.GCodeCmd):
+            if comment:
+                obj.comment = True
+            self.addCmd(obj)
+        elif isinstance(obj,ToolPath):
+            self.addToolPath(obj)
+        else:
+            listOfCmds = obj.listOfCmds
+            self.reserve(self.size + len(listOfCmds))
+            for cmd in listOfCmds:
+                self.addCmd(cmd)
+
+    def addCmd(self,cmd):
+        self.reserve(self.size + 1)
+        i = self.size
+        code, extra = getMotionCodeAndExtra(cmd)
+        self._codes[i] = code
+        if code == MOTION_NONE:
+            self._axes[i] = numpy.nan
+            self._offsets[i] = numpy.nan
+            self.sideTable[i] = cmd
+        else:
+            motionDict = cmd.motionDict
+            self._axes[i] = [getFloatOrNan(motionDict.get(k)) for k in AXIS_KEYS]
+            self._offsets[i] = [getFloatOrNan(motionDict.get(k)) for k in OFFSET_KEYS]
+            if extra:
+                self.sideTable[i] = extra
+        self.size += 1
+
+    def addToolPath(self,toolPath):
+        n0, n1 = self.size, self.size + toolPath.size
+        self.reserve(n1)
+        self._codes[n0:n1] = toolPath.codes
+        self._axes[n0:n1] = toolPath.axes
+        self._offsets[n0:n1] = toolPath.offsets
+        for i, value in toolPath.sideTable.iteritems():
+            self.sideTable[n0+i] = value
+        self.size = n1
+
+    def addMotions(self,code,pointArray,keys=('x','y'),offsetArray=None):
+        """
+        Appends block of motions of the given type. The columns of pointArray
+        are the axes given by keys. For arcs offsetArray holds the i,j,k
+        offsets (NaN for missing values).
+        """
+        pointArray = numpy.asarray(pointArray,dtype=float)
+        if pointArray.ndim != 2 or pointArray.shape[1] != len(keys):
+            raise ValueError('pointArray must have shape (N,{0})'.format(len(keys)))
+        for k in keys:
+            if k not in AXIS_KEYS:
+                raise ValueError('unknown axis {0}'.format(k))
+        n0, n1 = self.size, self.size + pointArray.shape[0]
+        self.reserve(n1)
+        self._codes[n0:n1] = code
+        self._axes[n0:n1] = numpy.nan
+        for col, k in enumerate(keys):
+            self._axes[n0:n1,AXIS_KEYS.index(k)] = pointArray[:,col]
+        if offsetArray is None:
+            self._offsets[n0:n1] = numpy.nan
+        else:
+            self._offsets[n0:n1] = offsetArray
+        self.size = n1
+
+    def addRows(self,codes,axes,offsets):
+        """
+        Appends rows given as sequences of motion type codes, x,y,z axes and
+        i,j,k offsets (NaN for missing values). Rows with MOTION_NONE need a
+        side table entry.
+        """
+        n0, n1 = self.size, self.size + len(codes)
+        self.reserve(n1)
+        self._codes[n0:n1] = codes
+        self._axes[n0:n1] = axes
+        self._offsets[n0:n1] = offsets
+        self.size = n1
+
+    def addLinearFeeds(self,pointArray,keys=('x','y')):
+        self.addMotions(MOTION_LINEAR,pointArray,keys=keys)
+
+    def addRapidMotions(self,pointArray,keys=('x','y')):
+        self.addMotions(MOTION_RAPID,pointArray,keys=keys)
+
+    def getCmd(self,i):
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError('toolpath index out of range')
+        code = int(self._codes[i])
+        if code == MOTION_NONE:
+            return self.sideTable[i]
+        kwargs = {}
+        for k, v in zip(AXIS_KEYS, self._axes[i].tolist()):
+            if v == v:
+                kwargs[k] = v
+        if code not in (MOTION_RAPID, MOTION_LINEAR):
+            kwargs['d'] = MOTION_TO_DIRECTION[code]
+            for k, v in zip(OFFSET_KEYS, self._offsets[i].tolist()):
+                if v == v:
+                    kwargs[k] = v
+        extra = self.sideTable.get(i,{})
+        comment = False
+        for k, v in extra.iteritems():
+            if k == 'comment':
+                comment = v
+            else:
+                kwargs[k] = v
+        cmd = MOTION_TO_CLASS[code](**kwargs)
+        cmd.comment = comment
+        return cmd
+
+    def iterCmds(self):
+        for i in range(self.size):
+            yield self.getCmd(i)
+
+    def getMotionMask(self,code=None):
+        """
+        Returns boolean mask of motion rows, or of rows with given motion code.
+        """
+        if code is None:
+            return self.codes != MOTION_NONE
+        else:
+            return self.codes == code
+
+    def getNumBytes(self):
+        """
+        Returns number of bytes used by the arrays (excluding the side table).
+        """
+        return self._codes.nbytes + self._axes.nbytes + self._offsets.nbytes
+
+
+# Utility functions
+# -----------------------------------------------------------------------------
+
+def getMotionCodeAndExtra(cmd):
+    """
+    Returns the motion type code for the command and dict of extra values
+    (rotary/uvw axes, turns, comment flag) which go in the side table.
+    Commands which can't be stored losslessly in the arrays get MOTION_NONE.
+    """
+    cls = type(cmd)
+    direction = getattr(cmd,'direction',None)
+    try:
+        code = CLASS_AND_DIRECTION_TO_MOTION[(cls,direction)]
+    except KeyError:
+        return MOTION_NONE, None
+    if cmd.code != getDefaultCode(code) or cmd.commentStr != getDefaultCommentStr(code):
+        return MOTION_NONE, None
+    extra = {}
+    for k, v in cmd.motionDict.iteritems():
+        if v is None or k in AXIS_KEYS or k in OFFSET_KEYS:
+            continue
+        extra[k] = v
+    if cmd.comment:
+        extra['comment'] = cmd.comment
+    return code, extra
+
+def getDefaultCode(code):
+    if code == MOTION_RAPID:
+        return 'G0'
+    elif code == MOTION_LINEAR:
+        return 'G1'
+    elif MOTION_TO_DIRECTION[code] == 'cw':
+        return 'G2'
+    else:
+        return 'G3'
+
+def getDefaultCommentStr(code):
+    if code == MOTION_RAPID:
+        return 'Rapid motion'
+    elif code == MOTION_LINEAR:
+        return 'Linear feed'
+    plane = {
+            gcode_cmd.HelicalMotionXY: 'xy',
+            gcode_cmd.HelicalMotionXZ: 'xz',
+            gcode_cmd.HelicalMotionYZ: 'yz',
+            }[MOTION_TO_CLASS[code]]
+    return 'Helical motion {0}-plane, {1}'.format(plane, MOTION_TO_DIRECTION[code])
+
+def getFloatOrNan(value):
+    if value is None:
+        return numpy.nan
+    else:
+        return float(value)
+
+
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    import cnc_path
+
+    prog = gcode_cmd.GCodeProg()
+    prog.add(gcode_cmd.GenericStart())
+    prog.add(gcode_cmd.FeedRate(10.0))
+    prog.add(cnc_path.RectPath((0,0),(1,2),radius=0.2,helix=(0,-0.1)))
+    prog.add(cnc_path.CircPath((0,0),1.0,turns=2))
+
+    toolPath = ToolPath.fromProg(prog)
+    toolPath.addLinearFeeds(numpy.array([[0.0,0.0],[1.0,0.5],[2.0,1.0]]))
+    prog.add(gcode_cmd.LinearFeed(x=0.0,y=0.0))
+    prog.add(gcode_cmd.LinearFeed(x=1.0,y=0.5))
+    prog.add(gcode_cmd.LinearFeed(x=2.0,y=1.0))
+
+    print(toolPath.toProg())
+    print('lossless: {0}'.format(str(toolPath.toProg()) == str(prog)))
+    print('bytes per row: {0}'.format(toolPath.getNumBytes()/float(toolPath.capacity)))